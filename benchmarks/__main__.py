@@ -0,0 +1,147 @@
+"""CPU cost of the hot paths: python -m benchmarks [--filter NAME] [--quick] [--save] [--baseline PATH]
+[--max-regression PERCENT]
+
+Offline, no VK or database is needed, the cases are in benchmarks/hot_paths.py. Every case is timed in
+ROUNDS rounds of about ROUND_SECONDS and the best round is reported, allocations are the peak of memory
+traced by tracemalloc during one call after the timing, so caches filled by the first calls are not counted.
+The garbage collector is off while timing, like in timeit.
+
+The output is one line per case in a fixed order and format. A baseline is the JSON of a previous run,
+--save writes it, cases not run keep their old results, each line shows the change of ops/s against it. Baselines depend on the machine, save
+one before a change and compare after it on the same machine. --max-regression exits with 1 if any
+case got slower by more than the given percent.
+"""
+import gc
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tracemalloc
+
+from pathlib import Path
+
+from benchmarks.hot_paths import CASES, Case
+
+BASELINE = Path(__file__).parent / 'baseline.json'
+
+ROUNDS = 5
+ROUND_SECONDS = 0.2
+
+
+def _runner(operation):
+    """Function calling the operation n times, coroutine functions are awaited in one event loop run"""
+    if asyncio.iscoroutinefunction(operation):
+        loop = asyncio.new_event_loop()
+
+        async def calls(n):
+            for _ in range(n):
+                await operation()
+
+        return lambda n: loop.run_until_complete(calls(n)), loop
+
+    def calls(n):
+        for _ in range(n):
+            operation()
+
+    return calls, None
+
+
+def _timed(calls, n):
+    start = time.perf_counter()
+    calls(n)
+    return time.perf_counter() - start
+
+
+def measure(case: Case) -> dict:
+    operation = case.setup()
+    calls, loop = _runner(operation)
+
+    # Also the warm up of caches
+    first = _timed(calls, 1)
+    n = max(1, int(ROUND_SECONDS / max(first, 1e-7)))
+    rounds = ROUNDS if first < ROUND_SECONDS else max(1, min(ROUNDS, int(2 / first)))
+
+    # As timeit does, a collection of garbage left by other cases would land in a random round
+    gc.collect()
+    gc.disable()
+    try:
+        best = min(_timed(calls, n) / n for _ in range(rounds))
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    calls(1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if loop:
+        loop.close()
+
+    return {
+        'ops': case.per_call / best,
+        'us': best / case.per_call * 1e6,
+        'alloc': peak // case.per_call,
+    }
+
+
+def _alloc(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024 or unit == 'MiB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def line(name, result, base=None):
+    text = f'{name:<28} {result["ops"]:>14,.1f} ops/s {result["us"]:>12.3f} us/op {_alloc(result["alloc"]):>12}/op'
+    if base:
+        text += f' {(result["ops"] / base["ops"] - 1) * 100:>+8.1f}%'
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='CPU cost of the hot paths')
+    parser.add_argument('--filter', help='only cases whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='skip the cases taking seconds and GBs')
+    parser.add_argument('--baseline', type=Path, default=BASELINE, help=f'default {BASELINE}')
+    parser.add_argument('--save', action='store_true', help='write the results as the baseline')
+    parser.add_argument('--max-regression', type=float, help='exit with 1 if ops/s of a case dropped more, percent')
+    args = parser.parse_args()
+
+    # The cost of logging is measured by benchmarks.log_overhead, here records below WARNING are not created
+    logging.disable(logging.INFO)
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())['cases']
+
+    results, regressions = {}, []
+    for case in CASES:
+        if args.filter and args.filter not in case.name or args.quick and case.large:
+            continue
+
+        result = results[case.name] = measure(case)
+        base = None if args.save else baseline.get(case.name)
+        print(line(case.name, result, base), flush=True)
+
+        if base and args.max_regression is not None and result['ops'] < base['ops'] * (1 - args.max_regression / 100):
+            regressions.append(case.name)
+
+    if args.save:
+        # Cases left out by --filter or --quick keep their old results
+        args.baseline.write_text(json.dumps({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cases': dict(baseline, **results),
+        }, indent=2, sort_keys=True) + '\n')
+        print(f'Baseline has been saved to {args.baseline}')
+
+    if regressions:
+        print(f'Slower than the baseline by more than {args.max_regression}%: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Updates received per second by the long poll and the Callback API server:
+python -m benchmarks.callback [events] [long poll batch] [concurrent callbacks]
+
+Both talk to a local stand-in of VK over HTTP in this process: for the long poll it is a long poll server
+answering every request with a batch of new messages at once, for the Callback API it is a client POSTing
+one event per request like VK does, several of them at a time. The stand-in shares the CPU with the bot,
+so the numbers are a lower bound of both paths, compare them with each other.
+"""
+import sys
+import json
+import time
+import asyncio
+import aiohttp
+
+from aiohttp import web
+
+from vk_api.api import API
+from vk_api.sessions import TokenSession
+from vk_api.longpoll import BotsLongPoll
+from vk_api.callback import CallbackServer
+
+GROUP_ID = 1
+HOST = '127.0.0.1'
+LONGPOLL_PORT = 18081
+CALLBACK_PORT = 18082
+
+
+def event(number):
+    return {
+        'type': 'message_new',
+        'group_id': GROUP_ID,
+        'event_id': str(number),
+        'secret': 'secret',
+        'object': {
+            'date': 1546300800, 'from_id': number, 'id': number, 'out': 0, 'peer_id': number,
+            'text': 'Бросить монету', 'conversation_message_id': number, 'fwd_messages': [],
+            'important': False, 'random_id': 0, 'attachments': [], 'is_hidden': False,
+        },
+    }
+
+
+async def start_site(app, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, port).start()
+    return runner
+
+
+async def measure_longpoll(count, batch):
+    sent = 0
+
+    async def check(request):
+        nonlocal sent
+        updates = [event(number) for number in range(sent, min(sent + batch, count))]
+        sent += len(updates)
+        return web.Response(text=json.dumps({'ts': str(sent), 'updates': updates}))
+
+    app = web.Application()
+    app.router.add_get('/', check)
+    runner = await start_site(app, LONGPOLL_PORT)
+
+    session = TokenSession('token')
+    longpoll = BotsLongPoll(API(session), mode=2, group_id=GROUP_ID)
+    # Got from groups.getLongPollServer by the bot
+    longpoll.base_url, longpoll.key, longpoll.ts = f'http://{HOST}:{LONGPOLL_PORT}/', 'key', '0'
+
+    received = 0
+    start = time.perf_counter()
+    while received < count:
+        received += len(await longpoll.wait())
+    elapsed = time.perf_counter() - start
+
+    await session.driver.close()
+    await runner.cleanup()
+    return elapsed
+
+
+async def measure_callback(count, concurrency):
+    server = CallbackServer(API(None), GROUP_ID, 'confirmation', 'secret', HOST, CALLBACK_PORT, max_queue=count)
+    await server.prepare()
+
+    async def post(client, numbers):
+        for number in numbers:
+            async with client.post(f'http://{HOST}:{CALLBACK_PORT}/callback', data=json.dumps(event(number))) as response:
+                assert await response.text() == 'ok'
+
+    async def receive():
+        received = 0
+        while received < count:
+            received += len(await server.wait())
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as client:
+        start = time.perf_counter()
+        await asyncio.gather(receive(), *[post(client, range(offset, count, concurrency))
+                                          for offset in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    await server.stop()
+    return elapsed
+
+
+def main(count=20000, batch=100, concurrency=10):
+    longpoll = asyncio.run(measure_longpoll(count, batch))
+    callback = asyncio.run(measure_callback(count, concurrency))
+
+    for name, elapsed in ((f'long poll, {batch} per response', longpoll), (f'callback, {concurrency} concurrent', callback)):
+        print(f'{name:<28} {count / elapsed:>10,.0f} events/s {longpoll / elapsed:>6.2f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,107 @@
+"""The game against the in-memory database and against Postgres: python -m benchmarks.database [players] [rounds] [dsn]
+
+Every player bets, tosses the coin and asks for the balance, rounds times, through the handler table of
+main.py with real sessions, scores and leaderboards. Updates come in long poll sized batches, the replies are
+taken out of the execute pool after every batch, VK is not needed. Postgres is measured only if a dsn is
+given, use a scratch database: the schema is migrated and players with ids from PLAYER_BASE are added.
+"""
+import sys
+import time
+import asyncio
+import logging
+
+import main as bot
+
+from vk_api.api import API
+from vk_api.execute import Pool
+from vk_api.updates import Update, UpdateManager
+
+from vcoingame.top import Top
+from vcoingame.score import Score
+from vcoingame.config import Config
+from vcoingame.ledger import Ledger
+from vcoingame.database import Database, MEMORY
+from vcoingame.session import SessionList
+from vcoingame.migrations import Migrator
+from vcoingame.membership import Membership
+from vcoingame.leaderboard import Leaderboard
+from vcoingame.handler_context import HandlerContext
+
+from benchmarks.hot_paths import CONFIG, message_event
+
+PLAYER_BASE = 2_000_000_000 - 100_000
+DIALOG = ('Бросить монету', '1', 'Орёл', 'Баланс')
+BATCH = 25
+
+
+async def prepare(dsn, players, rounds):
+    """The database and the handler table of main.py with players who have enough to bet in every round,
+    and the updates of the game"""
+    database = await Database.create(dsn)
+    await Migrator(database).migrate()
+
+    config = Config.load(dict(CONFIG, DATABASE_URL=dsn))
+    api = API(None)
+    pool = Pool(api)
+    sessions = SessionList(database, config)
+    update_manager = UpdateManager(None, api)
+    Top.leaderboard = Leaderboard()
+
+    user_ids = range(PLAYER_BASE, PLAYER_BASE + players)
+    members = Membership(api, config.group_id, database)
+    for user_id in user_ids:
+        members.add(user_id)
+    members.loaded = True
+
+    keyboards = bot.build_keyboards()
+    HandlerContext.initial(config, members, pool, update_manager, sessions, None, None, keyboards,
+                           bot.build_templates(api, keyboards))
+    bot.register_handlers(update_manager)
+
+    for user_id in user_ids:
+        score, _ = await Score.get_or_create(database, user_id, config.start_max_bet)
+        await score.set(10 ** 9)
+
+    # Messages of a player keep their order, players take turns like they do in a long poll response
+    updates = [Update(message_event(user_id, text)) for _ in range(rounds) for text in DIALOG for user_id in user_ids]
+    return database, update_manager, pool, updates
+
+
+async def play(database, update_manager, pool, updates):
+    """Seconds the updates take until the last balance change is written, and the number of replies"""
+    replies = 0
+    start = time.perf_counter()
+    for offset in range(0, len(updates), BATCH):
+        await update_manager.process(updates[offset:offset + BATCH])
+        while True:
+            code, _ = await pool.compile()
+            if code == 'return [];':
+                break
+            replies += code.count('API.messages.send')
+    await Ledger.of(database).flush()
+    return time.perf_counter() - start, replies
+
+
+async def measure(dsn, players, rounds):
+    database, update_manager, pool, updates = await prepare(dsn, players, rounds)
+    elapsed, replies = await play(database, update_manager, pool, updates)
+    await database.close()
+    return len(updates), replies, elapsed
+
+
+def main(players=200, rounds=10, dsn=None):
+    logging.disable(logging.INFO)
+
+    base = None
+    for name, url in (('memory', MEMORY), ('postgres', dsn)):
+        if url is None:
+            print(f'{name:<10} skipped, no dsn given')
+            continue
+
+        count, replies, elapsed = asyncio.run(measure(url, players, rounds))
+        base = base or elapsed
+        print(f'{name:<10} {count / elapsed:>10,.0f} updates/s {replies:>8} replies {base / elapsed:>6.2f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]), *sys.argv[3:4])
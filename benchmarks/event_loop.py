@@ -0,0 +1,139 @@
+"""Updates per second and reply latency on the asyncio loop and on uvloop:
+python -m benchmarks.event_loop [updates] [long poll batch]
+
+The bot side is the real one: the long poll, the update manager and the API session with its aiohttp driver.
+A handler sends a reply for every message in a task of its own, like the pool does with its executes.
+VK is stood in for by a local long poll server and a local API endpoint in the same process. The next batch
+of messages is given once all replies to the previous one have come, so the latency of a reply, the time from
+the long poll response with the message to the API request with the reply, is not time spent in a backlog.
+"""
+import sys
+import json
+import time
+import asyncio
+
+from aiohttp import web
+
+from vk_api.api import API
+from vk_api.sessions import TokenSession
+from vk_api.longpoll import BotsLongPoll
+from vk_api.updates import UpdateManager, UpdateType
+
+from vcoingame import runtime
+
+HOST = '127.0.0.1'
+PORT = 18083
+
+
+def event(number):
+    return {
+        'type': 'message_new',
+        'object': {
+            'date': 1546300800, 'from_id': number, 'id': number, 'out': 0, 'peer_id': number,
+            'text': 'Бросить монету', 'conversation_message_id': number, 'fwd_messages': [],
+            'important': False, 'random_id': 0, 'attachments': [], 'is_hidden': False,
+        },
+    }
+
+
+class ReplyHandler:
+    TYPES = [UpdateType.MESSAGE_NEW]
+    final = True
+
+    def __init__(self, api):
+        self.api = api
+        self.tasks = set()
+
+    async def check(self, message):
+        return True
+
+    async def start(self, update):
+        task = asyncio.get_event_loop().create_task(self.api.messages.send(user_id=update.object.from_id, message='ok'))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+class StandIn:
+    def __init__(self, count, batch):
+        self.count = count
+        self.batch = batch
+        self.sent = 0
+        self.sent_at = {}
+        self.latencies = []
+        self.replied = asyncio.Event()
+        self.done = asyncio.Event()
+
+    async def check(self, request):
+        if self.sent >= self.count:
+            return web.Response(text=json.dumps({'ts': str(self.sent), 'updates': []}))
+
+        # Like the real server, the request is held until there is something new
+        await self.replied.wait()
+        self.replied.clear()
+
+        numbers = range(self.sent, min(self.sent + self.batch, self.count))
+        self.sent += len(numbers)
+        now = time.perf_counter()
+        for number in numbers:
+            self.sent_at[number] = now
+        return web.Response(text=json.dumps({'ts': str(self.sent), 'updates': [event(number) for number in numbers]}))
+
+    async def method(self, request):
+        data = await request.post()
+        self.latencies.append(time.perf_counter() - self.sent_at[int(data['user_id'])])
+        if len(self.latencies) == self.sent:
+            self.replied.set()
+        if len(self.latencies) == self.count:
+            self.done.set()
+        return web.Response(text='{"response":1}', content_type='application/json')
+
+    def application(self):
+        app = web.Application()
+        app.router.add_get('/longpoll', self.check)
+        app.router.add_post('/method/{name}', self.method)
+        return app
+
+
+async def measure(count, batch):
+    stand_in = StandIn(count, batch)
+    runner = web.AppRunner(stand_in.application(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+
+    session = TokenSession('token')
+    session.REQUEST_URL = f'http://{HOST}:{PORT}/method/'
+    api = API(session)
+
+    longpoll = BotsLongPoll(api, mode=2, group_id=1)
+    longpoll.base_url, longpoll.key, longpoll.ts = f'http://{HOST}:{PORT}/longpoll', 'key', '0'
+
+    update_manager = UpdateManager(longpoll)
+    handler = ReplyHandler(api)
+    update_manager.register_handler(handler)
+
+    start = time.perf_counter()
+    stand_in.replied.set()
+    serving = asyncio.ensure_future(update_manager.start())
+    await stand_in.done.wait()
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*handler.tasks)
+    serving.cancel()
+    await session.driver.close()
+    await runner.cleanup()
+
+    latencies = sorted(stand_in.latencies)
+    return elapsed, latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100]
+
+
+def main(count=5000, batch=100):
+    base = None
+    for loop in ('asyncio', 'uvloop'):
+        elapsed, median, p99 = runtime.run(measure(count, batch), loop)
+        base = base or elapsed
+        print(f'{loop:<8} {count / elapsed:>8,.0f} updates/s {base / elapsed:>6.2f}x '
+              f'latency p50 {median * 1000:>7.1f} ms p99 {p99 * 1000:>7.1f} ms')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
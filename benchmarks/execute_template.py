@@ -0,0 +1,45 @@
+"""Encoding of a reply with a static keyboard: python -m benchmarks.execute_template [calls]"""
+import sys
+import time
+
+from vk_api.api import API
+from vk_api.keyboard import Keyboard, ButtonColor
+
+from vcoingame.messages import Message
+
+
+def main(count=200_000):
+    keyboard = Keyboard()
+    keyboard.add_button('Бросить монету', color=ButtonColor.POSITIVE)
+    keyboard.add_button('Получить коины!', color=ButtonColor.POSITIVE)
+    keyboard.add_line()
+    keyboard.add_button('Повысить максимальную ставку', color=ButtonColor.NEGATIVE)
+    keyboard.add_line()
+    keyboard.add_button('Пополнить')
+    keyboard.add_button('Баланс')
+    keyboard.add_button('Вывести')
+    keyboard.add_line()
+    keyboard.add_button('Доска лидеров')
+    keyboard.add_button('Статистика')
+
+    send = API(None).messages.send.code
+    template = send.template(keyboard=keyboard.get_keyboard())
+
+    def function(user_id):
+        return send(user_id=user_id, message=Message.Score.format(user_id), keyboard=keyboard.get_keyboard())
+
+    def templated(user_id):
+        return template(user_id=user_id, message=Message.Score.format(user_id))
+
+    assert function(1) == templated(1)
+
+    for name, encode in (('function', function), ('template', templated)):
+        start = time.perf_counter()
+        for user_id in range(count):
+            encode(user_id)
+        elapsed = time.perf_counter() - start
+        print(f'{name:<8} {elapsed / count * 10 ** 6:>8.2f} us per call {count / elapsed:>12,.0f} calls/s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,209 @@
+"""Cases of the hot path suite, see benchmarks/__main__.py.
+
+Every case is set up by a function returning the operation, a plain or a coroutine function, which is
+called many times. per_call is the number of ops one call does, e.g. updates of a long poll response.
+"""
+import json
+import random
+
+from vk_api.api import API
+from vk_api.execute import Pool
+from vk_api.updates import Update, UpdateManager
+
+from vcoingame.top import Top
+from vcoingame.score import Score
+from vcoingame.config import Config
+from vcoingame.session import Session, SessionList
+from vcoingame.membership import Membership
+from vcoingame.memory_database import MemoryDatabase
+from vcoingame.leaderboard import Leaderboard, Snapshot, Board
+from vcoingame.handler_context import HandlerContext
+
+TOP_SIZES = (('10k', 10_000), ('100k', 100_000), ('1M', 1_000_000))
+
+# Menu commands of the handler table, each one answers with one reply
+COMMANDS = ('Баланс', 'Статистика', 'Доска лидеров', 'Получить коины!', 'Помощь')
+
+CONFIG = {
+    'GROUP_TOKEN': 'token', 'GROUP_ID': '1', 'MERCHANT_ID': '1', 'KEY': 'key', 'PAYLOAD': '1',
+    'DATABASE_URL': 'postgres://localhost/vcoingame', 'WIN_RATE': '45', 'RATE': '1', 'DONATION_LIMIT': '100000',
+    'START_MAX_BET': '10000000', 'MARKET_URL': 'https://vk.com/app?',
+}
+
+
+class Case:
+    def __init__(self, name, setup, per_call=1, large=False):
+        """
+        :param setup: function returning the operation
+        :param large: takes seconds and GBs, skipped by --quick
+        """
+        self.name = name
+        self.setup = setup
+        self.per_call = per_call
+        self.large = large
+
+
+def message_event(user_id, text):
+    return {
+        'type': 'message_new',
+        'object': {
+            'date': 1546300800, 'from_id': user_id, 'id': user_id, 'out': 0, 'peer_id': user_id, 'text': text,
+            'conversation_message_id': user_id, 'fwd_messages': [], 'important': False, 'random_id': 0,
+            'attachments': [], 'is_hidden': False,
+        },
+    }
+
+
+def longpoll_response(count=25):
+    return json.dumps({'ts': '1', 'updates': [message_event(user_id, COMMANDS[user_id % len(COMMANDS)])
+                                              for user_id in range(count)]})
+
+
+def setup_update_parse():
+    text = longpoll_response()
+
+    async def parse():
+        return await Update.process_updates(json.loads(text))
+
+    return parse
+
+
+def setup_routing():
+    """The handler table of main.py with sessions and leaderboards in memory and the in-memory database,
+    the first call, which is not timed, creates the players"""
+    import main
+
+    random.seed(0)
+    database = MemoryDatabase()
+    config = Config.load(CONFIG)
+    api = API(None)
+    pool = Pool(api)
+    update_manager = UpdateManager(None, api)
+
+    Top.leaderboard = Leaderboard()
+    Top.leaderboard.load([(user_id, random.randint(0, 10 ** 7), random.randint(0, 500), random.randint(0, 500),
+                           random.randint(0, 10 ** 8), random.randint(0, 10 ** 8)) for user_id in range(10_000)])
+    Top._rendered = {}
+
+    members = Membership(api, 1, database)
+    for user_id in range(25):
+        members.add(user_id)
+    members.loaded = True
+
+    keyboards = main.build_keyboards()
+    sessions = SessionList(database, config)
+    HandlerContext.initial(config, members, pool, update_manager, sessions, None, None, keyboards,
+                           main.build_templates(api, keyboards))
+    main.register_handlers(update_manager)
+
+    updates = [Update(event) for event in json.loads(longpoll_response())['updates']]
+
+    async def route():
+        await update_manager._process_updates(updates)
+        # Every update is answered, the replies are taken out as one execute
+        return await pool.compile()
+
+    return route
+
+
+def setup_function():
+    send = API(None).messages.send.code
+    keyboard = setup_keyboard()()
+
+    def call():
+        return send(user_id=123456789, message='Ваш баланс: 1000.000 VKC', keyboard=keyboard)
+
+    return call
+
+
+def setup_pool_compile():
+    pool = Pool(API(None))
+    template = API(None).messages.send.code.template(keyboard=setup_keyboard()())
+    requests = [template(user_id=user_id, message='Ваш баланс: 1000.000 VKC') for user_id in range(25)]
+
+    async def compile_25():
+        for request in requests:
+            pool.append(request)
+        return await pool.compile()
+
+    return compile_25
+
+
+def setup_keyboard():
+    import main
+
+    return main.build_keyboards()['main'].get_keyboard
+
+
+def setup_parse_score():
+    def parse():
+        return Score.parse_score('1,5')
+
+    return parse
+
+
+def setup_bet_keyboard():
+    async def generate():
+        return await Session.generate_bet_keyboard(10_000_000)
+
+    return generate
+
+
+def leaderboard_rows(count):
+    random.seed(0)
+    return [(user_id, random.randint(0, 10 ** 7), random.randint(0, 500), random.randint(0, 500),
+             random.randint(0, 10 ** 8), random.randint(0, 10 ** 8)) for user_id in range(count)]
+
+
+def snapshot_rows(count):
+    """Rows as the snapshot query returns them, ranks are not consistent with values, it does not matter"""
+    random.seed(0)
+    rows = []
+    for user_id in range(count):
+        row = {'user_id': user_id}
+        for board in Board:
+            row[f'{board.value}_position'] = random.randint(1, count)
+            row[f'{board.value}_value'] = random.randint(0, 10 ** 6)
+        rows.append(row)
+    return rows
+
+
+def setup_leaderboard_load(count):
+    def setup():
+        rows = leaderboard_rows(count)
+
+        def load():
+            leaderboard = Leaderboard()
+            leaderboard.load(rows)
+            return leaderboard
+
+        return load
+
+    return setup
+
+
+def setup_snapshot(count):
+    def setup():
+        rows = snapshot_rows(count)
+
+        def build():
+            return Snapshot(rows)
+
+        return build
+
+    return setup
+
+
+CASES = [
+    Case('update.parse[25]', setup_update_parse, per_call=25),
+    Case('update_manager.route[25]', setup_routing, per_call=25),
+    Case('function.call', setup_function),
+    Case('pool.compile[25]', setup_pool_compile),
+    Case('keyboard.get_keyboard', setup_keyboard),
+    Case('score.parse_score', setup_parse_score),
+    Case('session.bet_keyboard', setup_bet_keyboard),
+]
+for label, size in TOP_SIZES:
+    CASES.append(Case(f'top.load[{label}]', setup_leaderboard_load(size), large=size >= 1_000_000))
+for label, size in TOP_SIZES:
+    CASES.append(Case(f'top.snapshot[{label}]', setup_snapshot(size), large=size >= 1_000_000))
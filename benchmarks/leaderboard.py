@@ -0,0 +1,39 @@
+"""Leaderboard engine at 1M users: python -m benchmarks.leaderboard [users]"""
+import sys
+import time
+import random
+
+from vcoingame.leaderboard import Leaderboard, Board
+
+
+def measure(name, count, func):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<24} {count / elapsed:>12,.0f} ops/s {elapsed / count * 1e6:>10.2f} us/op')
+
+
+def main(users=1_000_000):
+    random.seed(0)
+    rows = [(user_id, random.randint(0, 10 ** 7), random.randint(0, 500), random.randint(0, 500),
+             random.randint(0, 10 ** 8), random.randint(0, 10 ** 8)) for user_id in range(users)]
+
+    leaderboard = Leaderboard()
+    start = time.perf_counter()
+    leaderboard.load(rows)
+    print(f'{"load":<24} {time.perf_counter() - start:>12.2f} s for {users:,} users')
+
+    user_ids = [random.randrange(users) for _ in range(100_000)]
+    it = iter(user_ids * 10)
+
+    measure('apply score', 100_000, lambda: leaderboard.apply(next(it), score=random.randint(-1000, 1000)))
+    measure('apply game (win+prize)', 100_000, lambda: leaderboard.apply(next(it), win=1, prize=2000))
+    measure('apply game (lose)', 100_000, lambda: leaderboard.apply(next(it), lose=1))
+    measure('position', 100_000, lambda: leaderboard.position(Board.SCORE, next(it)))
+    measure('top 10', 100_000, lambda: leaderboard.top(Board.PROFIT))
+    measure('new user', 100_000, lambda: leaderboard.create(users + next(it)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,49 @@
+"""Ledger writes of the game, group committed and one entry per transaction:
+python -m benchmarks.ledger [players] [rounds] [dsn]
+
+The game of benchmarks.database is played through the handler table of main.py, every bet and payout is
+a ledger entry. Handlers only queue their entries, which are written in the background while the next
+updates are handled; the time runs until the last one is written. The in-memory database is always
+measured, Postgres only if a dsn is given, use a scratch database as benchmarks.database does.
+"""
+import sys
+import random
+import asyncio
+import logging
+
+from vcoingame.ledger import Ledger
+from vcoingame.database import MEMORY
+
+from benchmarks.database import prepare, play
+
+MODES = (('group', 500), ('single', 1))
+
+
+async def measure(dsn, max_batch, players, rounds):
+    database, update_manager, pool, updates = await prepare(dsn, players, rounds)
+    ledger = Ledger.attach(database, max_batch)
+
+    elapsed, _ = await play(database, update_manager, pool, updates)
+    await database.close()
+    return len(updates), ledger.written, ledger.batches, elapsed
+
+
+def main(players=200, rounds=10, dsn=None):
+    logging.disable(logging.INFO)
+
+    for name, url in (('memory', MEMORY), ('postgres', dsn)):
+        if url is None:
+            print(f'{name:<10} skipped, no dsn given')
+            continue
+
+        base = None
+        for mode, max_batch in MODES:
+            random.seed(0)
+            count, written, batches, elapsed = asyncio.run(measure(url, max_batch, players, rounds))
+            base = base or elapsed
+            print(f'{name:<10} {mode:<8} {count / elapsed:>10,.0f} updates/s {written / elapsed:>10,.0f} entries/s '
+                  f'{written / max(batches, 1):>8.1f} entries/batch {base / elapsed:>6.2f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]), *sys.argv[3:4])
@@ -0,0 +1,90 @@
+"""Time spent on the event loop thread logging one game update: python -m benchmarks.log_overhead [updates]
+
+A game update writes about as many lines as the Score, Session and Statistics helpers do for one toss.
+Records are written to /dev/null and to a slow sink, which blocks every write for a moment like a pipe
+whose reader lags behind.
+"""
+import os
+import sys
+import time
+import logging
+
+from vcoingame.config import Config
+from vcoingame.logs import LogPipeline, KeyValueFormatter, TextFormatter
+
+score = logging.getLogger('vcoingame.score')
+session = logging.getLogger('vcoingame.session')
+statistics = logging.getLogger('vcoingame.statistics')
+
+
+class SlowSink:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def legacy_update(user_id):
+    session.info(f'Set state for {user_id}')
+    session.info(f'Set current bet for {user_id}')
+    statistics.info(f'Add bet {5000} for {user_id}')
+    score.info(f'Sub {5000} from {user_id}')
+    statistics.info(f'Add win for {user_id}')
+    statistics.info(f'Add prize {9000} for {user_id}')
+    score.info(f'Add {9000} to {user_id}')
+
+
+def structured_update(user_id):
+    session.info('Set state', extra={'user_id': user_id, 'state': 'GAME'})
+    session.info('Set current bet', extra={'user_id': user_id, 'bet': 5000})
+    statistics.info('Add bet', extra={'user_id': user_id, 'value': 5000})
+    score.info('Sub score', extra={'user_id': user_id, 'amount': 5000})
+    statistics.info('Add win', extra={'user_id': user_id})
+    statistics.info('Add prize', extra={'user_id': user_id, 'value': 9000})
+    score.info('Add score', extra={'user_id': user_id, 'amount': 9000})
+
+
+def measure(name, update, count, stop=None):
+    start = time.perf_counter()
+    for user_id in range(count):
+        update(user_id)
+    elapsed = time.perf_counter() - start
+
+    drained = elapsed
+    if stop:
+        stop()
+        drained = time.perf_counter() - start
+
+    print(f'{name:<36} {elapsed / count * 10 ** 6:>8.2f} us per update on the loop '
+          f'{drained / count * 10 ** 6:>9.2f} us until written')
+
+
+def main(count=20_000):
+    devnull = open(os.devnull, 'w')
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+
+    for sink_name, sink in (('/dev/null', devnull), ('slow sink', SlowSink(0.0001))):
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(TextFormatter())
+        root.handlers = [handler]
+        measure(f'{sink_name}: console, f-strings', legacy_update, count)
+
+        for name, sampling in (('queue, key=value', {}), ('queue, sampled 1/10', {'vcoingame': 10})):
+            config = Config({'debug': False, 'log_format': 'kv', 'log_levels': {}, 'log_sampling': sampling})
+            handler = logging.StreamHandler(sink)
+            handler.setFormatter(KeyValueFormatter())
+
+            logs = LogPipeline()
+            logs.start(config, handler)
+            measure(f'{sink_name}: {name}', structured_update, count, logs.stop)
+
+    devnull.close()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
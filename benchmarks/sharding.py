@@ -0,0 +1,160 @@
+"""Throughput of the sharded mode by number of workers: python -m benchmarks.sharding [updates] [max workers]
+
+Every update is handled by a stand-in of the game handlers: it changes the leaderboard, which is relayed
+to all other workers, renders a top 10, spends CPU_US of CPU and waits DB_MS for the database like
+a toss does, then sends the reply back to the ingress. Updates are routed by the real ingress code.
+
+Afterwards a worker is made to exit while it waits for its next message, the check fails unless the ingress
+restarts it and the restarted worker answers an update.
+"""
+import sys
+import time
+import asyncio
+
+from types import SimpleNamespace
+
+from vk_api.execute import Template
+from vk_api.updates import Update, UpdateType
+
+from vcoingame.top import Top
+from vcoingame.leaderboard import Leaderboard, Board
+from vcoingame.sharding import Shards, Worker, UPDATE
+
+CPU_US = 300
+DB_MS = 2
+# Seconds the restarted worker has to answer
+RESTART_TIMEOUT = 30
+
+
+class StandInManager:
+    def __init__(self, pool):
+        self.pool = pool
+        self.template = Template('messages.send', {'keyboard': '{"one_time":false,"buttons":[]}'})
+
+    async def process(self, updates):
+        for update in updates:
+            if getattr(update.object, 'exit', False):
+                raise SystemExit(1)
+
+            user_id = update.object.from_id
+            Top.apply(user_id, score=1000, win=1)
+            text = Top.render_top_10(Board.SCORE, 'Top')
+
+            deadline = time.perf_counter() + CPU_US / 10 ** 6
+            while time.perf_counter() < deadline:
+                pass
+            await asyncio.sleep(DB_MS / 1000)
+
+            self.pool.append(self.template(user_id=user_id, message=text))
+
+
+async def run_worker(shard, count, inbox, outbox):
+    link = Worker(shard, count, inbox, outbox)
+    Top.leaderboard = Leaderboard()
+    link.share_top()
+    await link.serve(StandInManager(link.pool), None, None)
+
+
+def worker(shard, count, inbox, outbox):
+    asyncio.run(run_worker(shard, count, inbox, outbox))
+
+
+class CountingPool:
+    def __init__(self):
+        self.count = 0
+        self.target = 0
+        self.done = asyncio.Event()
+
+    def expect(self, count):
+        self.count, self.target = 0, count
+        self.done.clear()
+
+    def append(self, request):
+        self.count += 1
+        if self.count >= self.target:
+            self.done.set()
+
+
+def updates(user_ids):
+    return [Update(type=UpdateType.MESSAGE_NEW, object=SimpleNamespace(from_id=user_id)) for user_id in user_ids]
+
+
+async def measure(workers, count):
+    shards = Shards(workers, worker)
+    shards.start()
+
+    pool = CountingPool()
+    serving = asyncio.ensure_future(shards.serve(pool))
+
+    # Waits until every worker has started
+    pool.expect(workers)
+    shards.route(updates(range(workers)))
+    await pool.done.wait()
+
+    pool.expect(count)
+    start = time.perf_counter()
+    shards.route(updates(range(count)))
+    await pool.done.wait()
+    elapsed = time.perf_counter() - start
+
+    serving.cancel()
+    shards.stop()
+
+    return elapsed
+
+
+async def restart(workers=2):
+    """Seconds from the death of worker 0 until its restarted process has answered an update"""
+    shards = Shards(workers, worker, min_uptime=0)
+    shards.start()
+
+    pool = CountingPool()
+    serving = asyncio.ensure_future(shards.serve(pool))
+    supervising = asyncio.ensure_future(shards.supervise(interval=0.1))
+
+    pool.expect(workers)
+    shards.route(updates(range(workers)))
+    await pool.done.wait()
+
+    # Its reader thread is waiting for the next message when it exits
+    dead = shards.processes[0]
+    shards.send(0, (UPDATE, Update(type=UpdateType.MESSAGE_NEW, object=SimpleNamespace(from_id=0, exit=True))))
+    while dead.is_alive():
+        await asyncio.sleep(0.01)
+    start = time.perf_counter()
+
+    while shards.processes[0] is dead:
+        await asyncio.sleep(0.01)
+    pool.expect(1)
+    shards.route(updates([0]))
+    try:
+        await asyncio.wait_for(pool.done.wait(), RESTART_TIMEOUT)
+        elapsed = time.perf_counter() - start
+    except asyncio.TimeoutError:
+        elapsed = None
+
+    serving.cancel()
+    supervising.cancel()
+    shards.stop()
+
+    return elapsed
+
+
+def main(count=2000, max_workers=4):
+    base = None
+    workers = 1
+    while workers <= max_workers:
+        elapsed = asyncio.run(measure(workers, count))
+        base = base or elapsed
+        print(f'{workers} workers {count / elapsed:>10,.0f} updates/s {base / elapsed:>6.2f}x')
+        workers *= 2
+
+    elapsed = asyncio.run(restart())
+    if elapsed is None:
+        print(f'restart   the restarted worker has not answered in {RESTART_TIMEOUT}s')
+        sys.exit(1)
+    print(f'restart   the restarted worker has answered {elapsed:.2f}s after the death')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,74 @@
+"""Startup with the phase latencies of a big deployment, sequential vs warm-up: python -m benchmarks.startup
+
+The last case is the warm-up with the members phase failing once, like a reconcile without a snapshot
+while VK is down: the bot serves as usual and is ready once the retry has finished.
+"""
+import time
+import asyncio
+import logging
+
+from main import after
+from vcoingame.startup import Warmup
+
+# Seconds each step takes against production sized data
+LATENCIES = {
+    'database': 0.3,
+    'longpoll': 0.2,
+    'leaderboards': 2.0,
+    'deposits': 0.1,
+    'members': 1.5,
+}
+RETRY_DELAY = 0.5
+
+
+def step(name, failures=0):
+    """:param failures: the first runs which raise after the latency"""
+    runs = 0
+
+    async def run():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(LATENCIES[name])
+        if runs <= failures:
+            raise ConnectionError(f'{name} has failed')
+    return run
+
+
+async def sequential():
+    start = time.monotonic()
+    for name in LATENCIES:
+        await step(name)()
+    elapsed = time.monotonic() - start
+    return elapsed, elapsed
+
+
+async def warmup(failing=()):
+    start = time.monotonic()
+
+    warmup = Warmup(retry_delay=RETRY_DELAY)
+    warmup.add('database', step('database'))
+    warmup.add('longpoll', step('longpoll'))
+    warmup.add('leaderboards', step('leaderboards'), requires=['database'], required=False)
+    warmup.add('deposits', step('deposits'), requires=['database'], required=False)
+    warmup.add('members', step('members', failures=int('members' in failing)), requires=['database'], required=False)
+
+    await warmup.start()
+    serving = time.monotonic() - start
+    # What main() does with the loops of optional phases
+    await after(warmup, 'members', asyncio.sleep(0))
+    await warmup.ready.wait()
+
+    return serving, time.monotonic() - start
+
+
+def main():
+    logging.disable(logging.ERROR)
+
+    cases = (('sequential', sequential), ('warm-up', warmup), ('members fail', lambda: warmup(['members'])))
+    for name, run in cases:
+        serving, ready = asyncio.run(run())
+        print(f'{name:<12} serving in {serving:>6.2f}s ready in {ready:>6.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Memory and build time of a Top snapshot: python -m benchmarks.top_snapshot [users]"""
+import sys
+import time
+import random
+import tracemalloc
+
+from vcoingame.leaderboard import Snapshot, Board
+
+
+class LegacyPosition:
+    """Position as it was stored before snapshots: one object with a __dict__ per user and board"""
+
+    def __init__(self, data: dict):
+        self.user_id = data.get('user_id')
+        self.number = data.get('position')
+        self.value = data.get('value')
+
+
+def legacy(rows):
+    tops = {board: {} for board in Board}
+    for board, top in tops.items():
+        for row in rows:
+            top[row['user_id']] = LegacyPosition({
+                'user_id': row['user_id'],
+                'position': row[f'{board.value}_position'],
+                'value': row[f'{board.value}_value']})
+    return tops
+
+
+def measure(name, build, rows):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(rows)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:<10} {elapsed:>8.2f} s {size / 2 ** 20:>10.1f} MiB {size / len(rows):>8.0f} B/user')
+    return result
+
+
+def main(users=100_000):
+    random.seed(0)
+    rows = []
+    for user_id in range(users):
+        row = {'user_id': user_id}
+        for board in Board:
+            row[f'{board.value}_position'] = random.randint(1, users)
+            row[f'{board.value}_value'] = random.randint(0, 10 ** 6) / 1000 \
+                if board in (Board.SCORE, Board.PROFIT) else random.randint(0, 1000)
+        rows.append(row)
+
+    measure('legacy', legacy, rows)
+    measure('snapshot', Snapshot, rows)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""Parsing of a 10k rows merchant response: python -m benchmarks.transactions [rows]"""
+import sys
+import time
+import random
+
+from vcoingame.coin_api import Transaction
+
+MERCHANT_ID = 1
+PAYLOAD = 42
+
+
+def legacy(rows, seen):
+    transactions = [Transaction.to_python(row) for row in rows]
+    return [transaction for transaction in transactions
+            if transaction.from_id != MERCHANT_ID and transaction.payload == PAYLOAD and transaction.id not in seen]
+
+
+def bulk(rows, seen):
+    return Transaction.parse(rows, MERCHANT_ID, PAYLOAD, seen)
+
+
+def main(count=10_000, repeat=20):
+    random.seed(0)
+    rows = [{
+        'id': tid,
+        'from_id': random.choice((MERCHANT_ID, random.randint(2, 10 ** 6))),
+        'to_id': MERCHANT_ID,
+        'amount': str(random.randint(1, 10 ** 9)),
+        'type': random.choice((3, 4)),
+        'payload': random.choice((PAYLOAD, 0, 0, 0)),
+        'external_id': 0,
+        'created_at': 1556000000 + tid,
+    } for tid in range(count)]
+    # Every transaction except the newest ones was already seen by previous polls
+    seen = set(range(count - 10))
+
+    assert [t.id for t in legacy(rows, seen)] == [t.id for t in bulk(rows, seen)]
+
+    for name, parse in (('legacy', legacy), ('bulk', bulk)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse(rows, seen)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f'{name:<8} {elapsed * 1000:>8.2f} ms per {count:,} rows {count / elapsed:>14,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
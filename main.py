@@ -1,212 +1,215 @@
-import os
-import random
+import signal
 import asyncio
 import logging
 
-#from logging.handlers import RotatingFileHandler
-
+from vk_api import tracing
 from vk_api.api import API
 from vk_api.execute import Pool
 from vk_api.sessions import TokenSession
 from vk_api.longpoll import BotsLongPoll
+from vk_api.callback import CallbackServer
 from vk_api.updates import UpdateManager
 from vk_api.keyboard import Keyboard, ButtonColor
 from vk_api.handlers import MessageHandler, GroupJoinHandler, GroupLeaveHandler
 
-from vcoingame.top import Top
+from vcoingame import economics, runtime
+from vcoingame.top import Top, Position
+from vcoingame.leaderboard import Board
 from vcoingame.score import Score
+from vcoingame.ledger import Ledger, Reason
 from vcoingame.states import State
+from vcoingame.config import Config
+from vcoingame.logs import LogPipeline
 from vcoingame.coin_api import CoinAPI
 from vcoingame.messages import Message
 from vcoingame.database import Database
+from vcoingame.migrations import Migrator
+from vcoingame.startup import Warmup
 from vcoingame.session import SessionList, Session
+from vcoingame.membership import Membership
 from vcoingame.handler_context import HandlerContext
-from vcoingame.transaction_manager import TransactionManager
-
+from vcoingame.deposits import DepositWatcher
+from vcoingame.broadcast import Broadcaster
+from vcoingame.sharding import Shards, ShardedUpdateManager, RemoteSessions, Worker
+from vcoingame.transfers import TransferOutbox, TransferStatus, InsufficientFunds
 
-logFormatter = logging.Formatter(
-    '%(levelname)-5s [%(asctime)s] %(name)s %(message)s',
-    datefmt='%H:%M:%S'
-)
-logger = logging.getLogger()
 
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logFormatter)
+logger = logging.getLogger('main')
 
-#file_handler = logging.handlers.TimedRotatingFileHandler('log.txt')
-#file_handler.setFormatter(logFormatter)
-
-logger.addHandler(console_handler)
-#logger.addHandler(file_handler)
-logger.setLevel(logging.DEBUG if os.environ.get("DEBUG") else logging.INFO)
+LEADERBOARDS = {
+    'Топ-10 по количеству выигранных игр': Board.WIN,
+    'Топ-10 по шансу выигрыша': Board.WINRATE,
+    'Топ-10 по внутриигровому балансу': Board.SCORE,
+    'Топ-10 по количество сыгранных игр': Board.GAMES,
+    'Топ-10 по количеству выигранных коинов': Board.PROFIT,
+}
+LEADERBOARD_TITLES = {board: title for title, board in LEADERBOARDS.items()}
 
 
 async def vcoinbank_handler(session: Session):
-    params = {'vk_id': session.user_id, 'referrer': os.environ.get('REFERRER')}
-    url = os.environ.get('MARKET_URL') + '&' + '&'.join(f'{k}={v}'for k, v in params.items())
+    params = {'vk_id': session.user_id, 'referrer': HandlerContext.config.referrer}
+    url = HandlerContext.config.market_url + '&' + '&'.join(f'{k}={v}'for k, v in params.items())
 
     msg = Message.VCoinBank.format(url)
-    HandlerContext.pool.append(
-        HandlerContext.api.messages.send.code(user_id=session.user_id, message=msg))
+    HandlerContext.pool.append(HandlerContext.templates['plain'](user_id=session.user_id, message=msg))
 
 
 async def not_group_member_handler(session: Session):
-    if session.user_id not in HandlerContext.group_members:
-        HandlerContext.pool.append(
-            HandlerContext.api.messages.send.code(user_id=session.user_id, message=Message.NotGroupMember))
+    members = HandlerContext.group_members
+    if members.loaded and session.user_id not in members:
+        HandlerContext.pool.append(HandlerContext.templates['not_group_member'](user_id=session.user_id))
 
 
 async def help_handler(session: Session):
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id,
-        message=Message.Commands,
-        keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['help'](user_id=session.user_id))
 
 
 async def balance_handler(session: Session):
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
+    HandlerContext.pool.append(HandlerContext.templates['main'](
         user_id=session.user_id,
-        message=Message.Score.format(session.score),
-        keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+        message=Message.Score.format(session.score)))
 
 
 async def leaderboards_handler_1(session: Session):
     await session.set_state(State.TOP)
 
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id,
-        message=Message.Leaderboards,
-        keyboard=HandlerContext.keyboards.get('top').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['leaderboards'](user_id=session.user_id))
 
 
 async def leaderboards_handler_2(session: Session):
-    text = session['message'].text
-    if 'выигранных игр' in text:
-        top_10 = session.top.WIN_TOP_10
-        position = session.top.win
-    elif 'шансу' in text:
-        top_10 = session.top.WINRATE_TOP_10
-        position = session.top.winrate
-    elif 'балансу' in text:
-        top_10 = session.top.SCORE_TOP_10
-        position = session.top.score
-    elif 'сыгранных' in text:
-        top_10 = session.top.GAMES_TOP_10
-        position = session.top.games
-    else:
-        top_10 = session.top.PROFIT_TOP_10
-        position = session.top.profit
+    title = session['message'].text
+    board = LEADERBOARDS.get(title)
+    if board is None:
+        board = Board.PROFIT
+        title = LEADERBOARD_TITLES[board]
 
-    msg = text + ':\n'
-    for top in top_10:
-        msg += Message.LeaderboardRow.format(top.user_id, top.number, top.value)
+    msg = Top.render_top_10(board, title)
 
+    position = session.top.position(board)
     if position and position.number > 10:
-        msg += Message.LeaderboardSeparator
-        msg += Message.LeaderboardMyPosition.format(position.value, position.number)
+        msg = ''.join((msg, Message.LeaderboardSeparator,
+                       Message.LeaderboardMyPosition.format(position.value, position.number)))
 
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id,
-        message=msg,
-        keyboard=HandlerContext.keyboards.get('top').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['top'](user_id=session.user_id, message=msg))
 
 
 async def statistics_handler(session: Session):
+    top = session.top
+    games, win, winrate, profit, score = top.games, top.win, top.winrate, top.profit, top.score
+    # A player the leaderboard does not know yet is shown at position 0, like a snapshot shows new players
+    games, win, profit, score = (position or Position(session.user_id, 0, 0)
+                                 for position in (games, win, profit, score))
+
     msg = Message.Statistics.format(
         session.max_bet / 1000,
-        session.top.games.value,
-        session.top.win.value,
-        session.top.games.value - session.top.win.value,
-        session.top.winrate.value if session.top.winrate else Message.WinrateError,
-        session.top.profit.value,
-
-        session.top.games.number,
-        session.top.win.number,
-        session.top.winrate.number if session.top.winrate else Message.WinrateError,
-        session.top.profit.number,
-        session.top.score.number
+        games.value,
+        win.value,
+        games.value - win.value,
+        winrate.value if winrate else Message.WinrateError,
+        profit.value,
+
+        games.number,
+        win.number,
+        winrate.number if winrate else Message.WinrateError,
+        profit.number,
+        score.number
     )
 
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id,
-        message=msg,
-        keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['main'](user_id=session.user_id, message=msg))
 
 
 async def withdraw_handler_1(session: Session):
     await session.set_state(State.WITHDRAW)
 
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id,
-        message=Message.Withdraw,
-        keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['withdraw'](user_id=session.user_id))
 
 
 async def withdraw_handler_2(session: Session):
     amount = Score.parse_score(session['message'].text)
     if amount > session.score.score:
-        HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-            user_id=session.user_id, message=Message.Bum))
+        HandlerContext.pool.append(HandlerContext.templates['bum'](user_id=session.user_id))
         return
 
-    await session.statistics.add_withdraw(amount)
+    message = session['message']
+    try:
+        transfer_id = await HandlerContext.transfers.withdraw(
+            session.user_id, amount, f'withdraw:{session.user_id}:{message.id}')
+    except InsufficientFunds:
+        HandlerContext.pool.append(HandlerContext.templates['bum'](user_id=session.user_id))
+        return
 
-    await session.score.sub(amount)
-    await HandlerContext.coin_api.send(session.user_id, amount)
+    if transfer_id is None:
+        return
+    session.score.apply(-amount)
 
-    msg = Message.Send.format(amount / 1000)
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id, message=msg, keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+    msg = Message.SendQueued.format(amount / 1000)
+    HandlerContext.pool.append(HandlerContext.templates['main'](user_id=session.user_id, message=msg))
+
+    # Jobs are sent in the background, maybe merged with others of the player or by another process
+    tracing.detached(report_transfer(session.user_id, transfer_id, amount))
+
+
+TRANSFER_MESSAGES = {
+    TransferStatus.DONE: Message.Send,
+    TransferStatus.FAILED: Message.SendFailed,
+    TransferStatus.UNKNOWN: Message.SendUnknown,
+}
+
+
+async def report_transfer(user_id, transfer_id, amount):
+    """Tells the player how the withdrawal has ended"""
+    try:
+        status = await HandlerContext.transfers.wait(transfer_id)
+    except Exception:
+        logger.exception(f'Cant wait for transfer {transfer_id}')
+        return
+
+    msg = TRANSFER_MESSAGES[status].format(amount / 1000)
+    HandlerContext.pool.append(HandlerContext.templates['main'](user_id=user_id, message=msg))
 
 
 async def raise_max_bet_1(session: Session):
     donation_amount = await session.get_donation_amount()
     donation_amount = donation_amount if donation_amount else 0
 
-    donation_needed = int(os.environ.get('DONATION_LIMIT'))
+    donation_needed = HandlerContext.config.donation_limit
     if donation_needed > donation_amount:
         await session.set_state(State.ALL)
 
-        HandlerContext.pool.append(HandlerContext.api.messages.send.code(
+        HandlerContext.pool.append(HandlerContext.templates['main'](
             user_id=session.user_id,
-            message=Message.DonationError.format((donation_needed - donation_amount) / 1000),
-            keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+            message=Message.DonationError.format((donation_needed - donation_amount) / 1000)))
     else:
         await session.set_state(State.RAISE)
 
-        HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-            user_id=session.user_id,
-            message=Message.RaiseInput))
+        HandlerContext.pool.append(HandlerContext.templates['raise_input'](user_id=session.user_id))
 
 
 async def raise_max_bet_2(session: Session):
-    amount = Score.parse_score(session['message'].text)
+    message = session['message']
+    amount = Score.parse_score(message.text)
 
-    if amount < 1000:
-        HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-            user_id=session.user_id, message=Message.RaiseTooLower))
+    if amount < economics.MIN_RAISE:
+        HandlerContext.pool.append(HandlerContext.templates['raise_too_lower'](user_id=session.user_id))
         return
 
-    rate = float(os.environ.get('RATE'))
-    price = round((((session.max_bet + amount) / 1000) ** rate) - ((session.max_bet / 1000) ** rate)) * 1000
+    price = economics.raise_price(session.max_bet, amount, HandlerContext.config.rate)
 
     if price > session.score.score:
-        HandlerContext.pool.append(HandlerContext.api.messages.send.code(
+        HandlerContext.pool.append(HandlerContext.templates['plain'](
             user_id=session.user_id, message=Message.BumLeft.format((price - session.score.score) / 1000)))
         return
 
-    await session.score.sub(price)
+    await session.score.sub(price, Reason.RAISE, f'raise:{session.user_id}:{message.id}')
     await session.add_to_max_bet(amount)
 
     msg = Message.Raise.format(amount / 1000, price / 1000)
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id, message=msg, keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['main'](user_id=session.user_id, message=msg))
 
 
 async def deposit_handler(session: Session):
     msg = Message.Deposit.format(HandlerContext.coin_api.create_transaction_url(0, fixed=False))
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id, message=msg, keyboard=HandlerContext.keyboards.get('main').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['main'](user_id=session.user_id, message=msg))
 
 
 async def toss_handler_1(session: Session):
@@ -217,101 +220,70 @@ async def toss_handler_1(session: Session):
 
 
 async def toss_handler_2(session: Session):
-    amount = Score.parse_score(session['message'].text)
+    message = session['message']
+    amount = Score.parse_score(message.text)
     await session.set_bet(amount)
     user_score = session.score.score
 
     if amount > session.max_bet:
         await session.set_state(State.BET)
 
-        msg = Message.OverMaxBet.format(session.max_bet / 1000)
-        kbr = session.bet_keyboard
+        # The bet keyboard is different for every player
+        code = HandlerContext.api.messages.send.code(
+            user_id=session.user_id,
+            message=Message.OverMaxBet.format(session.max_bet / 1000),
+            keyboard=session.bet_keyboard.get_keyboard())
     elif amount > user_score:
         await session.set_state(State.ALL)
 
-        msg = Message.BumLeft.format((amount - user_score) / 1000)
-        kbr = HandlerContext.keyboards.get('main')
+        code = HandlerContext.templates['main'](
+            user_id=session.user_id, message=Message.BumLeft.format((amount - user_score) / 1000))
     else:
         await session.set_state(State.GAME)
         await session.statistics.add_bet(amount)
-        await session.score.sub(session.bet)
+        await session.score.sub(session.bet, Reason.BET, f'bet:{session.user_id}:{message.id}')
 
-        msg = Message.BetMade.format(amount * 2 / 1000)
-        kbr = HandlerContext.keyboards.get('game')
+        code = HandlerContext.templates['game'](
+            user_id=session.user_id, message=Message.BetMade.format(economics.prize(amount) / 1000))
 
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-        user_id=session.user_id,
-        message=msg,
-        keyboard=kbr.get_keyboard()))
+    HandlerContext.pool.append(code)
 
 
 async def im_game_handler(session: Session):
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
-            user_id=session.user_id,
-            message=Message.MakeAChoice.format(session.bet * 2 / 1000),
-            keyboard=HandlerContext.keyboards.get('game').get_keyboard()))
+    HandlerContext.pool.append(HandlerContext.templates['game'](
+        user_id=session.user_id,
+        message=Message.MakeAChoice.format(economics.prize(session.bet) / 1000)))
 
 
 async def game_handler(session: Session):
-    not_user_choice_msg = 'Орёл' if session['message'].text == 'Решка' else 'Решка'
-    not_user_choice_img = 'HEADS_IMG' if session['message'].text == 'Решка' else 'TAILS_IMG'
-    user_choice_img = 'HEADS_IMG' if session['message'].text == 'Орёл' else 'TAILS_IMG'
+    message = session['message']
+    not_user_choice_msg = 'Орёл' if message.text == 'Решка' else 'Решка'
+    config = HandlerContext.config
+    heads = message.text == 'Орёл'
 
-    if random.randint(1, 100) <= int(os.environ.get('WIN_RATE')):
-        msg = Message.Win.format(session.bet * 2 / 1000)
-        img = os.environ.get(user_choice_img)
+    if economics.is_win(economics.roll(), config.win_rate):
+        prize = economics.prize(session.bet)
+        msg = Message.Win.format(prize / 1000)
+        img = config.heads_img if heads else config.tails_img
 
         await session.statistics.add_win()
-        await session.statistics.add_prize(session.bet * 2)
+        await session.statistics.add_prize(prize)
 
-        await session.score.add(session.bet * 2)
+        await session.score.add(prize, Reason.PAYOUT, f'payout:{session.user_id}:{message.id}')
     else:
         msg = Message.Lose.format(not_user_choice_msg)
-        img = os.environ.get(not_user_choice_img)
+        img = config.tails_img if heads else config.heads_img
 
         await session.statistics.add_lose()
 
-    HandlerContext.pool.append(HandlerContext.api.messages.send.code(
+    HandlerContext.pool.append(HandlerContext.templates['main'](
         user_id=session.user_id,
         message=msg,
-        keyboard=HandlerContext.keyboards.get('main').get_keyboard(),
         attachment=img
     ))
 
 
-async def get_members(api):
-    members = []
-
-    offset = 0
-    while True:
-        response = await api.groups.getMembers(group_id=os.environ.get('GROUP_ID'), offset=offset, count=1000)
-
-        members.extend([members for members in response.get('items')])
-
-        if response.get('count') <= offset + 1000:
-            break
-        else:
-            offset += 1000
-
-    return members
-
-
-async def main():
-    token_session = TokenSession(access_token=os.environ.get('GROUP_TOKEN'), timeout=15)
-    api = API(token_session)
-    pool = Pool(api)
-    longpoll = BotsLongPoll(api, mode=2, group_id=os.environ.get('GROUP_ID'))
-
-    coin_api = CoinAPI(os.environ.get('MERCHANT_ID'), os.environ.get('KEY'), os.environ.get('PAYLOAD'))
-
-    database = await Database.create()
-    sessions = SessionList(database)
-
-    top = Top(database)
-    await top.update_tops()
-
-    transaction_manager = TransactionManager(database)
-
+def build_keyboards():
     main_keyboard = Keyboard()
     main_keyboard.add_button('Бросить монету', color=ButtonColor.POSITIVE)
     main_keyboard.add_button('Получить коины!', color=ButtonColor.POSITIVE)
@@ -332,30 +304,46 @@ async def main():
     leaderboard_keyboard = Keyboard()
     leaderboard_keyboard.add_button('Получить коины!', color=ButtonColor.NEGATIVE)
     leaderboard_keyboard.add_line()
-    leaderboard_keyboard.add_button('Топ-10 по количеству выигранных игр')
-    leaderboard_keyboard.add_line()
-    leaderboard_keyboard.add_button('Топ-10 по шансу выигрыша')
-    leaderboard_keyboard.add_line()
-    leaderboard_keyboard.add_button('Топ-10 по внутриигровому балансу')
-    leaderboard_keyboard.add_line()
-    leaderboard_keyboard.add_button('Топ-10 по количество сыгранных игр')
-    leaderboard_keyboard.add_line()
-    leaderboard_keyboard.add_button('Топ-10 по количеству выигранных коинов')
-    leaderboard_keyboard.add_line()
+    for title in LEADERBOARDS:
+        leaderboard_keyboard.add_button(title)
+        leaderboard_keyboard.add_line()
     leaderboard_keyboard.add_button('Назад', color=ButtonColor.PRIMARY)
 
-    keyboards = {
+    return {
         'main': main_keyboard,
         'game': game_keyboard,
         'top': leaderboard_keyboard
     }
 
-    update_manager = UpdateManager(longpoll)
 
-    HandlerContext.initial(await get_members(api), pool, update_manager, sessions, coin_api, keyboards)
+def build_templates(api: API, keyboards: dict):
+    """Replies with static keyboards and messages, encoded once"""
+    send = api.messages.send.code
+    main_keyboard, leaderboard_keyboard = keyboards['main'].get_keyboard(), keyboards['top'].get_keyboard()
+
+    templates = {name: send.template(keyboard=keyboard.get_keyboard()) for name, keyboard in keyboards.items()}
+    templates.update({
+        'plain': send.template(),
+        'help': send.template(message=Message.Commands, keyboard=main_keyboard),
+        'leaderboards': send.template(message=Message.Leaderboards, keyboard=leaderboard_keyboard),
+        'withdraw': send.template(message=Message.Withdraw, keyboard=main_keyboard),
+        'not_group_member': send.template(message=Message.NotGroupMember),
+        'bum': send.template(message=Message.Bum),
+        'raise_input': send.template(message=Message.RaiseInput),
+        'raise_too_lower': send.template(message=Message.RaiseTooLower),
+    })
+
+    return templates
 
+
+def register_handlers(update_manager: UpdateManager, messages=True):
+    """
+    :param messages: also the game, without it only group members are kept
+    """
     update_manager.register_handler(GroupJoinHandler())
     update_manager.register_handler(GroupLeaveHandler())
+    if not messages:
+        return
 
     update_manager.register_handler(MessageHandler(
         not_group_member_handler, '', final=False, reset_state=False, equal=False))
@@ -402,39 +390,200 @@ async def main():
     update_manager.register_handler(MessageHandler(
         help_handler, '', equal=False))
 
-    asyncio.create_task(update_manager.process_unread_conversation())
 
-    async def get_trans():
-        while True:
-            all_transactions = set(await transaction_manager.get_all_ids())
-            transactions = await coin_api.get_transactions()
-            transactions.extend(await coin_api.get_transactions(False))
-            transactions = [transaction for transaction in transactions
-                            if transaction.from_id != int(os.environ.get('MERCHANT_ID'))
-                            and transaction.payload == int(os.environ.get('PAYLOAD'))]
+def setup(config: Config):
+    """Logging, tracing and the config reload on SIGHUP of this process"""
+    logs = LogPipeline()
+    logs.start(config)
+    runtime.log_loop(config.executor_workers)
+
+    exporter = tracing.EXPORTERS[config.trace_format](config.trace_file) if config.trace_file else None
+    tracing.configure(exporter, config.trace_sample_rate)
+
+    def reload_config():
+        if config.reload():
+            logs.configure(config)
+            tracing.configure(exporter, config.trace_sample_rate)
+
+    try:
+        asyncio.get_event_loop().add_signal_handler(signal.SIGHUP, reload_config)
+    except (NotImplementedError, AttributeError):
+        logger.warning('Config reload on SIGHUP is not supported on this platform')
+
 
-            for transaction in transactions:
-                if transaction.id not in all_transactions:
-                    await transaction_manager.save_transaction(transaction)
+def updates_source(api: API, config: Config):
+    """The long poll or the Callback API server, both are waited for by the update manager"""
+    if config.ingress == 'callback':
+        return CallbackServer(api, config.group_id, config.callback_confirmation, config.callback_secret,
+                              config.callback_host, config.callback_port or config.port, config.callback_path,
+                              max_queue=config.callback_queue_size)
+    return BotsLongPoll(api, mode=2, group_id=config.group_id)
 
-                    session = await sessions.get_or_create(transaction.from_id)
-                    await session.statistics.add_deposit(transaction.amount)
-                    await session.score.add(transaction.amount)
 
-                    pool.append(api.messages.send.code(
-                        user_id=transaction.from_id,
-                        message=Message.Credited.format(transaction.amount / 1000)
-                    ))
+async def connect_database(database: Database, config: Config):
+    await database.initial(config.database_url)
+    if config.migrate_on_start:
+        await Migrator(database).migrate()
 
-            await asyncio.sleep(2)
+
+async def after(warmup: Warmup, phase, coroutine):
+    await warmup.wait(phase)
+    await coroutine
+
+
+async def main(config: Config):
+    setup(config)
+
+    if config.workers > 1:
+        await ingress(config)
+        return
+
+    token_session = TokenSession(access_token=config.group_token, timeout=15)
+    api = API(token_session)
+    pool = Pool(api)
+    source = updates_source(api, config)
+
+    coin_api = CoinAPI(config.merchant_id, config.key, config.payload)
+
+    # Connected by the warm-up
+    database = Database.backend(config.database_url)
+    Ledger.attach(database, config.ledger_batch_size, config.ledger_delay)
+    sessions = SessionList(database, config)
+    top_scheduler = Top.schedule(database, config.top_mode, config.top_reload_interval)
+    deposit_watcher = DepositWatcher(database, coin_api, sessions, api, pool)
+    members = Membership(api, config.group_id, database)
+
+    transfers = TransferOutbox(database, coin_api, concurrency=config.transfer_concurrency, sessions=sessions)
+    broadcaster = Broadcaster(database, api, members, interval=config.broadcast_interval)
+
+    keyboards = build_keyboards()
+    update_manager = UpdateManager(source)
+
+    HandlerContext.initial(config, members, pool, update_manager, sessions, coin_api, transfers, keyboards,
+                           build_templates(api, keyboards))
+    register_handlers(update_manager)
+
+    # Leaderboards, deposits and members are not needed to answer, the bot serves without them meanwhile
+    warmup = Warmup()
+    warmup.add('database', lambda: connect_database(database, config))
+    warmup.add('updates', source.prepare)
+    warmup.add('leaderboards', top_scheduler.refresh, requires=['database'], required=False)
+    warmup.add('deposits', deposit_watcher.warm_up, requires=['database'], required=False)
+    warmup.add('members', members.initial, requires=['database'], required=False)
+    if config.prewarm_sessions:
+        # Sessions depend on the leaderboard to know whether players are on it already
+        warmup.add('sessions', lambda: sessions.prewarm(config.prewarm_sessions),
+                   requires=['database', 'leaderboards'], required=False)
+    await warmup.start()
+
+    async def prewarm_unread(updates):
+        await sessions.prewarm(user_ids=[update.object.from_id for update in updates])
+
+    asyncio.create_task(update_manager.process_unread_conversation(prewarm_unread))
 
     await asyncio.gather(
         pool.start(),
         update_manager.start(),
-        coin_api.do_transfers(),
-        get_trans(),
-        top.start()
+        transfers.start(),
+        broadcaster.start(),
+        after(warmup, 'deposits', deposit_watcher.start()),
+        after(warmup, 'leaderboards', top_scheduler.start()),
+        after(warmup, 'members', members.start(config.members_reconcile_interval))
     )
 
+
+async def ingress(config: Config):
+    """The process owning the long poll or the Callback API server and everything global, the game is played by the workers"""
+    shards = Shards(config.workers, worker)
+
+    token_session = TokenSession(access_token=config.group_token, timeout=15)
+    api = API(token_session)
+    pool = Pool(api)
+    source = updates_source(api, config)
+
+    coin_api = CoinAPI(config.merchant_id, config.key, config.payload)
+
+    database = Database.backend(config.database_url)
+    members = Membership(api, config.group_id, database, on_reconcile=shards.members_reconciled)
+    sessions = RemoteSessions(database, config, shards)
+    deposit_watcher = DepositWatcher(database, coin_api, sessions, api, pool)
+    transfers = TransferOutbox(database, coin_api, concurrency=config.transfer_concurrency, sessions=sessions)
+    broadcaster = Broadcaster(database, api, members, interval=config.broadcast_interval)
+
+    # Workers reload their leaderboards when the ingress tells them to, so they reload at the same time
+    top_scheduler = Top.schedule(database, config.top_mode, config.top_reload_interval, refresh=shards.reload_tops)
+
+    update_manager = ShardedUpdateManager(source, shards)
+    HandlerContext.initial(config, members, pool, update_manager, None, coin_api, transfers, {}, {})
+    register_handlers(update_manager, messages=False)
+
+    shards.start()
+
+    warmup = Warmup()
+    warmup.add('database', lambda: connect_database(database, config))
+    warmup.add('updates', source.prepare)
+    warmup.add('deposits', deposit_watcher.warm_up, requires=['database'], required=False)
+    warmup.add('members', members.initial, requires=['database'], required=False)
+    await warmup.start()
+
+    asyncio.create_task(update_manager.process_unread_conversation())
+
+    await asyncio.gather(
+        pool.start(),
+        shards.serve(pool),
+        shards.supervise(),
+        top_scheduler.start(),
+        update_manager.start(),
+        transfers.start(),
+        broadcaster.start(),
+        after(warmup, 'deposits', deposit_watcher.start()),
+        after(warmup, 'members', members.start(config.members_reconcile_interval))
+    )
+
+
+async def run_worker(config: Config, shard, count, inbox, outbox):
+    setup(config)
+
+    link = Worker(shard, count, inbox, outbox)
+
+    # Only builds the code of requests, they are sent by the ingress
+    api = API(TokenSession(access_token=config.group_token, timeout=15))
+    coin_api = CoinAPI(config.merchant_id, config.key, config.payload)
+
+    database = Database.backend(config.database_url)
+    Ledger.attach(database, config.ledger_batch_size, config.ledger_delay)
+    sessions = SessionList(database, config)
+    top_scheduler = Top.schedule(database, config.top_mode, config.top_reload_interval)
+    # Kept up to date by the ingress
+    members = Membership(api, config.group_id, database)
+    # Only adds withdrawals, they are sent by the ingress
+    transfers = TransferOutbox(database, coin_api)
+
+    keyboards = build_keyboards()
+    update_manager = UpdateManager(None, api)
+
+    HandlerContext.initial(config, members, link.pool, update_manager, sessions, coin_api, transfers, keyboards,
+                           build_templates(api, keyboards))
+    register_handlers(update_manager)
+    link.share_top()
+
+    await database.initial(config.database_url)
+    await top_scheduler.refresh()
+    try:
+        await members.load_snapshot()
+    except Exception:
+        logger.exception('Cant load the members snapshot')
+
+    logger.info(f'Worker {shard} of {count} is ready')
+
+    await link.serve(update_manager, sessions, members, top_scheduler)
+
+
+def worker(shard, count, inbox, outbox):
+    config = Config.load()
+    runtime.run(run_worker(config, shard, count, inbox, outbox), config.event_loop, config.executor_workers)
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    config = Config.load()
+    runtime.run(main(config), config.event_loop, config.executor_workers)
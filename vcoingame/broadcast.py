@@ -0,0 +1,272 @@
+"""Announcements to all players or group members: python -m vcoingame.broadcast --help"""
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+from bisect import bisect_right
+from enum import Enum
+
+from vk_api.api import API
+
+from vcoingame.database import Database
+from vcoingame.membership import Membership
+
+logger = logging.getLogger('vcoingame.broadcast')
+
+
+class BroadcastStatus(Enum):
+    RUNNING = 0
+    DONE = 1
+    CANCELLED = 2
+
+
+class Recipients(Enum):
+    # Everybody who has ever played
+    PLAYERS = 'players'
+    # Members of the group, needs the membership index loaded
+    MEMBERS = 'members'
+
+
+class Broadcaster:
+    """Sends broadcasts stored in the database, one at a time and in the order they were created.
+
+    Recipients are read in pages ordered by user id, every page is sent by one execute of messages.send
+    calls with up to 100 user ids each. The last user id of every sent page is saved with the progress,
+    so a broadcast continues where it stopped after a restart. A page interrupted by a restart may be sent twice.
+    The execute requests are paced by their own interval and do not go through the reply pool, so game replies
+    are never queued behind a broadcast. Only one process should run the broadcaster.
+    """
+
+    # User ids in one messages.send, the limit of VK
+    USERS_PER_CALL = 100
+    # Calls in one execute, the limit of VK
+    CALLS_PER_EXECUTE = 25
+
+    def __init__(self, database: Database, api: API, members: Membership = None, interval=1, retries=3,
+                 idle_delay=60):
+        """
+        :param interval: seconds between two execute requests of a broadcast
+        :param retries: attempts to send a page the API refuses, then the page is counted as failed
+        :param idle_delay: how often the broadcaster looks for broadcasts created by other processes
+        """
+        self.database = database
+        self.api = api
+        self.members = members
+        self.interval = interval
+        self.retries = retries
+        self.idle_delay = idle_delay
+
+        self.page_size = self.USERS_PER_CALL * self.CALLS_PER_EXECUTE
+        self._wakeup = asyncio.Event()
+
+    async def create(self, message, recipients: Recipients = Recipients.PLAYERS, keyboard=None):
+        broadcast_id = await self.database.fetchval(
+            '''INSERT INTO broadcasts (message, keyboard, recipients) VALUES (($1::text), ($2::text), ($3::text))
+               RETURNING id''', message, keyboard, recipients.value)
+
+        logger.info(f'Broadcast {broadcast_id} to {recipients.value} has been created')
+        self._wakeup.set()
+
+        return broadcast_id
+
+    async def cancel(self, broadcast_id):
+        """Stops the broadcast after the page being sent now"""
+        return await self.database.fetchval(
+            '''UPDATE broadcasts SET status = ($1::smallint), updated_at = now(), finished_at = now()
+               WHERE id = ($2::int) AND status = ($3::smallint)
+               RETURNING id''',
+            BroadcastStatus.CANCELLED.value, broadcast_id, BroadcastStatus.RUNNING.value) is not None
+
+    async def progress(self, broadcast_id=None):
+        """Rows of the broadcast, or of all running broadcasts"""
+        if broadcast_id is not None:
+            return await self.database.fetch(
+                '''SELECT id, recipients, status, sent, failed, total, created_at, updated_at, finished_at
+                   FROM broadcasts WHERE id = ($1::int)''', broadcast_id)
+
+        return await self.database.fetch(
+            '''SELECT id, recipients, status, sent, failed, total, created_at, updated_at, finished_at
+               FROM broadcasts WHERE status = ($1::smallint) ORDER BY id''', BroadcastStatus.RUNNING.value)
+
+    async def _count(self, recipients: Recipients):
+        if recipients is Recipients.MEMBERS:
+            return len(self.members)
+        return await self.database.fetchval('''SELECT count(*) FROM user_scores''')
+
+    async def _pages(self, recipients: Recipients, last_user_id):
+        """Recipients with ids greater than the given one, a page at a time"""
+        if recipients is Recipients.MEMBERS:
+            if not self.members or not self.members.loaded:
+                raise RuntimeError('Group members are not loaded yet')
+
+            # A snapshot of the members, joins during the broadcast are not waited for
+            members = sorted(self.members)
+            start = bisect_right(members, last_user_id)
+            for offset in range(start, len(members), self.page_size):
+                yield members[offset:offset + self.page_size]
+            return
+
+        while True:
+            rows = await self.database.fetch(
+                '''SELECT user_id FROM user_scores WHERE user_id > ($1::int) ORDER BY user_id LIMIT ($2::int)''',
+                last_user_id, self.page_size)
+            if not rows:
+                return
+
+            page = [row['user_id'] for row in rows]
+            yield page
+            last_user_id = page[-1]
+
+    async def _send(self, send, user_ids):
+        """Sends the page and returns numbers of the sent and failed messages"""
+        chunks = [user_ids[i:i + self.USERS_PER_CALL] for i in range(0, len(user_ids), self.USERS_PER_CALL)]
+        code = f"return [{','.join(send(user_ids=','.join(map(str, chunk))) for chunk in chunks)}];"
+
+        for attempt in range(1, self.retries + 1):
+            response = await self.api.execute(code=code)
+            if response is not None:
+                break
+
+            logger.warning(f'Cant send a broadcast page, attempt {attempt} of {self.retries}')
+            await asyncio.sleep(self.interval * 2 ** attempt)
+        else:
+            return 0, len(user_ids)
+
+        sent = failed = 0
+        for chunk, result in zip(chunks, response):
+            if not result:
+                failed += len(chunk)
+                continue
+
+            # One item per recipient, with an error if the recipient cant get messages from the group
+            errors = sum(1 for item in result if isinstance(item, dict) and item.get('error'))
+            sent += len(chunk) - errors
+            failed += errors
+
+        return sent, failed
+
+    async def _run(self, broadcast):
+        broadcast_id = broadcast['id']
+        recipients = Recipients(broadcast['recipients'])
+
+        constants = {'message': broadcast['message']}
+        if broadcast['keyboard']:
+            constants['keyboard'] = broadcast['keyboard']
+        send = self.api.messages.send.code.template(**constants)
+
+        sent, failed, total = broadcast['sent'], broadcast['failed'], broadcast['total']
+        if total is None:
+            total = await self._count(recipients)
+            await self.database.execute(
+                '''UPDATE broadcasts SET total = ($1::int) WHERE id = ($2::int)''', total, broadcast_id)
+
+        logger.info(f'Broadcast {broadcast_id} to {recipients.value} has started. '
+                    f'Sent: {sent}; Total: {total}; From user: {broadcast["last_user_id"]}')
+
+        async for user_ids in self._pages(recipients, broadcast['last_user_id']):
+            start = time.monotonic()
+            page_sent, page_failed = await self._send(send, user_ids)
+            sent += page_sent
+            failed += page_failed
+
+            status = await self.database.fetchval(
+                '''UPDATE broadcasts SET last_user_id = ($1::int), sent = sent + ($2::int), failed = failed + ($3::int),
+                                         updated_at = now()
+                   WHERE id = ($4::int)
+                   RETURNING status''', user_ids[-1], page_sent, page_failed, broadcast_id)
+
+            logger.info(f'Broadcast {broadcast_id}: {sent + failed} of {total} '
+                        f'({(sent + failed) / total if total else 1:.0%}). Sent: {sent}; Failed: {failed}')
+
+            if status != BroadcastStatus.RUNNING.value:
+                logger.info(f'Broadcast {broadcast_id} has been cancelled')
+                return
+
+            await asyncio.sleep(max(self.interval - (time.monotonic() - start), 0))
+
+        await self.database.execute(
+            '''UPDATE broadcasts SET status = ($1::smallint), updated_at = now(), finished_at = now()
+               WHERE id = ($2::int) AND status = ($3::smallint)''',
+            BroadcastStatus.DONE.value, broadcast_id, BroadcastStatus.RUNNING.value)
+
+        logger.info(f'Broadcast {broadcast_id} has finished. Sent: {sent}; Failed: {failed}')
+
+    async def start(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                broadcasts = await self.database.fetch(
+                    '''SELECT id, message, keyboard, recipients, last_user_id, sent, failed, total FROM broadcasts
+                       WHERE status = ($1::smallint)
+                       ORDER BY id''', BroadcastStatus.RUNNING.value)
+
+                for broadcast in broadcasts:
+                    await self._run(broadcast)
+            except Exception:
+                # The broadcast continues from the last saved page
+                logger.exception('Cant send a broadcast')
+                await asyncio.sleep(self.idle_delay)
+                continue
+
+            if not broadcasts:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def run(args):
+    database = await Database.create()
+    broadcaster = Broadcaster(database, api=None)
+
+    try:
+        if args.command == 'create':
+            keyboard = None
+            if args.keyboard:
+                with open(args.keyboard) as file:
+                    keyboard = file.read()
+
+            broadcast_id = await broadcaster.create(args.message, Recipients(args.recipients), keyboard)
+            print(f'Broadcast {broadcast_id} has been created, the running bot will send it')
+        elif args.command == 'cancel':
+            if not await broadcaster.cancel(args.id):
+                print(f'Broadcast {args.id} is not running')
+                return 1
+        else:
+            for row in await broadcaster.progress(args.id):
+                done = row['sent'] + row['failed']
+                print(f'{row["id"]}: {BroadcastStatus(row["status"]).name} to {row["recipients"]}, '
+                      f'{done} of {row["total"] if row["total"] is not None else "?"}. '
+                      f'Sent: {row["sent"]}; Failed: {row["failed"]}; Updated: {row["updated_at"]:%Y-%m-%d %H:%M:%S}')
+
+        return 0
+    finally:
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create and watch broadcasts sent by the running bot')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help='add a broadcast')
+    create.add_argument('message')
+    create.add_argument('--recipients', choices=[recipients.value for recipients in Recipients],
+                        default=Recipients.PLAYERS.value)
+    create.add_argument('--keyboard', help='file with the keyboard JSON')
+
+    cancel = commands.add_parser('cancel', help='stop a running broadcast')
+    cancel.add_argument('id', type=int)
+
+    progress = commands.add_parser('progress', help='show a broadcast or all running ones')
+    progress.add_argument('id', type=int, nargs='?')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-5s [%(asctime)s] %(name)s %(message)s')
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
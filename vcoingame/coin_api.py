@@ -1,5 +1,4 @@
 import aiohttp
-import asyncio
 import logging
 
 from enum import Enum
@@ -13,6 +12,8 @@ class Transaction:
         FROM_USER_TO_USER = 3
         FROM_USER_TO_MERCHANT = 4
 
+    __slots__ = ('id', 'from_id', 'to_id', 'amount', 'type', 'payload', 'external_id', 'created_at')
+
     def __init__(self,
                  id,
                  from_id,
@@ -22,15 +23,14 @@ class Transaction:
                  payload,
                  external_id,
                  created_at):
-        super().__init__()
-
         self.id = int(id)
         self.from_id = int(from_id)
         self.to_id = int(to_id)
         self.amount = int(amount)
-        self.type = Transaction.Type(type)
+        # Types the merchant adds later are kept as is instead of failing the whole response
+        self.type = TYPES.get(type, type)
         self.payload = int(payload)
-        self.external_id = int(external_id)
+        self.external_id = int(external_id) if external_id is not None else None
         self.created_at = created_at
 
     @staticmethod
@@ -46,6 +46,40 @@ class Transaction:
             transaction.get('created_at'),
         )
 
+    @staticmethod
+    def parse(transactions, merchant_id=None, payload=None, seen=()):
+        """Builds transactions from a merchant response skipping the unwanted ones before creating any objects
+
+        :param transactions: list of dicts from the merchant response
+        :param merchant_id: skip transactions sent by the merchant
+        :param payload: skip transactions with another payload
+        :param seen: skip transactions with these ids
+        """
+        merchant_id = int(merchant_id) if merchant_id is not None else None
+        payload = int(payload) if payload is not None else None
+
+        result = []
+        for transaction in transactions:
+            if int(transaction['id']) in seen:
+                continue
+            if merchant_id is not None and int(transaction['from_id']) == merchant_id:
+                continue
+            if payload is not None and int(transaction['payload']) != payload:
+                continue
+
+            result.append(Transaction(
+                transaction['id'],
+                transaction['from_id'],
+                transaction['to_id'],
+                transaction['amount'],
+                transaction['type'],
+                transaction['payload'],
+                transaction.get('external_id'),
+                transaction.get('created_at'),
+            ))
+
+        return result
+
     def __str__(self):
         return f'ID: {self.id}; FROM: {self.from_id}; TO: {self.to_id}; AMOUNT: {self.amount}; ' \
             f'TYPE {self.type}; PAYLOAD: {self.payload}; CREATED AT: {datetime.fromtimestamp(self.created_at)}'
@@ -54,6 +88,9 @@ class Transaction:
         return self.__str__()
 
 
+TYPES = {transaction_type.value: transaction_type for transaction_type in Transaction.Type}
+
+
 class CoinAPI:
     class Method(Enum):
         GET_TRANSACTIONS = 'tx'
@@ -63,7 +100,6 @@ class CoinAPI:
 
     def __init__(self, merchant_id, key, payload):
         self.session = aiohttp.ClientSession()
-        self.transfers = asyncio.Queue()
         self.merchant_id = merchant_id
         self.payload = payload
         self.key = key
@@ -73,19 +109,28 @@ class CoinAPI:
             'key': self.key
         }
 
-    async def get_transactions(self, to_merchant=True):
+    async def get_transactions(self, to_merchant=True, last_tx=None, deposits=False, seen=()):
+        """
+        :param to_merchant: tx=[1] if True else tx=[2]
+        :param last_tx: skip transactions up to this one
+        :param deposits: only transactions to the merchant with its payload
+        :param seen: skip transactions with these ids
+        """
         method_url = CoinAPI.api_url.format(CoinAPI.Method.GET_TRANSACTIONS.value)
 
         params = self.params.copy()
         params.update({'tx': [1] if to_merchant else [2]})
+        # The merchant API skips everything up to lastTx, it works for tx=[2] only
+        if last_tx and not to_merchant:
+            params.update({'lastTx': last_tx})
 
         response = await self._send_request(method_url, params)
         response = response.get('response')
-        logger.debug(response)
+        logger.debug('Merchant returned %d transactions', len(response or ()))
 
-        transactions = [Transaction.to_python(transaction) for transaction in response]
-
-        return transactions
+        if deposits:
+            return Transaction.parse(response, self.merchant_id, self.payload, seen)
+        return Transaction.parse(response, seen=seen)
 
     async def send(self, to_id, amount):
         method_url = CoinAPI.api_url.format(CoinAPI.Method.SEND.value)
@@ -94,7 +139,10 @@ class CoinAPI:
         params.update({'toId': to_id})
         params.update({'amount': amount})
 
-        self.transfers.put_nowait((method_url, params))
+        response = await self._send_request(method_url, params)
+        logger.info(f'Sending coins! Response: {response}; Params: {params}')
+
+        return response
 
     def create_transaction_url(self, amount, fixed=True):
         def to_hex(dec):
@@ -104,20 +152,6 @@ class CoinAPI:
 
         return 'vk.com/coin#m' + '_'.join(params) + ('' if fixed else '_1')
 
-    async def do_transfers(self):
-        while True:
-            method_url, params = await self.transfers.get()
-            response = await self._send_request(method_url, params)
-            if 'error' in response:
-                logger.error(f'Cant send coins. Response: {response}; Params: {params}')
-
-                if response['error']['message'] == 'ANOTHER_TRANSACTION_IN_PROGRESS_AT_SAME_TIME':
-                    logger.warning(f'ANOTHER_TRANSACTION_IN_PROGRESS_AT_SAME_TIME add transaction again')
-                    self.transfers.put_nowait((method_url, params))
-
-            logger.info(f'Sending coins! Response: {response}; Params: {params}')
-            await asyncio.sleep(2)
-
     async def _send_request(self, url, params):
         async with self.session.post(url, json=params) as response:
             return await response.json(content_type=response.content_type)
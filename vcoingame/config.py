@@ -0,0 +1,193 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger('vcoingame.config')
+
+REQUIRED = object()
+
+
+class ConfigError(Exception):
+    pass
+
+
+def boolean(value):
+    return str(value).strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+
+def choice(*values):
+    def parse(value):
+        if value not in values:
+            raise ValueError(f'{value} is not one of {", ".join(values)}')
+        return value
+
+    return parse
+
+
+def level(value):
+    value = str(value).strip().upper()
+    if not isinstance(logging.getLevelName(value), int):
+        raise ValueError(f'Unknown logging level {value}')
+    return value
+
+
+def mapping(type):
+    """Parser of comma separated name=value pairs, e.g. "vcoingame.score=10,vk_api=20" """
+    def parse(value):
+        result = {}
+        for item in str(value).split(','):
+            if not item.strip():
+                continue
+            name, separator, raw = item.partition('=')
+            if not separator or not name.strip():
+                raise ValueError(f'Invalid pair {item!r}')
+            result[name.strip()] = type(raw.strip())
+        return result
+
+    return parse
+
+
+class Setting:
+    def __init__(self, name, type=str, default=REQUIRED, reloadable=False):
+        """
+        :param name: name of the environment variable, the attribute is its lower case
+        :param type: callable converting the raw string
+        :param default: value if the variable is not set, required if not given
+        :param reloadable: the value may change on reload without a restart
+        """
+        self.name = name
+        self.attribute = name.lower()
+        self.type = type
+        self.default = default
+        self.reloadable = reloadable
+
+
+SETTINGS = [
+    Setting('GROUP_TOKEN'),
+    Setting('GROUP_ID', int),
+    Setting('MERCHANT_ID', int),
+    Setting('KEY'),
+    Setting('PAYLOAD', int),
+    Setting('DATABASE_URL'),
+
+    Setting('WIN_RATE', int, reloadable=True),
+    Setting('RATE', float, reloadable=True),
+    Setting('DONATION_LIMIT', int, reloadable=True),
+    Setting('START_MAX_BET', int, reloadable=True),
+    Setting('HEADS_IMG', default=None, reloadable=True),
+    Setting('TAILS_IMG', default=None, reloadable=True),
+    Setting('MARKET_URL', reloadable=True),
+    Setting('REFERRER', default='', reloadable=True),
+
+    Setting('DEBUG', boolean, default=False, reloadable=True),
+    # kv for key=value records, text for the old human readable lines
+    Setting('LOG_FORMAT', default='kv'),
+    # Levels of single subsystems, e.g. vcoingame.transfers=DEBUG,vk_api=WARNING
+    Setting('LOG_LEVELS', mapping(level), default={}, reloadable=True),
+    # Only one of every N records below WARNING of a logger is kept, e.g. vcoingame.score=10
+    Setting('LOG_SAMPLING', mapping(int), default={}, reloadable=True),
+    # Traces of sampled updates are appended to the file, nothing is traced without it
+    Setting('TRACE_FILE', default=None),
+    Setting('TRACE_FORMAT', choice('jsonl', 'otlp'), default='jsonl'),
+    Setting('TRACE_SAMPLE_RATE', float, default=0.01, reloadable=True),
+    Setting('MIGRATE_ON_START', boolean, default=False),
+    Setting('TOP_MODE', choice('incremental', 'snapshot'), default='incremental'),
+    Setting('TOP_RELOAD_INTERVAL', int, default=None),
+    Setting('TRANSFER_CONCURRENCY', int, default=1),
+    # Most balance changes written to the ledger in one transaction, and seconds a batch waits for more
+    Setting('LEDGER_BATCH_SIZE', int, default=500),
+    Setting('LEDGER_DELAY', float, default=0),
+    Setting('MEMBERS_RECONCILE_INTERVAL', int, default=3600),
+    # auto runs on uvloop if it is installed
+    Setting('EVENT_LOOP', choice('auto', 'asyncio', 'uvloop'), default='auto'),
+    # Threads of the default executor of the loop, the asyncio default if not set
+    Setting('EXECUTOR_WORKERS', int, default=None),
+    # More than one runs an ingress process and this many worker processes sharded by user id
+    Setting('WORKERS', int, default=1),
+    # Updates come from the long poll, or are POSTed by VK to the Callback API server of the bot. On Heroku the
+    # callback mode runs as the web process of the Procfile, which gets HTTP traffic on $PORT, with the worker
+    # process scaled to 0; the long poll runs as the worker process with web scaled to 0
+    Setting('INGRESS', choice('longpoll', 'callback'), default='longpoll'),
+    Setting('CALLBACK_HOST', default='0.0.0.0'),
+    # $PORT if not set, the port Heroku routes to a web process, 8080 without either
+    Setting('CALLBACK_PORT', int, default=None),
+    Setting('PORT', int, default=8080),
+    Setting('CALLBACK_PATH', default='/callback'),
+    # Got from the API if not set
+    Setting('CALLBACK_CONFIRMATION', default=None),
+    Setting('CALLBACK_SECRET', default=None),
+    # Events received but not processed yet, more are refused and sent by VK again later
+    Setting('CALLBACK_QUEUE_SIZE', int, default=10000),
+    # Sessions of this many most recently active players are created at startup
+    Setting('PREWARM_SESSIONS', int, default=0),
+    # Seconds between execute requests of a broadcast, separate from the replies
+    Setting('BROADCAST_INTERVAL', float, default=1),
+    # JSON object with the same keys, its values take precedence over the environment and it is read again on reload
+    Setting('CONFIG_FILE', default=None),
+]
+
+
+class Config:
+    """All settings read and validated once at startup.
+
+    reload() reads them again and applies only the reloadable ones, in place, so everybody holding
+    the config sees the new values. An invalid reload is logged and the old values are kept.
+    """
+
+    def __init__(self, values: dict):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def _read(environ):
+        values = dict(environ)
+
+        config_file = values.get('CONFIG_FILE')
+        if config_file:
+            try:
+                with open(config_file) as file:
+                    values.update({key: str(value) for key, value in json.load(file).items()})
+            except (OSError, ValueError) as e:
+                raise ConfigError(f'Cant read {config_file}: {e}')
+
+        return values
+
+    @staticmethod
+    def load(environ=None):
+        values = Config._read(os.environ if environ is None else environ)
+
+        result, errors = {}, []
+        for setting in SETTINGS:
+            raw = values.get(setting.name)
+            if raw is None or raw == '':
+                if setting.default is REQUIRED:
+                    errors.append(f'{setting.name} is not set')
+                result[setting.attribute] = None if setting.default is REQUIRED else setting.default
+                continue
+
+            try:
+                result[setting.attribute] = setting.type(raw)
+            except ValueError:
+                errors.append(f'{setting.name} has an invalid value: {raw!r}')
+
+        if errors:
+            raise ConfigError('; '.join(errors))
+
+        return Config(result)
+
+    def reload(self, environ=None):
+        try:
+            config = Config.load(environ)
+        except ConfigError as e:
+            logger.error(f'Config has not been reloaded: {e}')
+            return False
+
+        changed = []
+        for setting in SETTINGS:
+            value = getattr(config, setting.attribute)
+            if setting.reloadable and getattr(self, setting.attribute) != value:
+                setattr(self, setting.attribute, value)
+                changed.append(setting.name)
+
+        logger.info(f'Config has been reloaded. Changed: {", ".join(changed) or "nothing"}')
+        return True
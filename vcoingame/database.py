@@ -2,39 +2,119 @@ import os
 import logging
 import asyncpg
 
+from contextlib import asynccontextmanager
+
+from vk_api import tracing
+
 logger = logging.getLogger('vcoingame.database')
 
+# Database.backend() gives the in-memory database for it
+MEMORY = 'memory://'
+# Runs of a transaction aborted by deadlocks before the error is raised
+DEADLOCK_ATTEMPTS = 3
+
+_statements = {}
+
+
+def _statement(query):
+    """Query in one line, short enough to name a span"""
+    statement = _statements.get(query)
+    if statement is None:
+        statement = _statements[query] = ' '.join(query.split())[:100]
+    return statement
+
 
 class Database:
     def __init__(self):
         self.pool = None
 
-    async def initial(self):
-        self.pool = await asyncpg.create_pool(dsn=os.environ.get('DATABASE_URL'))
+    async def initial(self, dsn=None):
+        self.pool = await asyncpg.create_pool(dsn=dsn or os.environ.get('DATABASE_URL'))
         return self
 
     @staticmethod
-    async def create():
-        return await Database().initial()
+    def backend(dsn=None) -> 'Database':
+        """Database for the dsn, not connected yet: the in-memory one for memory://, Postgres otherwise"""
+        dsn = dsn or os.environ.get('DATABASE_URL')
+        if dsn and dsn.startswith(MEMORY):
+            from vcoingame.memory_database import MemoryDatabase
+            return MemoryDatabase()
+        return Database()
+
+    @staticmethod
+    async def create(dsn=None):
+        return await Database.backend(dsn).initial(dsn)
+
+    async def close(self):
+        await self.pool.close()
+
+    @property
+    def load(self):
+        """Share of busy connections in the pool, a cheap hint of how loaded the database is"""
+        size = self.pool.get_size()
+        return (size - self.pool.get_idle_size()) / size if size else 0
 
     @property
     async def connection(self):
         return await self.pool.acquire()
 
+    @asynccontextmanager
+    async def transaction(self):
+        with tracing.span('db.transaction'):
+            conn = await self.connection
+            try:
+                async with conn.transaction():
+                    yield conn
+            finally:
+                await self.pool.release(conn)
+
+    async def run_in_transaction(self, work, attempts=DEADLOCK_ATTEMPTS):
+        """Returns await work(conn) run in a transaction, which is run again if Postgres aborts it to break
+        a deadlock, so work must not change anything but the database"""
+        for attempt in range(1, attempts + 1):
+            try:
+                async with self.transaction() as conn:
+                    return await work(conn)
+            except asyncpg.DeadlockDetectedError:
+                if attempt == attempts:
+                    raise
+                logger.warning(f'Transaction has been aborted by a deadlock, attempt {attempt} of {attempts}')
+
+    async def execute(self, query, *args):
+        logger.debug('%s; %s', query, args)
+        with tracing.span('db.execute', statement=_statement(query)):
+            conn = await self.connection
+            try:
+                return await conn.execute(query, *args)
+            finally:
+                await self.pool.release(conn)
+
     async def fetchval(self, query, *args):
-        logger.debug(f'{query}; {args}')
-        conn = await self.connection
-        try:
-            stmt = await conn.prepare(query)
-            return await stmt.fetchval(*args)
-        finally:
-            await self.pool.release(conn)
+        logger.debug('%s; %s', query, args)
+        with tracing.span('db.fetchval', statement=_statement(query)):
+            conn = await self.connection
+            try:
+                stmt = await conn.prepare(query)
+                return await stmt.fetchval(*args)
+            finally:
+                await self.pool.release(conn)
+
+    async def fetchrow(self, query, *args):
+        logger.debug('%s; %s', query, args)
+        with tracing.span('db.fetchrow', statement=_statement(query)):
+            conn = await self.connection
+            try:
+                stmt = await conn.prepare(query)
+                return await stmt.fetchrow(*args)
+            finally:
+                await self.pool.release(conn)
 
     async def fetch(self, query, *args):
-        logger.debug(f'{query}; {args}')
-        conn = await self.connection
-        try:
-            stmt = await conn.prepare(query)
-            return await stmt.fetch(*args)
-        finally:
-            await self.pool.release(conn)
+        logger.debug('%s; %s', query, args)
+        with tracing.span('db.fetch', statement=_statement(query)):
+            conn = await self.connection
+            try:
+                stmt = await conn.prepare(query)
+                return await stmt.fetch(*args)
+            finally:
+                await self.pool.release(conn)
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+from vk_api.execute import Pool
+from vk_api.api import API
+
+from vcoingame.coin_api import CoinAPI
+from vcoingame.messages import Message
+from vcoingame.database import Database
+from vcoingame.session import SessionList
+from vcoingame.transaction_manager import TransactionManager
+
+logger = logging.getLogger('vcoingame.deposits')
+
+
+class DepositWatcher:
+    """Polls the merchant for new deposits and credits them.
+
+    Ids of the recent transactions are kept in memory and the merchant response is filtered by them
+    before any transaction objects are built, so only the new deposits reach the database. They are saved
+    and credited in bulk in one database transaction, and the tid primary key makes sure a deposit is credited
+    once even if it is seen twice.
+    """
+
+    def __init__(self, database: Database, coin_api: CoinAPI, sessions: SessionList, api: API, pool: Pool,
+                 min_interval=1, max_interval=10):
+        self.database = database
+        self.transaction_manager = TransactionManager(database)
+        self.coin_api = coin_api
+        self.sessions = sessions
+        self.api = api
+        self.pool = pool
+        self.send = api.messages.send.code.template()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.interval = min_interval
+        self.last_id = 0
+        self.seen = set()
+
+    async def warm_up(self):
+        self.seen = set(await self.transaction_manager.get_all_ids())
+        self.last_id = max(self.seen, default=0)
+        logger.info(f'Deposit watcher is ready. Last transaction: {self.last_id}')
+
+    async def poll(self):
+        deposits = await self.coin_api.get_transactions(deposits=True, seen=self.seen)
+        deposits.extend(await self.coin_api.get_transactions(False, self.last_id, deposits=True, seen=self.seen))
+        deposits = list({transaction.id: transaction for transaction in deposits}.values())
+
+        if deposits:
+            await self._credit(deposits)
+
+            self.seen.update(transaction.id for transaction in deposits)
+            self.last_id = max(self.last_id, max(transaction.id for transaction in deposits))
+
+            # Ids are increasing and every merchant response is at most 1000 transactions,
+            # older ids will never come again
+            if len(self.seen) > 4000:
+                self.seen = set(sorted(self.seen)[-2000:])
+
+        return len(deposits)
+
+    async def _credit(self, deposits):
+        # Makes sure every sender has a score row to credit
+        sessions = {}
+        for transaction in deposits:
+            if transaction.from_id not in sessions:
+                sessions[transaction.from_id] = await self.sessions.get_or_create(transaction.from_id)
+
+        inserted = await self.database.run_in_transaction(
+            lambda conn: self.transaction_manager.save_deposits(conn, deposits))
+
+        logger.info(f'Credited {len(inserted)} of {len(deposits)} new deposits')
+
+        for row in inserted:
+            sessions[row['from_id']].score.apply(row['amount'])
+
+            self.pool.append(self.send(
+                user_id=row['from_id'],
+                message=Message.Credited.format(row['amount'] / 1000)
+            ))
+
+    async def start(self):
+        while True:
+            try:
+                found = await self.poll()
+            except Exception:
+                logger.exception('Cant check deposits')
+                found = 0
+
+            # Polls often while deposits are flowing and backs off while nothing happens
+            self.interval = self.min_interval if found else min(self.interval * 2, self.max_interval)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,30 @@
+"""Game rules shared by the handlers and the simulator.
+
+Every function works both with plain numbers and with NumPy arrays, so the simulator applies
+exactly the same rules as the bot.
+"""
+import random
+
+# Amounts are in thousandths of a coin
+COIN = 1000
+MIN_RAISE = COIN
+
+
+def roll():
+    return random.randint(1, 100)
+
+
+def is_win(rolled, win_rate):
+    """A game is won when the roll from 1 to 100 is not above the win rate"""
+    return rolled <= win_rate
+
+
+def prize(bet):
+    return bet * 2
+
+
+def raise_price(max_bet, amount, rate):
+    """Price of raising the max bet by the amount, rounded to whole coins"""
+    price = ((max_bet + amount) / COIN) ** rate - (max_bet / COIN) ** rate
+    # Both round half to even, so arrays are priced like single numbers
+    return (price.round() if hasattr(price, 'round') else round(price)) * COIN
@@ -1,20 +1,26 @@
 from vk_api.execute import Pool
 from vk_api.updates import UpdateManager
 
+from vcoingame.config import Config
 from vcoingame.coin_api import CoinAPI
 from vcoingame.session import SessionList
+from vcoingame.membership import Membership
+from vcoingame.transfers import TransferOutbox
 
 
 class HandlerContext:
-    group_members = pool = api = update_manager = sessions = coin_api = keyboards = None
+    config = group_members = pool = api = update_manager = sessions = coin_api = transfers = keyboards = templates = None
 
     @staticmethod
-    def initial(group_members: list, pool: Pool, update_manager: UpdateManager, sessions: SessionList,
-                coin_api: CoinAPI, keyboards: dict):
+    def initial(config: Config, group_members: Membership, pool: Pool, update_manager: UpdateManager, sessions: SessionList,
+                coin_api: CoinAPI, transfers: TransferOutbox, keyboards: dict, templates: dict):
+        HandlerContext.config = config
         HandlerContext.group_members = group_members
         HandlerContext.pool = pool
         HandlerContext.update_manager = update_manager
         HandlerContext.api = update_manager.api
         HandlerContext.sessions = sessions
         HandlerContext.coin_api = coin_api
+        HandlerContext.transfers = transfers
         HandlerContext.keyboards = keyboards
+        HandlerContext.templates = templates
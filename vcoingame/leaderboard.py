@@ -0,0 +1,360 @@
+import heapq
+import logging
+
+from enum import Enum
+from array import array
+from bisect import bisect_left, insort
+
+logger = logging.getLogger('vcoingame.leaderboard')
+
+
+class Board(Enum):
+    WIN = 'win'
+    WINRATE = 'winrate'
+    SCORE = 'score'
+    GAMES = 'games'
+    PROFIT = 'profit'
+
+
+# Only players with more games than this are ranked by their win rate
+WINRATE_MIN_GAMES = 20
+
+
+class OrderStatisticList:
+    """Sorted list split into blocks with a Fenwick tree over the block sizes.
+
+    Insertion and removal touch one block only, rank is a bisect in the block index, a bisect in
+    the block and a prefix sum in the tree, so all of them stay around O(log n) for millions of keys.
+    """
+
+    __slots__ = ('_load', '_blocks', '_maxes', '_tree', '_len')
+
+    def __init__(self, load=512):
+        self._load = load
+        self._blocks = []
+        self._maxes = []
+        self._tree = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def build(self, keys):
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + self._load] for i in range(0, len(keys), self._load)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        tree = [0] + [len(block) for block in self._blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, index, delta):
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _tree_prefix(self, index):
+        total = 0
+        while index:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def add(self, key):
+        if not self._blocks:
+            self.build([key])
+            return
+
+        index = bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            index -= 1
+            self._blocks[index].append(key)
+            self._maxes[index] = key
+        else:
+            insort(self._blocks[index], key)
+
+        self._len += 1
+
+        block = self._blocks[index]
+        if len(block) > self._load * 2:
+            self._blocks[index:index + 1] = [block[:self._load], block[self._load:]]
+            self._maxes[index:index + 1] = [block[self._load - 1], block[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(index, 1)
+
+    def remove(self, key):
+        index = bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            raise ValueError(f'{key} is not in list')
+
+        block = self._blocks[index]
+        position = bisect_left(block, key)
+        if block[position] != key:
+            raise ValueError(f'{key} is not in list')
+
+        del block[position]
+        self._len -= 1
+
+        if block:
+            self._maxes[index] = block[-1]
+            self._tree_add(index, -1)
+        else:
+            del self._blocks[index]
+            del self._maxes[index]
+            self._rebuild_tree()
+
+    def rank(self, key):
+        """Number of keys strictly less than the key"""
+        index = bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            return self._len
+
+        return self._tree_prefix(index) + bisect_left(self._blocks[index], key)
+
+    def head(self, count):
+        result = []
+        for block in self._blocks:
+            result.extend(block[:count - len(result)])
+            if len(result) >= count:
+                break
+
+        return result
+
+
+class Stats:
+    __slots__ = ('score', 'win', 'lose', 'bet', 'prize')
+
+    def __init__(self, score=0, win=0, lose=0, bet=0, prize=0):
+        self.score = score
+        self.win = win
+        self.lose = lose
+        self.bet = bet
+        self.prize = prize
+
+
+def _winrate(stats: Stats):
+    return stats.win / (stats.win + stats.lose)
+
+
+# Board: (sort value, displayed value) of the player, the same expressions the SQL ranking used
+BOARDS = {
+    Board.WIN: lambda stats: (stats.win, stats.win),
+    Board.WINRATE: lambda stats: (_winrate(stats), round(_winrate(stats) * 100))
+    if stats.win + stats.lose > WINRATE_MIN_GAMES else None,
+    Board.SCORE: lambda stats: (stats.score, stats.score / 1000),
+    Board.GAMES: lambda stats: (stats.win + stats.lose, stats.win + stats.lose),
+    Board.PROFIT: lambda stats: (stats.prize - stats.bet, (stats.prize - stats.bet) / 1000),
+}
+
+# Which boards have to be re-ranked when the stat changes
+AFFECTED_BOARDS = {
+    'score': (Board.SCORE,),
+    'win': (Board.WIN, Board.WINRATE, Board.GAMES),
+    'lose': (Board.WINRATE, Board.GAMES),
+    'bet': (Board.PROFIT,),
+    'prize': (Board.PROFIT,),
+}
+
+
+class Leaderboard:
+    """Keeps every board ranked in memory and re-ranks a single player on each change.
+
+    Keys are (-sort value, user_id), so the best player is the first one and ties are stable.
+    The rank is the number of players with a strictly better value plus one, like SQL rank().
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._boards = {board: OrderStatisticList() for board in Board}
+        self._keys = {board: {} for board in Board}
+        self.versions = {board: 0 for board in Board}
+
+    def __len__(self):
+        return len(self._stats)
+
+    def __contains__(self, user_id):
+        return user_id in self._stats
+
+    def load(self, rows):
+        """Replace everything with rows of (user_id, score, win, lose, bet, prize)"""
+        self._stats = {row[0]: Stats(*row[1:]) for row in rows}
+
+        for board, rank_of in BOARDS.items():
+            keys = {}
+            for user_id, stats in self._stats.items():
+                rank = rank_of(stats)
+                if rank is not None:
+                    keys[user_id] = (-rank[0], user_id)
+
+            self._keys[board] = keys
+            self._boards[board].build(keys.values())
+            self.versions[board] += 1
+
+        logger.info(f'Leaderboard has been loaded. Users: {len(self)}')
+
+    def create(self, user_id):
+        if user_id not in self._stats:
+            self.set(user_id, score=0)
+
+    def apply(self, user_id, **deltas):
+        """Add deltas to the player stats, e.g. apply(user_id, win=1, prize=2000)"""
+        stats, changed = self._get(user_id, deltas)
+        for name, delta in deltas.items():
+            setattr(stats, name, getattr(stats, name) + delta)
+
+        self._rerank(user_id, stats, changed)
+
+    def set(self, user_id, **values):
+        stats, changed = self._get(user_id, values)
+        for name, value in values.items():
+            setattr(stats, name, value)
+
+        self._rerank(user_id, stats, changed)
+
+    def _get(self, user_id, changed):
+        stats = self._stats.get(user_id)
+        if stats is None:
+            # A new player has to appear on every board, not only on the changed ones
+            stats = self._stats[user_id] = Stats()
+            changed = Stats.__slots__
+
+        return stats, changed
+
+    def _rerank(self, user_id, stats, changed):
+        boards = set()
+        for name in changed:
+            boards.update(AFFECTED_BOARDS[name])
+
+        for board in boards:
+            keys = self._keys[board]
+            ordered = self._boards[board]
+
+            old_key = keys.get(user_id)
+            rank = BOARDS[board](stats)
+            new_key = (-rank[0], user_id) if rank is not None else None
+
+            if old_key == new_key:
+                continue
+
+            head = ordered.head(10)
+            tenth = head[-1] if len(head) == 10 else None
+
+            if old_key is not None:
+                ordered.remove(old_key)
+                del keys[user_id]
+            if new_key is not None:
+                ordered.add(new_key)
+                keys[user_id] = new_key
+
+            if tenth is None or (old_key is not None and old_key <= tenth) or \
+                    (new_key is not None and new_key <= tenth):
+                self.versions[board] += 1
+
+    def position(self, board: Board, user_id):
+        """(rank, displayed value) of the player or None if the player is not on the board"""
+        key = self._keys[board].get(user_id)
+        if key is None:
+            return None
+
+        return self._boards[board].rank((key[0],)) + 1, BOARDS[board](self._stats[user_id])[1]
+
+    def top(self, board: Board, count=10):
+        """[(user_id, rank, displayed value)] of the best players"""
+        result = []
+        ordered = self._boards[board]
+        for key in ordered.head(count):
+            user_id = key[1]
+            result.append((user_id, ordered.rank((key[0],)) + 1, BOARDS[board](self._stats[user_id])[1]))
+
+        return result
+
+
+# Board: array type code of the displayed value
+SNAPSHOT_TYPES = {
+    Board.WIN: 'q',
+    Board.WINRATE: 'q',
+    Board.SCORE: 'd',
+    Board.GAMES: 'q',
+    Board.PROFIT: 'd',
+}
+
+
+class Snapshot:
+    """Read-only result of a full ranking stored column by column.
+
+    Rows are ordered by user_id, so the user_id column is the index: a bisect finds the row and
+    every board is two flat arrays of ranks and values. Rank 0 means the player is not on the board.
+    Players created after the snapshot was taken are shown at position 0, until the next refresh.
+    """
+
+    __slots__ = ('user_ids', 'ranks', 'values', 'tops', 'versions', 'created')
+
+    def __init__(self, rows, versions=None):
+        """
+        :param rows: rows ordered by user_id with user_id and <board>_value, <board>_position for every board
+        :param versions: versions of the previous snapshot
+        """
+        self.user_ids = array('q')
+        self.ranks = {board: array('i') for board in Board}
+        self.values = {board: array(SNAPSHOT_TYPES[board]) for board in Board}
+        self.versions = {board: (versions or {}).get(board, 0) + 1 for board in Board}
+        self.created = set()
+
+        columns = [(f'{board.value}_position', f'{board.value}_value', self.ranks[board], self.values[board])
+                   for board in Board]
+
+        for row in rows:
+            self.user_ids.append(row['user_id'])
+            for rank_column, value_column, ranks, values in columns:
+                ranks.append(row[rank_column] or 0)
+                values.append(row[value_column] or 0)
+
+        self.tops = {}
+        for board in Board:
+            ranks = self.ranks[board]
+            ranked = (row for row in range(len(ranks)) if ranks[row])
+            self.tops[board] = heapq.nsmallest(10, ranked, key=lambda row: (ranks[row], self.user_ids[row]))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return self._row(user_id) is not None or user_id in self.created
+
+    def _row(self, user_id):
+        row = bisect_left(self.user_ids, user_id)
+        return row if row < len(self.user_ids) and self.user_ids[row] == user_id else None
+
+    def create(self, user_id):
+        if self._row(user_id) is None:
+            self.created.add(user_id)
+
+    def apply(self, user_id, **deltas):
+        pass
+
+    def set(self, user_id, **values):
+        pass
+
+    def position(self, board: Board, user_id):
+        row = self._row(user_id)
+        if row is None:
+            return (0, 0) if user_id in self.created and board is not Board.WINRATE else None
+
+        rank = self.ranks[board][row]
+        return (rank, self.values[board][row]) if rank else None
+
+    def top(self, board: Board, count=10):
+        return [(self.user_ids[row], self.ranks[board][row], self.values[board][row])
+                for row in self.tops[board][:count]]
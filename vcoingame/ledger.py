@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import weakref
+
+from enum import Enum
+
+from vk_api import tracing
+
+from vcoingame.database import Database
+
+logger = logging.getLogger('vcoingame.ledger')
+
+
+class Reason(Enum):
+    BET = 1
+    PAYOUT = 2
+    DEPOSIT = 3
+    WITHDRAWAL = 4
+    RAISE = 5
+    # The balance set by hand, the amount is the difference
+    ADJUSTMENT = 6
+
+
+class Entry:
+    __slots__ = ('user_id', 'amount', 'reason', 'reference')
+
+    def __init__(self, user_id, amount, reason: Reason, reference=None):
+        """
+        :param amount: signed change of the balance
+        :param reference: what caused it, e.g. the message or the transaction
+        """
+        self.user_id = user_id
+        self.amount = amount
+        self.reason = reason
+        self.reference = reference
+
+    def __str__(self):
+        return f'[Entry] User: {self.user_id}; Amount: {self.amount}; Reason: {self.reason.name}'
+
+
+class Ledger:
+    """Append-only history of balance changes, user_scores.score is the running total of it.
+
+    Every change of a balance is an entry written in the same transaction as the change of the total.
+    Entries of the game are group committed in the background: record() only queues the entry, the score
+    in memory is what the game relies on. While one batch is being written the next one fills up, so under
+    load one transaction carries many entries and an idle bot writes at once. A batch which cant be written
+    stays queued and is retried with a backoff, entries still queued when the process is killed are lost.
+    Deposits and withdrawals have transactions of their own and append their entries there.
+    """
+
+    # Database: its ledger, most processes have one database
+    _ledgers = weakref.WeakKeyDictionary()
+
+    def __init__(self, database: Database, max_batch=500, delay=0, retry_delay=1, max_retry_delay=60):
+        """
+        :param max_batch: most entries written in one transaction
+        :param delay: seconds a batch waits for more entries before it is written
+        :param retry_delay: first delay before a failed batch is written again, doubles with every failure
+        :param max_retry_delay: the retry delay never goes above it
+        """
+        self.database = database
+        self.max_batch = max_batch
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # Written entries and transactions, and failed attempts to write a batch
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+
+        self._queue = []
+        self._writer = None
+        self._retry = None
+        self._next_retry_delay = retry_delay
+
+    @staticmethod
+    def attach(database: Database, max_batch=500, delay=0) -> 'Ledger':
+        ledger = Ledger._ledgers[database] = Ledger(database, max_batch, delay)
+        return ledger
+
+    @staticmethod
+    def of(database: Database) -> 'Ledger':
+        """Ledger of the database, with the default batching if none has been attached"""
+        ledger = Ledger._ledgers.get(database)
+        if ledger is None:
+            ledger = Ledger.attach(database)
+        return ledger
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def record(self, user_id, amount, reason: Reason, reference=None):
+        """Queues the change of the balance by the amount, it is written in the background"""
+        self._queue.append(Entry(user_id, amount, reason, reference))
+
+        # While a retry is scheduled the database is not bothered by every new entry
+        if self._writer is None and self._retry is None:
+            self._start()
+
+    async def flush(self):
+        """Writes every entry queued so far, raises the error of the database if they cant be written now"""
+        # Entries are written in the order they are queued, the ones queued later are not waited for
+        target = self.written + len(self._queue)
+        while self.written < target:
+            if self._writer is None:
+                self._start()
+
+            error = await asyncio.shield(self._writer)
+            if error is not None:
+                raise error
+
+    def _start(self):
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+
+        # Shared by every player, its batches are no part of the update which happened to queue the first entry
+        self._writer = tracing.detached(self._write())
+
+    async def _write(self):
+        """Returns the error which stopped the writing, the entries stay queued"""
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+            while self._queue:
+                entries = self._queue[:self.max_batch]
+                await self.database.run_in_transaction(lambda conn: Ledger._commit(conn, entries))
+                del self._queue[:len(entries)]
+
+                self.written += len(entries)
+                self.batches += 1
+                self._next_retry_delay = self.retry_delay
+                logger.debug(f'Ledger batch of {len(entries)} entries has been written')
+        except Exception as e:
+            self.failures += 1
+            delay, self._next_retry_delay = self._next_retry_delay, min(self._next_retry_delay * 2,
+                                                                        self.max_retry_delay)
+            logger.exception(f'Cant write {len(self._queue)} ledger entries, retrying in {delay:.1f}s')
+            self._retry = asyncio.get_event_loop().call_later(delay, self._start)
+            return e
+        finally:
+            self._writer = None
+
+    @staticmethod
+    async def _commit(conn, entries):
+        await Ledger.append(conn, entries)
+        await Ledger._apply(conn, entries)
+
+    @staticmethod
+    async def append(conn, entries):
+        """Adds the entries in the connection's transaction, the totals are changed by the caller"""
+        await conn.execute(
+            '''INSERT INTO ledger (user_id, amount, reason, reference)
+               SELECT * FROM unnest(($1::int[]), ($2::bigint[]), ($3::smallint[]), ($4::text[]))''',
+            [entry.user_id for entry in entries],
+            [entry.amount for entry in entries],
+            [entry.reason.value for entry in entries],
+            [entry.reference for entry in entries])
+
+    @staticmethod
+    async def lock(conn, user_ids):
+        """Locks the score rows in the order of user ids, so transactions changing many players at once
+        never deadlock each other. Changes of many rows in one UPDATE lock them in no particular order
+        """
+        await conn.execute(
+            '''SELECT user_id FROM user_scores WHERE user_id = ANY($1::int[]) ORDER BY user_id FOR UPDATE''',
+            user_ids)
+
+    @staticmethod
+    async def _apply(conn, entries):
+        user_ids = [entry.user_id for entry in entries]
+        await Ledger.lock(conn, user_ids)
+        await conn.execute(
+            '''UPDATE user_scores SET score = score + d.amount
+               FROM (SELECT user_id, sum(amount)::bigint as amount
+                     FROM unnest(($1::int[]), ($2::bigint[])) as t (user_id, amount)
+                     GROUP BY user_id) d
+               WHERE user_scores.user_id = d.user_id''',
+            user_ids, [entry.amount for entry in entries])
+
+    async def reconcile(self):
+        """Players whose score is not the total of their entries, as (user_id, score, total) rows.
+
+        An entry and the change of its total are committed together, so a running bot gives none
+        """
+        return await self.database.fetch(
+            '''SELECT user_scores.user_id, user_scores.score, coalesce(l.total, 0)::bigint as total
+               FROM user_scores LEFT JOIN (SELECT user_id, sum(amount)::bigint as total FROM ledger
+                                           GROUP BY user_id) l ON l.user_id = user_scores.user_id
+               WHERE user_scores.score <> coalesce(l.total, 0)
+               ORDER BY user_scores.user_id''')
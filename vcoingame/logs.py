@@ -0,0 +1,185 @@
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+from vcoingame.config import Config
+
+TEXT_FORMAT = '%(levelname)-5s [%(asctime)s] %(name)s %(message)s'
+
+# Attributes every record has, anything else came from extra and is a field
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _quote(value):
+    value = str(value)
+    if value and not any(char in value for char in ' "=\n'):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _fields(record):
+    """key=value pairs of the fields passed in extra"""
+    return [f'{key}={_quote(value)}' for key, value in vars(record).items() if key not in STANDARD_ATTRIBUTES]
+
+
+class KeyValueFormatter(logging.Formatter):
+    """One line of key=value pairs per record: time, level, logger, msg and the fields passed in extra"""
+
+    def __init__(self, datefmt='%Y-%m-%dT%H:%M:%S'):
+        super().__init__(datefmt=datefmt)
+        self._second = None
+        self._time = None
+
+    def formatTime(self, record, datefmt=None):
+        # Many records share a second, strftime is the slowest part of a record
+        second = int(record.created)
+        if second != self._second:
+            self._time = time.strftime(self.datefmt, self.converter(second))
+            self._second = second
+        return self._time
+
+    def format(self, record):
+        pairs = [
+            f'time={self.formatTime(record)}',
+            f'level={record.levelname}',
+            f'logger={record.name}',
+            f'msg={_quote(record.getMessage())}',
+        ]
+        pairs.extend(_fields(record))
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            pairs.append(f'exc={_quote(record.exc_text)}')
+
+        return ' '.join(pairs)
+
+
+class TextFormatter(logging.Formatter):
+    """TEXT_FORMAT followed by the fields passed in extra, an exception goes on the next lines"""
+
+    def __init__(self, datefmt='%H:%M:%S'):
+        super().__init__(TEXT_FORMAT, datefmt=datefmt)
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        fields = _fields(record)
+        return message + ' ' + ' '.join(fields) if fields else message
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one of every N records below WARNING of a logger, N is set for the logger or its nearest parent.
+
+    Kept records get a sampled=N field, so whoever reads the logs can scale the counts back.
+    """
+
+    def __init__(self, rates: dict = None):
+        super().__init__()
+        self.rates = {}
+        self._cache = {}
+        self._counters = {}
+        self.set_rates(rates or {})
+
+    def set_rates(self, rates: dict):
+        self.rates = dict(rates)
+        self._cache = {}
+
+    def _rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            parent = name
+            while parent not in self.rates and '.' in parent:
+                parent = parent.rpartition('.')[0]
+            rate = self._cache[name] = self.rates.get(parent, 1)
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+
+        rate = self._rate(record.name)
+        if rate <= 1:
+            return True
+
+        count = self._counters.get(record.name, 0)
+        self._counters[record.name] = count + 1
+        if count % rate:
+            return False
+
+        record.sampled = rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Only the message is rendered on the event loop, the arguments may change after the call.
+        # Formatting and writing are left to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class LogPipeline:
+    """Logging of the bot: records are put on a queue by the event loop and formatted and written
+    by a listener thread, so a slow console never blocks the loop.
+
+    configure() applies DEBUG, LOG_LEVELS and LOG_SAMPLING, it is called again after a config reload,
+    so the level of one subsystem can be raised without a restart.
+    """
+
+    def __init__(self):
+        self.sampling = SamplingFilter()
+        self.listener = None
+        self._levels = {}
+
+    def start(self, config: Config, handler: logging.Handler = None):
+        """
+        :param handler: where records are written, stderr if not given
+        """
+        if handler is None:
+            handler = logging.StreamHandler()
+            if config.log_format == 'text':
+                handler.setFormatter(TextFormatter())
+            else:
+                handler.setFormatter(KeyValueFormatter())
+
+        # No record needs the thread or the process, looking them up costs on every call. The formats leave out
+        # the file and line of the call too, but logging still looks them up: it can be turned off only through
+        # a private global of the logging module, which would change every logger of the process
+        logging.logThreads = False
+        logging.logMultiprocessing = False
+
+        records = queue.SimpleQueue()
+        queue_handler = _QueueHandler(records)
+        queue_handler.addFilter(self.sampling)
+
+        root = logging.getLogger()
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+        root.addHandler(queue_handler)
+
+        self.listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+
+        self.configure(config)
+
+    def configure(self, config: Config):
+        logging.getLogger().setLevel(logging.DEBUG if config.debug else logging.INFO)
+
+        for name in self._levels.keys() - config.log_levels.keys():
+            logging.getLogger(name).setLevel(logging.NOTSET)
+        for name, level in config.log_levels.items():
+            logging.getLogger(name).setLevel(level)
+        self._levels = dict(config.log_levels)
+
+        self.sampling.set_rates(config.log_sampling)
+
+    def stop(self):
+        """Writes the records left on the queue"""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
@@ -0,0 +1,190 @@
+import json
+import time
+import asyncio
+import logging
+
+from array import array
+
+from vk_api import tracing
+from vk_api.api import API
+
+from vcoingame.database import Database
+
+logger = logging.getLogger('vcoingame.membership')
+
+
+class Membership:
+    """Members of the group with O(1) lookup.
+
+    Kept up to date by join and leave events and reconciled with VK from time to time, so events
+    missed while the bot was down are fixed too. Events that come during a reconciliation are applied
+    on top of the fetched list. Every reconciliation is saved to the database, so the next start
+    can serve from the snapshot right away and reconcile in the background.
+    """
+
+    PAGE_SIZE = 1000
+    # groups.getMembers calls in one execute, the limit of VK
+    PAGES_PER_EXECUTE = 25
+
+    def __init__(self, api: API, group_id, database: Database = None, concurrency=3, on_reconcile=None):
+        """
+        :param concurrency: number of execute requests sent at the same time
+        :param on_reconcile: called with the membership after every reconciliation
+        """
+        self.api = api
+        self.group_id = group_id
+        self.database = database
+        self.concurrency = concurrency
+        self.on_reconcile = on_reconcile
+        self._members = set()
+        self._changes = None
+        self.loaded = False
+
+    def __contains__(self, user_id):
+        return user_id in self._members
+
+    def __len__(self):
+        return len(self._members)
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def add(self, user_id):
+        if self._changes is not None:
+            self._changes[user_id] = True
+        if user_id in self._members:
+            return False
+
+        self._members.add(user_id)
+        return True
+
+    def remove(self, user_id):
+        if self._changes is not None:
+            self._changes[user_id] = False
+        if user_id not in self._members:
+            return False
+
+        self._members.discard(user_id)
+        return True
+
+    def _get_members_code(self, offsets):
+        calls = [
+            'API.groups.getMembers(' + json.dumps(
+                {'group_id': self.group_id, 'offset': offset, 'count': self.PAGE_SIZE}) + ')'
+            for offset in offsets
+        ]
+        return f"return [{','.join(calls)}];"
+
+    async def _fetch_pages(self, offsets, semaphore):
+        async with semaphore:
+            response = await self.api.execute(code=self._get_members_code(offsets))
+
+        if not response or not all(response):
+            raise RuntimeError(f'Cant get members from offset {offsets[0]}')
+
+        return [user_id for page in response for user_id in page.get('items')]
+
+    async def fetch(self):
+        """Fetches all members, the first page alone and the rest up to 25 pages per request"""
+        start = time.monotonic()
+
+        response = await self.api.groups.getMembers(group_id=self.group_id, offset=0, count=self.PAGE_SIZE)
+        members = list(response.get('items'))
+
+        offsets = list(range(self.PAGE_SIZE, response.get('count'), self.PAGE_SIZE))
+        chunks = [offsets[i:i + self.PAGES_PER_EXECUTE] for i in range(0, len(offsets), self.PAGES_PER_EXECUTE)]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        for items in await asyncio.gather(*[self._fetch_pages(chunk, semaphore) for chunk in chunks]):
+            members.extend(items)
+
+        elapsed = time.monotonic() - start
+        pages = len(offsets) + 1
+        logger.info(f'Members have been fetched in {elapsed:.2f}s. Pages: {pages}; Requests: {len(chunks) + 1}; '
+                    f'Pages per second: {pages / elapsed if elapsed else pages:.1f}')
+
+        return members
+
+    def to_bytes(self):
+        return array('q', self._members).tobytes()
+
+    def replace(self, members: bytes):
+        """Replaces all members with the ones packed by to_bytes()"""
+        snapshot = array('q')
+        snapshot.frombytes(members)
+        self._members = set(snapshot)
+        self.loaded = True
+
+    async def load_snapshot(self):
+        if not self.database:
+            return False
+
+        members = await self.database.fetchval(
+            '''SELECT members FROM member_snapshots WHERE group_id = ($1::int)''', self.group_id)
+        if members is None:
+            return False
+
+        self.replace(members)
+
+        logger.info(f'Members have been loaded from the snapshot. Members: {len(self)}')
+        return True
+
+    async def save_snapshot(self):
+        if not self.database:
+            return
+
+        await self.database.execute(
+            '''INSERT INTO member_snapshots (group_id, members) VALUES (($1::int), ($2::bytea))
+               ON CONFLICT (group_id) DO UPDATE SET members = excluded.members, updated_at = now()''',
+            self.group_id, self.to_bytes())
+
+    async def reconcile(self):
+        self._changes = {}
+        try:
+            members = set(await self.fetch())
+        finally:
+            changes, self._changes = self._changes, None
+
+        for user_id, joined in changes.items():
+            if joined:
+                members.add(user_id)
+            else:
+                members.discard(user_id)
+
+        joined, left = len(members - self._members), len(self._members - members)
+        self._members = members
+        self.loaded = True
+
+        logger.info(f'Members have been reconciled. Members: {len(members)}; Joined: {joined}; Left: {left}')
+
+        await self.save_snapshot()
+        if self.on_reconcile:
+            self.on_reconcile(self)
+
+    async def initial(self):
+        """Serves from the snapshot if there is one, reconciling in the background, otherwise fetches members"""
+        start = time.monotonic()
+        try:
+            loaded = await self.load_snapshot()
+        except Exception:
+            logger.exception('Cant load the members snapshot')
+            loaded = False
+
+        if loaded:
+            tracing.detached(self._reconcile_safely())
+        else:
+            await self.reconcile()
+
+        logger.info(f'Members are ready in {time.monotonic() - start:.2f}s')
+        return self
+
+    async def _reconcile_safely(self):
+        try:
+            await self.reconcile()
+        except Exception:
+            logger.exception('Cant reconcile members')
+
+    async def start(self, interval=3600):
+        while True:
+            await asyncio.sleep(interval)
+            await self._reconcile_safely()
@@ -0,0 +1,746 @@
+"""In-process backend with the interface of Database, for benchmarks and simulations without Postgres.
+
+Only the statements the bot sends are understood: every one is matched by its text, whitespace aside, and
+answered from dicts indexed like the tables in Postgres. Any other statement raises UnsupportedStatement,
+so a query changed in the code fails loudly instead of getting wrong rows. A change of a query has to be
+made here too.
+
+Statements are atomic. Transactions run one at a time and are rolled back by undoing their changes on an
+exception, statements outside of a transaction may see the changes of a transaction not finished yet.
+The schema is always the latest one, migrations have nothing to apply. The data lives in one process,
+so it does not work with WORKERS above 1.
+"""
+import asyncio
+import logging
+import asyncpg
+
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+
+from vk_api import tracing
+
+from vcoingame.database import Database, _statement
+from vcoingame.migrations import MIGRATIONS
+
+logger = logging.getLogger('vcoingame.memory_database')
+
+# Normalized text of a statement: its implementation
+STATEMENTS = {}
+# The same by the text as it is in the code, queries are constants
+_implementations = {}
+
+
+class UnsupportedStatement(NotImplementedError):
+    pass
+
+
+def _normalize(query):
+    return ' '.join(query.split())
+
+
+def statement(query):
+    """Registers the method as the implementation of the statement"""
+    def register(method):
+        STATEMENTS[_normalize(query)] = method
+        return method
+
+    return register
+
+
+class Record(tuple):
+    """Row with access by column name and by index, like asyncpg.Record"""
+    __slots__ = ()
+    columns = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.columns[key]
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.columns else default
+
+    def keys(self):
+        return iter(self.columns)
+
+    def values(self):
+        return iter(self)
+
+    def items(self):
+        return zip(self.columns, self)
+
+    def __repr__(self):
+        return '<Record ' + ' '.join(f'{key}={value!r}' for key, value in self.items()) + '>'
+
+
+def record_type(*columns):
+    return type('Record', (Record,), {'__slots__': (), 'columns': {column: i for i, column in enumerate(columns)}})
+
+
+def _rows(record, rows, columns):
+    return [record(row[column] for column in columns) for row in rows]
+
+
+def _ranks(rows, key):
+    """user_id: rank() over (order by key desc)"""
+    ranks, previous, rank = {}, None, 0
+    for number, row in enumerate(sorted(rows, key=key, reverse=True), 1):
+        value = key(row)
+        if value != previous:
+            rank, previous = number, value
+        ranks[row['user_id']] = rank
+    return ranks
+
+
+def _round(value):
+    # round() of Postgres rounds halves away from zero
+    return int(value + 0.5) if value >= 0 else -int(-value + 0.5)
+
+
+def _user_score(user_id, score, max_bet):
+    return {
+        'user_id': user_id, 'score': score, 'max_bet': max_bet, 'current_bet': 0, 'state': -1, 'win': 0,
+        'lose': 0, 'bet': 0, 'prize': 0, 'deposit': 0, 'withdraw': 0, 'last_active': None,
+    }
+
+
+VALUE = record_type('value')
+SCORE_ROW = record_type('user_id', 'score', 'max_bet', 'current_bet', 'state')
+DONATION = record_type('user_id', 'coins')
+LEADERBOARD_ROW = record_type('user_id', 'score', 'win', 'lose', 'bet', 'prize')
+SNAPSHOT_ROW = record_type('user_id', 'win_value', 'win_position', 'winrate_value', 'winrate_position',
+                           'score_value', 'score_position', 'games_value', 'games_position',
+                           'profit_value', 'profit_position')
+TID = record_type('tid')
+DEPOSIT = record_type('tid', 'from_id', 'amount')
+JOB = record_type('id', 'to_id', 'amount', 'attempts', 'batch_id')
+ID = record_type('id')
+REFUND = record_type('id', 'to_id', 'amount')
+QUEUE_STATS = record_type('depth', 'oldest_age')
+PROGRESS = record_type('id', 'recipients', 'status', 'sent', 'failed', 'total', 'created_at', 'updated_at',
+                       'finished_at')
+USER_ID = record_type('user_id')
+MISMATCH = record_type('user_id', 'score', 'total')
+BROADCAST = record_type('id', 'message', 'keyboard', 'recipients', 'last_user_id', 'sent', 'failed', 'total')
+
+
+class _Connection:
+    """Connection as given by Database.transaction(), the changes of a transaction are recorded to undo them"""
+
+    def __init__(self, database, undo=None):
+        self.database = database
+        self.undo = undo
+
+    async def execute(self, query, *args):
+        return self.database._run(self, query, args, 'execute')
+
+    async def fetchval(self, query, *args):
+        rows = self.database._run(self, query, args, 'fetchval')
+        return rows[0][0] if rows else None
+
+    async def fetchrow(self, query, *args):
+        rows = self.database._run(self, query, args, 'fetchrow')
+        return rows[0] if rows else None
+
+    async def fetch(self, query, *args):
+        return self.database._run(self, query, args, 'fetch') or []
+
+
+class MemoryDatabase(Database):
+    """Database for the dsn memory://, see the module docstring"""
+
+    def __init__(self):
+        super().__init__()
+        self.user_scores = {}
+        # Nothing the bot does adds used codes, the sum of coins of a player is the index the queries need
+        self.used_codes = {}
+        self.transactions = {}
+        self.transfers = {}
+        self.transfer_keys = {}
+        self.pending_transfers = {}
+        self.member_snapshots = {}
+        self.broadcasts = {}
+        self.ledger = {}
+        self.schema_migrations = {migration.version: migration.name for migration in MIGRATIONS}
+
+        self._sequences = {'transfers': 0, 'broadcasts': 0, 'ledger': 0}
+        self._autocommit = _Connection(self)
+        self._lock = None
+
+    async def initial(self, dsn=None):
+        self._lock = asyncio.Lock()
+        return self
+
+    async def close(self):
+        pass
+
+    @property
+    def load(self):
+        return 0
+
+    @asynccontextmanager
+    async def transaction(self):
+        with tracing.span('db.transaction'):
+            async with self._lock:
+                conn = _Connection(self, [])
+                try:
+                    yield conn
+                except BaseException:
+                    for undo in reversed(conn.undo):
+                        undo()
+                    raise
+
+    async def execute(self, query, *args):
+        return await self._autocommit.execute(query, *args)
+
+    async def fetchval(self, query, *args):
+        return await self._autocommit.fetchval(query, *args)
+
+    async def fetchrow(self, query, *args):
+        return await self._autocommit.fetchrow(query, *args)
+
+    async def fetch(self, query, *args):
+        return await self._autocommit.fetch(query, *args)
+
+    def _run(self, conn: _Connection, query, args, method):
+        logger.debug('%s; %s', query, args)
+        implementation = _implementations.get(query)
+        if implementation is None:
+            implementation = STATEMENTS.get(_normalize(query))
+            if implementation is None:
+                raise UnsupportedStatement(f'{_statement(query)} is not supported by the in-memory database')
+            _implementations[query] = implementation
+
+        with tracing.span(f'db.{method}', statement=_statement(query)):
+            return implementation(self, conn, *args)
+
+    # Changes of rows, undone if the transaction fails
+
+    def _insert(self, conn, table: dict, key, row, index: dict = None, index_key=None):
+        table[key] = row
+        if index is not None:
+            index[index_key] = key
+        if conn.undo is not None:
+            def undo():
+                table.pop(key, None)
+                if index is not None:
+                    index.pop(index_key, None)
+            conn.undo.append(undo)
+
+    def _update(self, conn, row: dict, **values):
+        if conn.undo is not None:
+            old = {column: row[column] for column in values}
+            conn.undo.append(lambda: row.update(old))
+        row.update(values)
+
+    def _next(self, sequence):
+        # Like sequences in Postgres, a rolled back transaction does not give the number back
+        self._sequences[sequence] += 1
+        return self._sequences[sequence]
+
+    def _user_column(self, conn, user_id, column, value):
+        row = self.user_scores.get(user_id)
+        if row is not None:
+            self._update(conn, row, **{column: value(row)})
+
+    def _pending(self, conn, row, pending):
+        """Keeps the partial index of pending transfers"""
+        if pending:
+            self.pending_transfers[row['id']] = row
+        else:
+            self.pending_transfers.pop(row['id'], None)
+
+        if conn.undo is not None:
+            was_pending = not pending
+            conn.undo.append(lambda: self._pending(_Connection(self), row, was_pending))
+
+    def _set_transfer_status(self, conn, row, status, **values):
+        self._update(conn, row, status=status, **values)
+        pending = status == 0
+        if pending != (row['id'] in self.pending_transfers):
+            self._pending(conn, row, pending)
+
+    # Score
+
+    @statement('''SELECT COUNT(*) FROM user_scores WHERE user_id = ($1::int)''')
+    def _score_exists(self, conn, user_id):
+        return [VALUE((int(user_id in self.user_scores),))]
+
+    @statement('''INSERT INTO user_scores (user_id, score, max_bet) VALUES (($1::int), ($2::bigint), ($3::bigint))''')
+    def _create_score(self, conn, user_id, score, max_bet):
+        if user_id in self.user_scores:
+            raise asyncpg.UniqueViolationError(
+                'duplicate key value violates unique constraint "user_scores_pkey"')
+        self._insert(conn, self.user_scores, user_id, _user_score(user_id, score, max_bet))
+
+    @statement('''UPDATE user_scores SET score = ($1::bigint) WHERE user_id = ($2::int)''')
+    def _set_score(self, conn, amount, user_id):
+        self._user_column(conn, user_id, 'score', lambda row: amount)
+
+    def _user_value(self, user_id, column):
+        row = self.user_scores.get(user_id)
+        return [VALUE((row[column],))] if row is not None else None
+
+    @statement('''SELECT score FROM user_scores WHERE user_id = ($1::int)''')
+    def _get_score(self, conn, user_id):
+        return self._user_value(user_id, 'score')
+
+    @statement('''SELECT score FROM user_scores WHERE user_id = ($1::int) FOR UPDATE''')
+    def _lock_score(self, conn, user_id):
+        # Transactions already run one at a time
+        return self._user_value(user_id, 'score')
+
+    # Session
+
+    @statement('''SELECT sum(coins) FROM used_codes WHERE user_id = ($1::int)''')
+    def _donation_amount(self, conn, user_id):
+        return [VALUE((self.used_codes.get(user_id),))]
+
+    @statement('''SELECT max_bet FROM user_scores WHERE user_id = ($1::int)''')
+    def _get_max_bet(self, conn, user_id):
+        return self._user_value(user_id, 'max_bet')
+
+    @statement('''SELECT current_bet FROM user_scores WHERE user_id = ($1::int)''')
+    def _get_bet(self, conn, user_id):
+        return self._user_value(user_id, 'current_bet')
+
+    @statement('''SELECT state FROM user_scores WHERE user_id = ($1::int)''')
+    def _get_state(self, conn, user_id):
+        return self._user_value(user_id, 'state')
+
+    @statement('''UPDATE user_scores SET max_bet = max_bet + ($1::bigint) WHERE user_id = ($2::int)''')
+    def _add_max_bet(self, conn, max_bet, user_id):
+        self._user_column(conn, user_id, 'max_bet', lambda row: row['max_bet'] + max_bet)
+
+    @statement('''UPDATE user_scores SET current_bet = ($1::bigint) WHERE user_id = ($2::int)''')
+    def _set_bet(self, conn, bet, user_id):
+        self._user_column(conn, user_id, 'current_bet', lambda row: bet)
+
+    @statement('''UPDATE user_scores SET state = ($1::smallint) WHERE user_id = ($2::int)''')
+    def _set_state_only(self, conn, state, user_id):
+        self._user_column(conn, user_id, 'state', lambda row: state)
+
+    @statement('''UPDATE user_scores SET state = ($1::smallint), last_active = now() WHERE user_id = ($2::int)''')
+    def _set_state(self, conn, state, user_id):
+        row = self.user_scores.get(user_id)
+        if row is not None:
+            self._update(conn, row, state=state, last_active=datetime.now())
+
+    @statement('''SELECT user_id, score, max_bet, current_bet, state FROM user_scores
+                  WHERE user_id = ANY($1::int[])''')
+    def _score_rows(self, conn, user_ids):
+        rows = (self.user_scores.get(user_id) for user_id in set(user_ids))
+        return _rows(SCORE_ROW, [row for row in rows if row is not None], SCORE_ROW.columns)
+
+    @statement('''SELECT user_id, score, max_bet, current_bet, state FROM user_scores
+                  ORDER BY last_active DESC NULLS LAST
+                  LIMIT ($1::int)''')
+    def _recent_score_rows(self, conn, limit):
+        rows = sorted(self.user_scores.values(), key=lambda row: (row['last_active'] is not None, row['last_active']
+                                                                  or datetime.min), reverse=True)
+        return _rows(SCORE_ROW, rows[:limit] if limit is not None else rows, SCORE_ROW.columns)
+
+    @statement('''SELECT user_id, sum(coins) as coins FROM used_codes
+                  WHERE user_id = ANY($1::int[])
+                  GROUP BY user_id''')
+    def _donations(self, conn, user_ids):
+        return [DONATION((user_id, self.used_codes[user_id])) for user_id in set(user_ids) if user_id in self.used_codes]
+
+    # Statistics
+
+    def _increment(column, parameter=True):
+        def increment(self, conn, *args):
+            value, user_id = args if parameter else (1, args[0])
+            self._user_column(conn, user_id, column, lambda row: row[column] + value)
+        return increment
+
+    _add_win = statement('''UPDATE user_scores SET win = win + 1 WHERE user_id = ($1::int)''')(
+        _increment('win', parameter=False))
+    _add_lose = statement('''UPDATE user_scores SET lose = lose + 1 WHERE user_id = ($1::int)''')(
+        _increment('lose', parameter=False))
+    _add_bet = statement('''UPDATE user_scores SET bet = bet + ($1::bigint) WHERE user_id = ($2::int)''')(
+        _increment('bet'))
+    _add_prize = statement('''UPDATE user_scores SET prize = prize + ($1::bigint) WHERE user_id = ($2::int)''')(
+        _increment('prize'))
+    _add_deposit = statement('''UPDATE user_scores SET deposit = deposit + ($1::bigint) WHERE user_id = ($2::int)''')(
+        _increment('deposit'))
+    _add_withdraw = statement(
+        '''UPDATE user_scores SET withdraw = withdraw + ($1::bigint) WHERE user_id = ($2::int)''')(
+        _increment('withdraw'))
+    del _increment
+
+    # Top
+
+    @statement('''SELECT user_id, score, win, lose, bet, prize FROM user_scores''')
+    def _leaderboard(self, conn):
+        return _rows(LEADERBOARD_ROW, self.user_scores.values(), LEADERBOARD_ROW.columns)
+
+    @statement('''SELECT user_id,
+                         win as win_value,
+                         rank() over (order by win desc) as win_position,
+                         CASE WHEN win + lose > 20 THEN round((win::float / (win + lose)) * 100)::int END as winrate_value,
+                         CASE WHEN win + lose > 20 THEN rank() over (
+                             partition by win + lose > 20 order by win::float / nullif(win + lose, 0) desc) END
+                             as winrate_position,
+                         score::float / 1000 as score_value,
+                         rank() over (order by score desc) as score_position,
+                         win + lose as games_value,
+                         rank() over (order by win + lose desc) as games_position,
+                         (prize - bet)::float / 1000 as profit_value,
+                         rank() over (order by prize - bet desc) as profit_position
+                  FROM user_scores
+                  ORDER BY user_id''')
+    def _snapshot(self, conn):
+        rows = list(self.user_scores.values())
+        ranked = [row for row in rows if row['win'] + row['lose'] > 20]
+
+        win = _ranks(rows, lambda row: row['win'])
+        winrate = _ranks(ranked, lambda row: row['win'] / (row['win'] + row['lose']))
+        score = _ranks(rows, lambda row: row['score'])
+        games = _ranks(rows, lambda row: row['win'] + row['lose'])
+        profit = _ranks(rows, lambda row: row['prize'] - row['bet'])
+
+        result = []
+        for row in sorted(rows, key=lambda row: row['user_id']):
+            user_id, games_value = row['user_id'], row['win'] + row['lose']
+            result.append(SNAPSHOT_ROW((
+                user_id,
+                row['win'], win[user_id],
+                _round(row['win'] / games_value * 100) if games_value > 20 else None, winrate.get(user_id),
+                row['score'] / 1000, score[user_id],
+                games_value, games[user_id],
+                (row['prize'] - row['bet']) / 1000, profit[user_id],
+            )))
+        return result
+
+    # TransactionManager
+
+    @statement('''SELECT tid FROM transactions ORDER BY tid DESC LIMIT 1000''')
+    def _transaction_ids(self, conn):
+        return [TID((tid,)) for tid in sorted(self.transactions, reverse=True)[:1000]]
+
+    @statement('''INSERT INTO transactions (from_id, to_id, amount, created_at, tid)
+                  VALUES (($1::int), ($2::int), ($3::bigint), ($4::timestamp), ($5::int))''')
+    def _save_transaction(self, conn, from_id, to_id, amount, created_at, tid):
+        if tid in self.transactions:
+            raise asyncpg.UniqueViolationError('duplicate key value violates unique constraint "transactions_pkey"')
+        self._insert(conn, self.transactions, tid,
+                     {'tid': tid, 'from_id': from_id, 'to_id': to_id, 'amount': amount, 'created_at': created_at})
+
+    @statement('''INSERT INTO transactions (from_id, to_id, amount, created_at, tid)
+                  SELECT * FROM unnest(($1::int[]), ($2::int[]), ($3::bigint[]), ($4::timestamp[]), ($5::int[]))
+                  ON CONFLICT (tid) DO NOTHING
+                  RETURNING tid, from_id, amount''')
+    def _save_deposits(self, conn, from_ids, to_ids, amounts, created_ats, tids):
+        inserted = []
+        for from_id, to_id, amount, created_at, tid in zip(from_ids, to_ids, amounts, created_ats, tids):
+            if tid in self.transactions:
+                continue
+            self._insert(conn, self.transactions, tid,
+                         {'tid': tid, 'from_id': from_id, 'to_id': to_id, 'amount': amount, 'created_at': created_at})
+            inserted.append(DEPOSIT((tid, from_id, amount)))
+        return inserted
+
+    @statement('''UPDATE user_scores SET score = score + d.amount, deposit = deposit + d.amount
+                  FROM (SELECT user_id, sum(amount)::bigint as amount
+                        FROM unnest(($1::int[]), ($2::bigint[])) as t (user_id, amount)
+                        GROUP BY user_id) d
+                  WHERE user_scores.user_id = d.user_id''')
+    def _credit_deposits(self, conn, user_ids, amounts):
+        totals = {}
+        for user_id, amount in zip(user_ids, amounts):
+            totals[user_id] = totals.get(user_id, 0) + amount
+
+        for user_id, amount in totals.items():
+            row = self.user_scores.get(user_id)
+            if row is not None:
+                self._update(conn, row, score=row['score'] + amount, deposit=row['deposit'] + amount)
+
+    # TransferOutbox
+
+    @statement('''INSERT INTO transfers (idempotency_key, to_id, amount) VALUES (($1::text), ($2::int), ($3::bigint))
+                  ON CONFLICT (idempotency_key) DO NOTHING
+                  RETURNING id''')
+    def _add_transfer(self, conn, idempotency_key, to_id, amount):
+        if idempotency_key in self.transfer_keys:
+            return None
+
+        now = datetime.now()
+        transfer_id = self._next('transfers')
+        row = {
+            'id': transfer_id, 'idempotency_key': idempotency_key, 'to_id': to_id, 'amount': amount, 'status': 0,
+            'attempts': 0, 'next_attempt_at': now, 'created_at': now, 'claimed_at': None, 'sent_at': None,
+            'response': None, 'batch_id': None,
+        }
+        self._insert(conn, self.transfers, transfer_id, row, self.transfer_keys, idempotency_key)
+        self._pending(conn, row, True)
+        return [ID((transfer_id,))]
+
+    @statement('''UPDATE user_scores SET score = score - ($1::bigint), withdraw = withdraw + ($1::bigint)
+                  WHERE user_id = ($2::int) AND score >= ($1::bigint)
+                  RETURNING score''')
+    def _debit(self, conn, amount, user_id):
+        row = self.user_scores.get(user_id)
+        if row is None or row['score'] < amount:
+            return None
+
+        self._update(conn, row, score=row['score'] - amount, withdraw=row['withdraw'] + amount)
+        return [VALUE((row['score'],))]
+
+    @statement('''WITH lead AS (
+                      SELECT id, to_id FROM transfers
+                      WHERE status = ($2::smallint) AND next_attempt_at <= now()
+                      ORDER BY next_attempt_at, id
+                      LIMIT 1
+                      FOR UPDATE SKIP LOCKED
+                  ), jobs AS (
+                      SELECT transfers.id FROM transfers, lead
+                      WHERE transfers.to_id = lead.to_id
+                            AND transfers.status = ($2::smallint) AND transfers.next_attempt_at <= now()
+                      FOR UPDATE OF transfers SKIP LOCKED
+                  )
+                  UPDATE transfers SET status = ($1::smallint), attempts = attempts + 1, claimed_at = now(),
+                                       batch_id = (SELECT id FROM lead)
+                  WHERE id IN (SELECT id FROM jobs)
+                  RETURNING id, to_id, amount, attempts, batch_id''')
+    def _claim_transfers(self, conn, sending, pending):
+        now = datetime.now()
+        due = [row for row in self.pending_transfers.values()
+               if row['status'] == pending and row['next_attempt_at'] <= now]
+        if not due:
+            return []
+
+        lead = min(due, key=lambda row: (row['next_attempt_at'], row['id']))
+        jobs = [row for row in due if row['to_id'] == lead['to_id']]
+        for row in jobs:
+            self._set_transfer_status(conn, row, sending, attempts=row['attempts'] + 1, claimed_at=now,
+                                      batch_id=lead['id'])
+        return _rows(JOB, jobs, JOB.columns)
+
+    @statement('''UPDATE transfers SET status = ($1::smallint), response = ($2::text),
+                                       sent_at = CASE WHEN ($3::bool) THEN now() END
+                  WHERE id = ANY($4::bigint[])''')
+    def _finish_transfers(self, conn, status, response, done, ids):
+        now = datetime.now()
+        for transfer_id in ids:
+            row = self.transfers.get(transfer_id)
+            if row is not None:
+                self._set_transfer_status(conn, row, status, response=response, sent_at=now if done else None)
+
+    @statement('''UPDATE transfers SET status = ($1::smallint), response = ($2::text)
+                  WHERE id = ANY($3::bigint[]) AND status = ($4::smallint)
+                  RETURNING id, to_id, amount''')
+    def _fail_transfers(self, conn, status, response, ids, sending):
+        rows = [self.transfers[transfer_id] for transfer_id in ids
+                if transfer_id in self.transfers and self.transfers[transfer_id]['status'] == sending]
+        for row in rows:
+            self._set_transfer_status(conn, row, status, response=response)
+        return _rows(REFUND, rows, REFUND.columns)
+
+    @statement('''UPDATE user_scores SET score = score + ($1::bigint), withdraw = withdraw - ($1::bigint)
+                  WHERE user_id = ($2::int)''')
+    def _refund(self, conn, amount, user_id):
+        row = self.user_scores.get(user_id)
+        if row is not None:
+            self._update(conn, row, score=row['score'] + amount, withdraw=row['withdraw'] - amount)
+
+    @statement('''UPDATE transfers SET status = ($1::smallint), response = ($2::text),
+                                       next_attempt_at = now() + ($3::float) * interval '1 second'
+                  WHERE id = ANY($4::bigint[])''')
+    def _retry_transfers(self, conn, status, response, delay, ids):
+        next_attempt_at = datetime.now() + timedelta(seconds=delay)
+        for transfer_id in ids:
+            row = self.transfers.get(transfer_id)
+            if row is not None:
+                self._set_transfer_status(conn, row, status, response=response, next_attempt_at=next_attempt_at)
+
+    @statement('''UPDATE transfers SET status = ($1::smallint)
+                  WHERE status = ($2::smallint) AND claimed_at < now() - ($3::float) * interval '1 second'
+                  RETURNING id''')
+    def _recover_transfers(self, conn, unknown, sending, timeout):
+        deadline = datetime.now() - timedelta(seconds=timeout)
+        rows = [row for row in self.transfers.values()
+                if row['status'] == sending and row['claimed_at'] is not None and row['claimed_at'] < deadline]
+        for row in rows:
+            self._set_transfer_status(conn, row, unknown)
+        return [ID((row['id'],)) for row in rows]
+
+    @statement('''SELECT status FROM transfers WHERE id = ($1::bigint)''')
+    def _transfer_status(self, conn, transfer_id):
+        row = self.transfers.get(transfer_id)
+        return [VALUE((row['status'],))] if row is not None else None
+
+    @statement('''SELECT count(*) as depth, coalesce(extract(epoch from now() - min(created_at)), 0) as oldest_age
+                  FROM transfers
+                  WHERE status IN (($1::smallint), ($2::smallint))''')
+    def _transfer_stats(self, conn, *statuses):
+        rows = [row for row in self.transfers.values() if row['status'] in statuses]
+        oldest = min((row['created_at'] for row in rows), default=None)
+        return [QUEUE_STATS((len(rows), (datetime.now() - oldest).total_seconds() if oldest else 0))]
+
+    # Ledger
+
+    @statement('''INSERT INTO ledger (user_id, amount, reason, reference)
+                  SELECT * FROM unnest(($1::int[]), ($2::bigint[]), ($3::smallint[]), ($4::text[]))''')
+    def _append_entries(self, conn, user_ids, amounts, reasons, references):
+        now = datetime.now()
+        for user_id, amount, reason, reference in zip(user_ids, amounts, reasons, references):
+            entry_id = self._next('ledger')
+            self._insert(conn, self.ledger, entry_id, {
+                'id': entry_id, 'user_id': user_id, 'amount': amount, 'reason': reason, 'reference': reference,
+                'created_at': now,
+            })
+
+    @statement('''SELECT user_id FROM user_scores WHERE user_id = ANY($1::int[]) ORDER BY user_id FOR UPDATE''')
+    def _lock_scores(self, conn, user_ids):
+        # Transactions already run one at a time
+        return [USER_ID((user_id,)) for user_id in sorted(set(user_ids)) if user_id in self.user_scores]
+
+    @statement('''UPDATE user_scores SET score = score + d.amount
+                  FROM (SELECT user_id, sum(amount)::bigint as amount
+                        FROM unnest(($1::int[]), ($2::bigint[])) as t (user_id, amount)
+                        GROUP BY user_id) d
+                  WHERE user_scores.user_id = d.user_id''')
+    def _apply_entries(self, conn, user_ids, amounts):
+        totals = {}
+        for user_id, amount in zip(user_ids, amounts):
+            totals[user_id] = totals.get(user_id, 0) + amount
+
+        for user_id, amount in totals.items():
+            self._user_column(conn, user_id, 'score', lambda row: row['score'] + amount)
+
+    @statement('''SELECT user_scores.user_id, user_scores.score, coalesce(l.total, 0)::bigint as total
+                  FROM user_scores LEFT JOIN (SELECT user_id, sum(amount)::bigint as total FROM ledger
+                                              GROUP BY user_id) l ON l.user_id = user_scores.user_id
+                  WHERE user_scores.score <> coalesce(l.total, 0)
+                  ORDER BY user_scores.user_id''')
+    def _reconcile(self, conn):
+        totals = {}
+        for row in self.ledger.values():
+            totals[row['user_id']] = totals.get(row['user_id'], 0) + row['amount']
+
+        return [MISMATCH((user_id, row['score'], totals.get(user_id, 0)))
+                for user_id, row in sorted(self.user_scores.items()) if row['score'] != totals.get(user_id, 0)]
+
+    # Membership
+
+    @statement('''SELECT members FROM member_snapshots WHERE group_id = ($1::int)''')
+    def _member_snapshot(self, conn, group_id):
+        row = self.member_snapshots.get(group_id)
+        return [VALUE((row['members'],))] if row is not None else None
+
+    @statement('''INSERT INTO member_snapshots (group_id, members) VALUES (($1::int), ($2::bytea))
+                  ON CONFLICT (group_id) DO UPDATE SET members = excluded.members, updated_at = now()''')
+    def _save_member_snapshot(self, conn, group_id, members):
+        row = self.member_snapshots.get(group_id)
+        if row is None:
+            self._insert(conn, self.member_snapshots, group_id,
+                         {'group_id': group_id, 'members': members, 'updated_at': datetime.now()})
+        else:
+            self._update(conn, row, members=members, updated_at=datetime.now())
+
+    # Broadcaster
+
+    @statement('''INSERT INTO broadcasts (message, keyboard, recipients) VALUES (($1::text), ($2::text), ($3::text))
+                  RETURNING id''')
+    def _create_broadcast(self, conn, message, keyboard, recipients):
+        now = datetime.now()
+        broadcast_id = self._next('broadcasts')
+        self._insert(conn, self.broadcasts, broadcast_id, {
+            'id': broadcast_id, 'message': message, 'keyboard': keyboard, 'recipients': recipients, 'status': 0,
+            'last_user_id': 0, 'sent': 0, 'failed': 0, 'total': None, 'created_at': now, 'updated_at': now,
+            'finished_at': None,
+        })
+        return [ID((broadcast_id,))]
+
+    def _finish_broadcast(self, conn, status, broadcast_id, running):
+        row = self.broadcasts.get(broadcast_id)
+        if row is None or row['status'] != running:
+            return None
+
+        now = datetime.now()
+        self._update(conn, row, status=status, updated_at=now, finished_at=now)
+        return [ID((broadcast_id,))]
+
+    _cancel_broadcast = statement(
+        '''UPDATE broadcasts SET status = ($1::smallint), updated_at = now(), finished_at = now()
+           WHERE id = ($2::int) AND status = ($3::smallint)
+           RETURNING id''')(_finish_broadcast)
+    _end_broadcast = statement(
+        '''UPDATE broadcasts SET status = ($1::smallint), updated_at = now(), finished_at = now()
+           WHERE id = ($2::int) AND status = ($3::smallint)''')(_finish_broadcast)
+
+    @statement('''SELECT id, recipients, status, sent, failed, total, created_at, updated_at, finished_at
+                  FROM broadcasts WHERE id = ($1::int)''')
+    def _broadcast_progress(self, conn, broadcast_id):
+        row = self.broadcasts.get(broadcast_id)
+        return _rows(PROGRESS, [row] if row else [], PROGRESS.columns)
+
+    @statement('''SELECT id, recipients, status, sent, failed, total, created_at, updated_at, finished_at
+                  FROM broadcasts WHERE status = ($1::smallint) ORDER BY id''')
+    def _running_progress(self, conn, status):
+        return _rows(PROGRESS, self._broadcasts_with(status), PROGRESS.columns)
+
+    @statement('''SELECT id, message, keyboard, recipients, last_user_id, sent, failed, total FROM broadcasts
+                  WHERE status = ($1::smallint)
+                  ORDER BY id''')
+    def _running_broadcasts(self, conn, status):
+        return _rows(BROADCAST, self._broadcasts_with(status), BROADCAST.columns)
+
+    def _broadcasts_with(self, status):
+        return [row for _, row in sorted(self.broadcasts.items()) if row['status'] == status]
+
+    @statement('''SELECT count(*) FROM user_scores''')
+    def _count_players(self, conn):
+        return [VALUE((len(self.user_scores),))]
+
+    @statement('''SELECT user_id FROM user_scores WHERE user_id > ($1::int) ORDER BY user_id LIMIT ($2::int)''')
+    def _player_page(self, conn, last_user_id, limit):
+        user_ids = sorted(user_id for user_id in self.user_scores if user_id > last_user_id)
+        return [USER_ID((user_id,)) for user_id in user_ids[:limit]]
+
+    @statement('''UPDATE broadcasts SET total = ($1::int) WHERE id = ($2::int)''')
+    def _set_broadcast_total(self, conn, total, broadcast_id):
+        row = self.broadcasts.get(broadcast_id)
+        if row is not None:
+            self._update(conn, row, total=total)
+
+    @statement('''UPDATE broadcasts SET last_user_id = ($1::int), sent = sent + ($2::int), failed = failed + ($3::int),
+                                        updated_at = now()
+                  WHERE id = ($4::int)
+                  RETURNING status''')
+    def _broadcast_page(self, conn, last_user_id, sent, failed, broadcast_id):
+        row = self.broadcasts.get(broadcast_id)
+        if row is None:
+            return None
+
+        self._update(conn, row, last_user_id=last_user_id, sent=row['sent'] + sent, failed=row['failed'] + failed,
+                     updated_at=datetime.now())
+        return [VALUE((row['status'],))]
+
+    # Migrator, the schema is always the latest one
+
+    @statement('''SELECT to_regclass('schema_migrations') IS NOT NULL''')
+    def _versions_exist(self, conn):
+        return [VALUE((True,))]
+
+    @statement('''SELECT max(version) FROM schema_migrations''')
+    def _max_version(self, conn):
+        return [VALUE((max(self.schema_migrations, default=None),))]
+
+    @statement('''SELECT coalesce(max(version), 0) FROM schema_migrations''')
+    def _current_version(self, conn):
+        return [VALUE((max(self.schema_migrations, default=0),))]
+
+    @statement('''SELECT pg_advisory_xact_lock($1::bigint)''')
+    def _migration_lock(self, conn, key):
+        # Transactions already run one at a time
+        return None
+
+    @statement('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                      version integer NOT NULL PRIMARY KEY,
+                      name text NOT NULL,
+                      applied_at timestamp NOT NULL DEFAULT now()
+                  )''')
+    def _create_versions(self, conn):
+        return None
@@ -24,6 +24,9 @@ class Message:
 Не хватает коинов для пополнения? Жмите на "Получить коины" """
 
     Send = """✅ {} монет было успешно выведено!"""
+    SendQueued = """⏳ Вывод {} монет поставлен в очередь, мы сообщим, когда он завершится"""
+    SendFailed = """😢 Не удалось вывести {} монет, они возвращены на Ваш баланс"""
+    SendUnknown = """⚠️ Вывод {} монет задерживается, мы проверим его вручную"""
     Credited = """✅ {} монет успешно зачислены на Ваш баланс!"""
 
     Lose = """😢 {}, вы проиграли :("""
@@ -0,0 +1,257 @@
+import sys
+import asyncio
+import logging
+import argparse
+
+from vcoingame.database import Database
+
+logger = logging.getLogger('vcoingame.migrations')
+
+# Any constant works as long as every process that migrates the schema uses the same one
+LOCK_KEY = 0x5C01
+
+
+class Migration:
+    def __init__(self, version: int, name: str, statements: list, indexes: list = None):
+        """
+        :param version: strictly increasing schema version
+        :param name: short human readable description
+        :param statements: DDL statements, executed in order inside one transaction
+        :param indexes: (table, index name) pairs that must exist once this migration is applied
+        """
+        self.version = version
+        self.name = name
+        self.statements = statements
+        self.indexes = indexes or []
+
+    def __str__(self):
+        return f'[Migration] {self.version}: {self.name}'
+
+
+MIGRATIONS = [
+    Migration(1, 'initial schema', [
+        '''CREATE TABLE IF NOT EXISTS user_scores (
+               user_id integer NOT NULL,
+               score bigint NOT NULL DEFAULT 0,
+               max_bet bigint NOT NULL DEFAULT 0,
+               current_bet bigint NOT NULL DEFAULT 0,
+               state smallint NOT NULL DEFAULT -1,
+               win integer NOT NULL DEFAULT 0,
+               lose integer NOT NULL DEFAULT 0,
+               bet bigint NOT NULL DEFAULT 0,
+               prize bigint NOT NULL DEFAULT 0,
+               deposit bigint NOT NULL DEFAULT 0,
+               withdraw bigint NOT NULL DEFAULT 0,
+               CONSTRAINT user_scores_pkey PRIMARY KEY (user_id)
+           )''',
+        '''CREATE TABLE IF NOT EXISTS used_codes (
+               id bigserial NOT NULL,
+               code text NOT NULL,
+               user_id integer NOT NULL,
+               coins bigint NOT NULL,
+               created_at timestamp NOT NULL DEFAULT now(),
+               CONSTRAINT used_codes_pkey PRIMARY KEY (id),
+               CONSTRAINT used_codes_code_key UNIQUE (code)
+           )''',
+        '''CREATE TABLE IF NOT EXISTS transactions (
+               tid integer NOT NULL,
+               from_id integer NOT NULL,
+               to_id integer NOT NULL,
+               amount bigint NOT NULL,
+               created_at timestamp NOT NULL,
+               CONSTRAINT transactions_pkey PRIMARY KEY (tid)
+           )''',
+        # Tables created before the schema was versioned have no keys at all. A unique index with the
+        # constraint's name is a no-op on fresh databases and gives legacy ones the same access path
+        '''CREATE UNIQUE INDEX IF NOT EXISTS user_scores_pkey ON user_scores (user_id)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS transactions_pkey ON transactions (tid)''',
+        # SUM(coins) ... WHERE user_id = $1 is answered by an index only scan
+        '''CREATE INDEX IF NOT EXISTS used_codes_user_id_coins_idx ON used_codes (user_id, coins)''',
+    ], [
+        ('user_scores', 'user_scores_pkey'),
+        ('transactions', 'transactions_pkey'),
+        ('used_codes', 'used_codes_user_id_coins_idx'),
+    ]),
+    Migration(2, 'transfer outbox', [
+        '''CREATE TABLE IF NOT EXISTS transfers (
+               id bigserial NOT NULL,
+               idempotency_key text NOT NULL,
+               to_id integer NOT NULL,
+               amount bigint NOT NULL,
+               status smallint NOT NULL DEFAULT 0,
+               attempts integer NOT NULL DEFAULT 0,
+               next_attempt_at timestamp NOT NULL DEFAULT now(),
+               created_at timestamp NOT NULL DEFAULT now(),
+               claimed_at timestamp,
+               sent_at timestamp,
+               response text,
+               CONSTRAINT transfers_pkey PRIMARY KEY (id),
+               CONSTRAINT transfers_idempotency_key_key UNIQUE (idempotency_key)
+           )''',
+        # Workers look for the oldest due job, finished ones are never scanned again
+        '''CREATE INDEX IF NOT EXISTS transfers_pending_idx ON transfers (next_attempt_at, id) WHERE status = 0''',
+    ], [
+        ('transfers', 'transfers_pkey'),
+        ('transfers', 'transfers_idempotency_key_key'),
+        ('transfers', 'transfers_pending_idx'),
+    ]),
+    Migration(3, 'coalesced transfers', [
+        # Id of the job which carried the job to the merchant, the same for every job merged into one transfer
+        '''ALTER TABLE transfers ADD COLUMN IF NOT EXISTS batch_id bigint''',
+        '''CREATE INDEX IF NOT EXISTS transfers_pending_to_id_idx ON transfers (to_id) WHERE status = 0''',
+    ], [
+        ('transfers', 'transfers_pending_to_id_idx'),
+    ]),
+    Migration(4, 'group member snapshots', [
+        '''CREATE TABLE IF NOT EXISTS member_snapshots (
+               group_id integer NOT NULL,
+               members bytea NOT NULL,
+               updated_at timestamp NOT NULL DEFAULT now(),
+               CONSTRAINT member_snapshots_pkey PRIMARY KEY (group_id)
+           )''',
+    ], [
+        ('member_snapshots', 'member_snapshots_pkey'),
+    ]),
+    Migration(5, 'last activity of players', [
+        # Written together with the state, at most once in session.ACTIVITY_INTERVAL per player
+        '''ALTER TABLE user_scores ADD COLUMN IF NOT EXISTS last_active timestamp''',
+        '''CREATE INDEX IF NOT EXISTS user_scores_last_active_idx ON user_scores (last_active DESC NULLS LAST)''',
+    ], [
+        ('user_scores', 'user_scores_last_active_idx'),
+    ]),
+    Migration(6, 'broadcasts', [
+        '''CREATE TABLE IF NOT EXISTS broadcasts (
+               id serial NOT NULL,
+               message text NOT NULL,
+               keyboard text,
+               recipients text NOT NULL,
+               status smallint NOT NULL DEFAULT 0,
+               last_user_id integer NOT NULL DEFAULT 0,
+               sent integer NOT NULL DEFAULT 0,
+               failed integer NOT NULL DEFAULT 0,
+               total integer,
+               created_at timestamp NOT NULL DEFAULT now(),
+               updated_at timestamp NOT NULL DEFAULT now(),
+               finished_at timestamp,
+               CONSTRAINT broadcasts_pkey PRIMARY KEY (id)
+           )''',
+    ], [
+        ('broadcasts', 'broadcasts_pkey'),
+    ]),
+    Migration(7, 'balance ledger', [
+        '''CREATE TABLE IF NOT EXISTS ledger (
+               id bigserial NOT NULL,
+               user_id integer NOT NULL,
+               amount bigint NOT NULL,
+               reason smallint NOT NULL,
+               reference text,
+               created_at timestamp NOT NULL DEFAULT now(),
+               CONSTRAINT ledger_pkey PRIMARY KEY (id)
+           )''',
+        # History of a player and the totals of reconciliation
+        '''CREATE INDEX IF NOT EXISTS ledger_user_id_idx ON ledger (user_id, id)''',
+        # Balances from before the ledger are opening adjustments, so every score is the total of its entries
+        '''INSERT INTO ledger (user_id, amount, reason, reference)
+           SELECT user_id, score, 6, 'opening balance' FROM user_scores WHERE score <> 0''',
+    ], [
+        ('ledger', 'ledger_pkey'),
+        ('ledger', 'ledger_user_id_idx'),
+    ]),
+]
+
+
+class Migrator:
+    def __init__(self, database: Database, migrations: list = None):
+        self.database = database
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda migration: migration.version)
+
+    @property
+    def latest_version(self):
+        return self.migrations[-1].version if self.migrations else 0
+
+    async def _ensure_versions_table(self, conn):
+        await conn.execute(
+            '''CREATE TABLE IF NOT EXISTS schema_migrations (
+                   version integer NOT NULL PRIMARY KEY,
+                   name text NOT NULL,
+                   applied_at timestamp NOT NULL DEFAULT now()
+               )''')
+
+    async def get_version(self):
+        exists = await self.database.fetchval('''SELECT to_regclass('schema_migrations') IS NOT NULL''')
+        if not exists:
+            return 0
+
+        version = await self.database.fetchval('''SELECT max(version) FROM schema_migrations''')
+        return version or 0
+
+    async def migrate(self):
+        async with self.database.transaction() as conn:
+            # Several processes may start at once, only one of them applies migrations
+            await conn.execute('''SELECT pg_advisory_xact_lock($1::bigint)''', LOCK_KEY)
+            await self._ensure_versions_table(conn)
+
+            version = await conn.fetchval('''SELECT coalesce(max(version), 0) FROM schema_migrations''')
+            for migration in self.migrations:
+                if migration.version <= version:
+                    continue
+
+                logger.info(f'Applying {migration}')
+                for statement in migration.statements:
+                    await conn.execute(statement)
+
+                await conn.execute(
+                    '''INSERT INTO schema_migrations (version, name) VALUES (($1::int), ($2::text))''',
+                    migration.version, migration.name)
+                version = migration.version
+
+        logger.info(f'Database schema is up to date. Version: {version}')
+        return version
+
+    async def check(self):
+        """Returns (table, index) pairs the access paths rely on, but which are missing in the database"""
+        rows = await self.database.fetch(
+            '''SELECT tablename, indexname FROM pg_indexes WHERE schemaname = current_schema()''')
+        existing = {(row['tablename'], row['indexname']) for row in rows}
+
+        missing = []
+        for migration in self.migrations:
+            missing.extend(index for index in migration.indexes if index not in existing)
+
+        return missing
+
+
+async def run(check=False):
+    database = await Database.create()
+    migrator = Migrator(database)
+
+    try:
+        if not check:
+            await migrator.migrate()
+            return 0
+
+        version = await migrator.get_version()
+        missing = await migrator.check()
+
+        print(f'Schema version: {version} (latest: {migrator.latest_version})')
+        for table, index in missing:
+            print(f'Missing index: {index} on {table}')
+        if not missing:
+            print('All required indexes are present')
+
+        return 1 if missing or version < migrator.latest_version else 0
+    finally:
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create or check the VCoinGame database schema')
+    parser.add_argument('--check', action='store_true', help='only report missing migrations and indexes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-5s [%(asctime)s] %(name)s %(message)s')
+    sys.exit(asyncio.run(run(args.check)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Event loop of the bot processes: uvloop when it is installed and not turned off, plain asyncio otherwise.
+
+Most of the time of the bot is spent in socket I/O of aiohttp and asyncpg, uvloop does it in C. The default
+executor runs the blocking calls of the loop, e.g. DNS lookups of aiohttp, its size may be set.
+"""
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('vcoingame.runtime')
+
+
+def install(name='auto') -> str:
+    """Sets the event loop policy of the process
+
+    :param name: auto for uvloop if it is installed, uvloop or asyncio
+    :return: name of the loop which will be used
+    """
+    if name != 'asyncio':
+        try:
+            import uvloop
+        except ImportError:
+            if name == 'uvloop':
+                raise
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+
+    asyncio.set_event_loop_policy(None)
+    return 'asyncio'
+
+
+def tune(loop: asyncio.AbstractEventLoop, executor_workers: int = None):
+    """
+    :param executor_workers: threads of the default executor, the asyncio default if not given
+    """
+    if executor_workers:
+        loop.set_default_executor(ThreadPoolExecutor(executor_workers, thread_name_prefix='executor'))
+
+
+def describe(loop: asyncio.AbstractEventLoop) -> str:
+    loop_type = type(loop)
+    module = loop_type.__module__.partition('.')[0]
+    if module == 'uvloop':
+        import uvloop
+        return f'uvloop {uvloop.__version__}'
+    return f'{module} {loop_type.__name__}'
+
+
+def run(coroutine, loop='auto', executor_workers: int = None):
+    """asyncio.run on the chosen loop"""
+    install(loop)
+
+    async def tuned():
+        tune(asyncio.get_event_loop(), executor_workers)
+        return await coroutine
+
+    return asyncio.run(tuned())
+
+
+def log_loop(executor_workers: int = None):
+    """Logs which loop runs the process, called once logging is set up"""
+    logger.info(f'Event loop: {describe(asyncio.get_event_loop())}; '
+                f'executor workers: {executor_workers or "default"}')
@@ -0,0 +1,120 @@
+import time
+import asyncio
+import logging
+
+from vk_api import tracing
+
+logger = logging.getLogger('vcoingame.scheduler')
+
+
+class RefreshScheduler:
+    """Runs a refresh periodically, never more than one at a time.
+
+    Ticks that come while a refresh is running are not queued, they are coalesced into the running one.
+    The interval grows when refreshes are expensive or the database is busy and shrinks back when they are cheap.
+    """
+
+    def __init__(self, name, refresh, interval, min_interval=None, max_interval=None, cost_factor=10, load=None):
+        """
+        :param name: name for logs
+        :param refresh: coroutine function doing the work
+        :param interval: base interval between refreshes in seconds
+        :param min_interval: the interval never goes below it, defaults to the base interval
+        :param max_interval: the interval never goes above it, defaults to ten base intervals
+        :param cost_factor: the interval is at least this many durations of the last refresh
+        :param load: callable returning the current database load from 0 to 1
+        """
+        self.name = name
+        self._refresh = refresh
+        self.base_interval = interval
+        self.min_interval = min_interval if min_interval is not None else interval
+        self.max_interval = max_interval if max_interval is not None else interval * 10
+        self.cost_factor = cost_factor
+        self._load = load
+
+        self.interval = interval
+        self.last_success = None
+        self.last_duration = None
+        self.last_error = None
+        self.runs = self.failures = self.coalesced = 0
+
+        self._task = None
+        self._finished_at = None
+        self._requested = asyncio.Event()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def staleness(self):
+        """Seconds since the last successful refresh or None if there was none"""
+        return time.time() - self.last_success if self.last_success else None
+
+    def stats(self):
+        return {
+            'last_success': self.last_success,
+            'last_duration': self.last_duration,
+            'staleness': self.staleness,
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'coalesced': self.coalesced,
+        }
+
+    def request(self):
+        """Ask for a refresh as soon as possible without waiting for it"""
+        self._requested.set()
+
+    async def refresh(self):
+        """Refresh now and wait for it. If a refresh is already running, waits for that one instead.
+        Raises the error of the refresh it has waited for"""
+        if self.running:
+            self.coalesced += 1
+        else:
+            self._task = tracing.detached(self._run())
+
+        await asyncio.shield(self._task)
+
+    async def _run(self):
+        self.runs += 1
+        start = time.monotonic()
+        try:
+            await self._refresh()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = e
+            logger.exception(f'{self.name} refresh has failed')
+            raise
+        finally:
+            self._finished_at = time.monotonic()
+
+        self.last_duration = time.monotonic() - start
+        self.last_success = time.time()
+        self.interval = self._next_interval()
+
+        logger.info(f'{self.name} has been updated in {self.last_duration:.2f}s. Next in {self.interval:.0f}s')
+
+    def _next_interval(self):
+        interval = max(self.base_interval, self.last_duration * self.cost_factor)
+        if self._load:
+            interval *= 1 + min(max(self._load(), 0), 1)
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    async def start(self):
+        while True:
+            # Counted from the end of the last refresh, so on-demand refreshes push the next tick
+            # and a refresh that took longer than the interval is not followed by a burst of late ones
+            elapsed = time.monotonic() - self._finished_at if self._finished_at else 0
+            try:
+                await asyncio.wait_for(self._requested.wait(), timeout=max(self.interval - elapsed, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._requested.clear()
+
+            try:
+                await self.refresh()
+            except Exception:
+                # Logged by the refresh, the next tick tries again
+                pass
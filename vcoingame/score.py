@@ -1,7 +1,8 @@
-import os
 import re
 import logging
 
+from vcoingame.top import Top
+from vcoingame.ledger import Ledger, Entry, Reason
 from vcoingame.database import Database
 
 logger = logging.getLogger('vcoingame.score')
@@ -14,48 +15,61 @@ class Score:
         self.score = 0
 
     @staticmethod
-    async def get_or_create(database: Database, user_id):
+    async def get_or_create(database: Database, user_id, start_max_bet=0):
         score = Score(database, user_id)
         is_exists = await score.is_exists()
         if is_exists:
             await score.get()
         else:
-            await score.create()
+            await score.create(start_max_bet)
 
         return score, not is_exists
 
     async def is_exists(self):
-        logger.info(f'Check on exists {self.user_id}')
+        logger.info('Check on exists', extra={'user_id': self.user_id})
         return await self.database.fetchval(
             '''SELECT COUNT(*) FROM user_scores WHERE user_id = ($1::int)''', self.user_id)
 
-    async def create(self):
-        logger.info(f'Create score for {self.user_id}')
+    async def create(self, max_bet):
+        logger.info('Create score', extra={'user_id': self.user_id})
         await self.database.fetchval(
             '''INSERT INTO user_scores (user_id, score, max_bet) VALUES (($1::int), ($2::bigint), ($3::bigint))''',
-            self.user_id, 0, int(os.environ.get('START_MAX_BET')))
+            self.user_id, 0, max_bet)
         self.score = 0
 
     async def set(self, amount):
-        logger.info(f'Set score for {self.user_id}')
-        await self.database.fetchval(
-            '''UPDATE user_scores SET score = ($1::bigint) WHERE user_id = ($2::int)''', amount, self.user_id)
+        logger.info('Set score', extra={'user_id': self.user_id, 'amount': amount})
+        # The difference is taken from the score in the database, which has to have every change queued
+        await Ledger.of(self.database).flush()
+        async with self.database.transaction() as conn:
+            score = await conn.fetchval(
+                '''SELECT score FROM user_scores WHERE user_id = ($1::int) FOR UPDATE''', self.user_id)
+            if score is not None and score != amount:
+                await Ledger.append(conn, [Entry(self.user_id, amount - score, Reason.ADJUSTMENT)])
+                await conn.execute(
+                    '''UPDATE user_scores SET score = ($1::bigint) WHERE user_id = ($2::int)''', amount, self.user_id)
         self.score = amount
+        Top.set(self.user_id, score=amount)
 
-    async def add(self, amount):
-        logger.info(f'Add {amount} to {self.user_id}')
-        await self.database.fetchval(
-            '''UPDATE user_scores SET score = score + ($1::bigint) WHERE user_id = ($2::int)''', amount, self.user_id)
+    async def add(self, amount, reason: Reason, reference=None):
+        logger.info('Add score', extra={'user_id': self.user_id, 'amount': amount, 'reason': reason.name})
+        Ledger.of(self.database).record(self.user_id, amount, reason, reference)
         self.score += amount
+        Top.apply(self.user_id, score=amount)
 
-    async def sub(self, amount):
-        logger.info(f'Sub {amount} from {self.user_id}')
-        await self.database.fetchval(
-            '''UPDATE user_scores SET score = score - ($1::bigint) WHERE user_id = ($2::int)''', amount, self.user_id)
+    async def sub(self, amount, reason: Reason, reference=None):
+        logger.info('Sub score', extra={'user_id': self.user_id, 'amount': amount, 'reason': reason.name})
+        Ledger.of(self.database).record(self.user_id, -amount, reason, reference)
         self.score -= amount
+        Top.apply(self.user_id, score=-amount)
+
+    def apply(self, amount):
+        """Adds the amount which is already added in the database"""
+        self.score += amount
+        Top.apply(self.user_id, score=amount)
 
     async def get(self):
-        logger.info(f'Get {self.user_id}`s score')
+        logger.info('Get score', extra={'user_id': self.user_id})
         self.score = await self.database.fetchval(
             '''SELECT score FROM user_scores WHERE user_id = ($1::int)''', self.user_id)
         return self.score
@@ -1,3 +1,4 @@
+import time
 import logging
 
 from vk_api.keyboard import Keyboard, ButtonColor
@@ -5,10 +6,15 @@ from vk_api.keyboard import Keyboard, ButtonColor
 from vcoingame.top import Top
 from vcoingame.score import Score
 from vcoingame.states import State
+from vcoingame.config import Config
 from vcoingame.statistics import Statistics
 
 logger = logging.getLogger('vcoingame.session')
 
+# last_active is written at most once in this many seconds per session, a state change which writes only
+# the state changes no indexed column, so Postgres updates the row in place (HOT) without touching indexes
+ACTIVITY_INTERVAL = 300
+
 
 class Session:
     def __init__(self, database, user_id, state=State.MENU):
@@ -21,9 +27,10 @@ class Session:
         self.bet_keyboard = None
         self.statistics = self.score = self.top = None
         self._fields = {}
+        self._active_at = None
 
-    async def initial(self):
-        self.score, new_user = await Score.get_or_create(self.database, self.user_id)
+    async def initial(self, start_max_bet=0):
+        self.score, new_user = await Score.get_or_create(self.database, self.user_id, start_max_bet)
         self.state = await self.get_state()
         self.bet = await self.get_bet()
         self.max_bet = await self.get_max_bet()
@@ -32,14 +39,33 @@ class Session:
         self.bet_keyboard = await self.generate_bet_keyboard(self.max_bet)
 
         self.top = Top(self.database, self.user_id)
-        if new_user:
+        # Also while leaderboards are still loading at startup
+        if new_user or self.user_id not in Top.leaderboard:
             self.top.create()
 
         return self
 
     @staticmethod
-    async def create(database, user_id):
-        return await Session(database, user_id).initial()
+    async def create(database, user_id, start_max_bet=0):
+        return await Session(database, user_id).initial(start_max_bet)
+
+    @staticmethod
+    async def from_row(database, row, donation_amount):
+        """Session of an existing player from a user_scores row, without any queries"""
+        session = Session(database, row['user_id'], State(row['state']))
+        session.score = Score(database, session.user_id)
+        session.score.score = row['score']
+        session.bet = row['current_bet']
+        session.max_bet = row['max_bet']
+        session.donation_amount = donation_amount
+        session.statistics = Statistics(database, session.user_id)
+        session.bet_keyboard = await Session.generate_bet_keyboard(session.max_bet)
+
+        session.top = Top(database, session.user_id)
+        if session.user_id not in Top.leaderboard:
+            session.top.create()
+
+        return session
 
     @staticmethod
     async def generate_bet_keyboard(max_bet: int):
@@ -71,7 +97,7 @@ class Session:
         return bet_keyboard
 
     async def get_donation_amount(self):
-        logger.info(f'Get {self.user_id}`s donation amount')
+        logger.info('Get donation amount', extra={'user_id': self.user_id})
         self.donation_amount = await self.database.fetchval(
             '''SELECT
                     sum(coins)
@@ -80,40 +106,47 @@ class Session:
         return self.donation_amount
 
     async def get_max_bet(self):
-        logger.info(f'Get {self.user_id}`s max bet')
+        logger.info('Get max bet', extra={'user_id': self.user_id})
         self.max_bet = await self.database.fetchval(
             '''SELECT max_bet FROM user_scores WHERE user_id = ($1::int)''', self.user_id)
         return self.max_bet
 
     async def get_bet(self):
-        logger.info(f'Get {self.user_id}`s current bet')
+        logger.info('Get current bet', extra={'user_id': self.user_id})
         self.bet = await self.database.fetchval(
             '''SELECT current_bet FROM user_scores WHERE user_id = ($1::int)''', self.user_id)
         return self.bet
 
     async def add_to_max_bet(self, max_bet):
-        logger.info(f'Set max bet for {self.user_id}')
+        logger.info('Add to max bet', extra={'user_id': self.user_id, 'amount': max_bet})
         await self.database.fetchval(
             '''UPDATE user_scores SET max_bet = max_bet + ($1::bigint) WHERE user_id = ($2::int)''', max_bet, self.user_id)
         self.max_bet += max_bet
         self.bet_keyboard = await self.generate_bet_keyboard(self.max_bet)
 
     async def set_bet(self, bet):
-        logger.info(f'Set current bet for {self.user_id}')
+        logger.info('Set current bet', extra={'user_id': self.user_id, 'bet': bet})
         await self.database.fetchval(
             '''UPDATE user_scores SET current_bet = ($1::bigint) WHERE user_id = ($2::int)''', bet, self.user_id)
         self.bet = bet
 
     async def get_state(self):
-        logger.info(f'Get {self.user_id}`s state')
+        logger.info('Get state', extra={'user_id': self.user_id})
         self.state = State(await self.database.fetchval(
             '''SELECT state FROM user_scores WHERE user_id = ($1::int)''', self.user_id))
         return self.state
 
     async def set_state(self, state: State):
-        logger.info(f'Set state for {self.user_id}')
-        await self.database.fetchval(
-            '''UPDATE user_scores SET state = ($1::smallint) WHERE user_id = ($2::int)''', state.value, self.user_id)
+        logger.info('Set state', extra={'user_id': self.user_id, 'state': state.name})
+        now = time.monotonic()
+        if self._active_at is None or now - self._active_at >= ACTIVITY_INTERVAL:
+            await self.database.fetchval(
+                '''UPDATE user_scores SET state = ($1::smallint), last_active = now() WHERE user_id = ($2::int)''',
+                state.value, self.user_id)
+            self._active_at = now
+        else:
+            await self.database.fetchval(
+                '''UPDATE user_scores SET state = ($1::smallint) WHERE user_id = ($2::int)''', state.value, self.user_id)
         self.state = state
 
     async def reset_state(self):
@@ -130,23 +163,73 @@ class Session:
 
 
 class SessionList:
-    def __init__(self, database):
+    def __init__(self, database, config: Config):
         self.database = database
+        self.config = config
         self._sessions = {}
 
     def append(self, user_id: int, item: Session):
         self._sessions.update({user_id: item})
-        logger.info(f'Appended session for {user_id}. Len: {len(self)}')
+        logger.info('Appended session', extra={'user_id': user_id, 'sessions': len(self)})
 
     def __len__(self):
         return len(self._sessions)
 
+    def get(self, user_id: int) -> Session:
+        """Session if it is loaded already"""
+        return self._sessions.get(user_id)
+
+    def credit(self, user_id, amount):
+        """Follows a change of the score which is already made in the database, e.g. a refund"""
+        session = self._sessions.get(user_id)
+        if session:
+            session.score.apply(amount)
+        else:
+            # The session is loaded with the changed score, only the leaderboard has to follow
+            Top.apply(user_id, score=amount)
+
+    async def prewarm(self, limit=None, user_ids=None):
+        """Creates sessions of the players in a couple of queries
+
+        :param limit: number of the most recently active players
+        :param user_ids: the players, instead of the most recently active ones
+        """
+        if user_ids is not None:
+            user_ids = [user_id for user_id in set(user_ids) if user_id not in self._sessions]
+            if not user_ids:
+                return 0
+
+            rows = await self.database.fetch(
+                '''SELECT user_id, score, max_bet, current_bet, state FROM user_scores
+                   WHERE user_id = ANY($1::int[])''', user_ids)
+        else:
+            rows = await self.database.fetch(
+                '''SELECT user_id, score, max_bet, current_bet, state FROM user_scores
+                   ORDER BY last_active DESC NULLS LAST
+                   LIMIT ($1::int)''', limit)
+
+        donations = await self.database.fetch(
+            '''SELECT user_id, sum(coins) as coins FROM used_codes
+               WHERE user_id = ANY($1::int[])
+               GROUP BY user_id''', [row['user_id'] for row in rows])
+        donations = {row['user_id']: row['coins'] for row in donations}
+
+        count = 0
+        for row in rows:
+            if row['user_id'] not in self._sessions:
+                self._sessions[row['user_id']] = await Session.from_row(
+                    self.database, row, donations.get(row['user_id']))
+                count += 1
+
+        logger.info('Prewarmed sessions', extra={'count': count, 'sessions': len(self)})
+        return count
+
     async def get_or_create(self, user_id: int) -> Session:
         session = self._sessions.get(user_id)
         if session:
             return session
 
-        session = await Session.create(self.database, user_id)
+        session = await Session.create(self.database, user_id, self.config.start_max_bet)
         self.append(user_id, session)
 
         return session
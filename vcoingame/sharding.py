@@ -0,0 +1,292 @@
+"""Scale-out mode: one ingress process and WORKERS worker processes, each of them owns the players
+whose user_id % WORKERS is its shard.
+
+The ingress owns everything that has to exist once: the long poll, the execute pool, group members,
+deposits, transfers and broadcasts. Message updates go to the worker owning the sender, group join and
+leave updates go to every worker. Workers keep the sessions of their players and a full copy of
+the leaderboards: every change a worker makes is relayed by the ingress to the other workers, reconciled
+group members are sent to all of them, and replies come back to the ingress to be batched by its pool.
+Leaderboards are reloaded from the database by all workers at once when the ingress tells them to, changes
+relayed meanwhile are replayed onto the reloaded boards. The ingress restarts workers which have died.
+"""
+import time
+
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+from vk_api.updates import UpdateManager, UpdateType
+
+from vcoingame.top import Top
+from vcoingame.score import Score
+from vcoingame.config import Config
+from vcoingame.database import Database
+from vcoingame.session import SessionList
+from vcoingame.membership import Membership
+from vcoingame.scheduler import RefreshScheduler
+
+logger = logging.getLogger('vcoingame.sharding')
+
+# Ingress to a worker
+UPDATE = 'update'
+MEMBERS = 'members'
+CREDITED = 'credited'
+RELOAD = 'reload'
+# Worker to the ingress
+SEND = 'send'
+# Both ways, a leaderboard change
+TOP = 'top'
+
+
+class Channel:
+    """One direction of a multiprocessing queue.
+
+    Messages sent during one iteration of the event loop are put as one batch, so they share one pickle
+    and one pipe write. Received messages are waited for in a thread of the channel.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._batch = []
+
+    def send(self, message):
+        if not self._batch:
+            asyncio.get_event_loop().call_soon(self.flush)
+        self._batch.append(message)
+
+    def flush(self):
+        batch, self._batch = self._batch, []
+        if batch:
+            self.queue.put(batch)
+
+    async def receive(self):
+        loop = asyncio.get_event_loop()
+        received = asyncio.Queue()
+
+        def read():
+            try:
+                while True:
+                    loop.call_soon_threadsafe(received.put_nowait, self.queue.get())
+            except (ValueError, OSError, EOFError, RuntimeError):
+                # The queue or the loop has been closed
+                return
+
+        # A daemon, the process never waits for it to exit
+        threading.Thread(target=read, name='channel', daemon=True).start()
+
+        while True:
+            for message in await received.get():
+                yield message
+
+
+class Shards:
+    """The workers as seen by the ingress"""
+
+    def __init__(self, count, target, args=(), min_uptime=10, max_restarts=5):
+        """
+        :param target: function run by every worker process with (shard, count, inbox, outbox, *args)
+        :param min_uptime: a worker which dies sooner after its start has crashed at startup
+        :param max_restarts: the ingress gives up after this many crashes at startup in a row of one worker
+        """
+        self.context = multiprocessing.get_context('spawn')
+        self.count = count
+        self.target = target
+        self.args = args
+        self.min_uptime = min_uptime
+        self.max_restarts = max_restarts
+        self.inboxes = [Channel(self.context.Queue()) for _ in range(count)]
+        # Shared by all workers, the shard is a part of the messages which need it
+        self.outbox = Channel(self.context.Queue())
+        self.processes = [self._process(shard) for shard in range(count)]
+        self.started_at = [None] * count
+        self.crashes = [0] * count
+
+    def _process(self, shard):
+        return self.context.Process(target=self.target, name=f'worker-{shard}', daemon=True,
+                                    args=(shard, self.count, self.inboxes[shard].queue, self.outbox.queue) + self.args)
+
+    def start(self):
+        for shard, process in enumerate(self.processes):
+            process.start()
+            self.started_at[shard] = time.monotonic()
+        logger.info(f'{self.count} workers have been started')
+
+    async def supervise(self, interval=1):
+        """Restarts workers which have died.
+
+        A restarted worker loads its players and leaderboards from the database, entries of its ledger
+        which were not written yet and messages sent to it before the restart are lost. Raises if a worker
+        keeps crashing at startup
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for shard, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+
+                uptime = time.monotonic() - self.started_at[shard]
+                self.crashes[shard] = self.crashes[shard] + 1 if uptime < self.min_uptime else 0
+                if self.crashes[shard] >= self.max_restarts:
+                    raise RuntimeError(f'Worker {shard} has crashed {self.crashes[shard]} times at startup')
+
+                logger.error(f'Worker {shard} has died with exit code {process.exitcode} after {uptime:.0f}s, '
+                             f'restarting it, the messages not yet read by it are dropped')
+                self._renew_inbox(shard)
+                self.processes[shard] = self._process(shard)
+                self.processes[shard].start()
+                self.started_at[shard] = time.monotonic()
+
+    def _renew_inbox(self, shard):
+        """A dead worker keeps the read lock of its inbox if it died waiting for a message, which is almost
+        always, so the restarted worker gets a new queue. The channel stays, batches not yet put go there
+        """
+        inbox = self.inboxes[shard]
+        queue, inbox.queue = inbox.queue, self.context.Queue()
+        queue.cancel_join_thread()
+        queue.close()
+
+    async def reload_tops(self):
+        """Tells every worker to reload its leaderboards, they all do it at once"""
+        self.broadcast((RELOAD,))
+
+    def shard(self, user_id):
+        return user_id % self.count
+
+    def send(self, user_id, message):
+        """Sends the message to the worker owning the player"""
+        self.inboxes[self.shard(user_id)].send(message)
+
+    def broadcast(self, message, exclude=None):
+        for shard, inbox in enumerate(self.inboxes):
+            if shard != exclude:
+                inbox.send(message)
+
+    def route(self, updates):
+        for update in updates:
+            if update.type is UpdateType.MESSAGE_NEW:
+                self.send(update.object.from_id, (UPDATE, update))
+            else:
+                self.broadcast((UPDATE, update))
+
+    def members_reconciled(self, members: Membership):
+        self.broadcast((MEMBERS, members.to_bytes()))
+
+    async def serve(self, pool):
+        """Sends replies of the workers through the pool and relays their leaderboard changes"""
+        async for message in self.outbox.receive():
+            if message[0] == SEND:
+                pool.append(message[1])
+            elif message[0] == TOP:
+                self.broadcast((TOP,) + message[2:], exclude=message[1])
+
+    def alive(self):
+        return sum(process.is_alive() for process in self.processes)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        # Messages nobody will read must not keep this process from exiting
+        for channel in self.inboxes + [self.outbox]:
+            channel.queue.cancel_join_thread()
+            channel.queue.close()
+
+
+class ShardedUpdateManager(UpdateManager):
+    """Update manager of the ingress, it hands updates to the workers and runs only its own handlers,
+    e.g. the ones keeping group members of the ingress"""
+
+    def __init__(self, longpoll, shards: Shards):
+        super().__init__(longpoll)
+        self.shards = shards
+
+    async def _process_updates(self, updates):
+        self.shards.route(updates)
+        await super()._process_updates([update for update in updates if update.type is not UpdateType.MESSAGE_NEW])
+
+
+class _RemoteScore:
+    __slots__ = ('user_id', 'shards')
+
+    def __init__(self, user_id, shards: Shards):
+        self.user_id = user_id
+        self.shards = shards
+
+    def apply(self, amount):
+        self.shards.send(self.user_id, (CREDITED, self.user_id, amount))
+
+
+class _RemoteSession:
+    __slots__ = 'score'
+
+    def __init__(self, user_id, shards: Shards):
+        self.score = _RemoteScore(user_id, shards)
+
+
+class RemoteSessions:
+    """Sessions for the services of the ingress, e.g. the deposit watcher. The score row is created here,
+    the credit is applied to the session by the worker owning the player"""
+
+    def __init__(self, database: Database, config: Config, shards: Shards):
+        self.database = database
+        self.config = config
+        self.shards = shards
+
+    async def get_or_create(self, user_id):
+        await Score.get_or_create(self.database, user_id, self.config.start_max_bet)
+        return _RemoteSession(user_id, self.shards)
+
+    def credit(self, user_id, amount):
+        self.shards.send(user_id, (CREDITED, user_id, amount))
+
+
+class RemotePool:
+    """Pool of a worker, the requests are batched by the pool of the ingress"""
+
+    def __init__(self, channel: Channel):
+        self.channel = channel
+
+    def append(self, request):
+        self.channel.send((SEND, request))
+
+
+class Worker:
+    """The ingress as seen by a worker"""
+
+    def __init__(self, shard, count, inbox, outbox):
+        self.shard = shard
+        self.count = count
+        self.inbox = Channel(inbox)
+        self.outbox = Channel(outbox)
+        self.pool = RemotePool(self.outbox)
+
+    def share_top(self):
+        """Sends every leaderboard change of this worker to the others"""
+        Top.on_change = lambda operation, user_id, values: self.outbox.send((TOP, self.shard, operation, user_id, values))
+
+    async def serve(self, update_manager: UpdateManager, sessions: SessionList, members: Membership,
+                    top_scheduler: RefreshScheduler = None):
+        # One message at a time, so updates of a player are processed in the order they came
+        async for message in self.inbox.receive():
+            try:
+                if message[0] == UPDATE:
+                    await update_manager.process([message[1]])
+                elif message[0] == TOP:
+                    Top.replay(*message[1:])
+                elif message[0] == MEMBERS:
+                    members.replace(message[1])
+                elif message[0] == CREDITED:
+                    sessions.credit(*message[1:])
+                elif message[0] == RELOAD:
+                    # Updates are served meanwhile, their changes are replayed onto the reloaded boards
+                    asyncio.ensure_future(self._reload(top_scheduler))
+            except Exception:
+                logger.exception(f'Cant process {message[0]} on worker {self.shard}')
+
+    @staticmethod
+    async def _reload(top_scheduler: RefreshScheduler):
+        try:
+            await top_scheduler.refresh()
+        except Exception:
+            # Logged by the scheduler, the boards are kept until the next reload
+            pass
@@ -0,0 +1,147 @@
+"""Monte Carlo simulation of the game economics: python -m vcoingame.simulator --help
+
+Every player session starts with a deposit and the start max bet, then plays a number of games betting
+a share of the balance, never more than the max bet, and sometimes buys a max bet raise. All sessions
+are simulated at once with NumPy arrays, using the same rules as the bot from vcoingame.economics.
+Requires NumPy, which the bot itself does not need.
+"""
+import sys
+import time
+import argparse
+
+from vcoingame import economics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Result:
+    def __init__(self, wagered, paid, house, players_ruined, house_ruined, raises, raise_income):
+        """
+        :param wagered: total of all bets
+        :param paid: total of all prizes
+        :param house: house result of every session
+        :param players_ruined: share of players who could not afford a bet any more
+        :param house_ruined: share of runs where the house balance went below its bankroll
+        :param raises: number of bought raises
+        :param raise_income: total paid for raises
+        """
+        self.wagered = wagered
+        self.paid = paid
+        self.house = house
+        self.players_ruined = players_ruined
+        self.house_ruined = house_ruined
+        self.raises = raises
+        self.raise_income = raise_income
+
+    @property
+    def house_edge(self):
+        return (self.wagered - self.paid) / self.wagered if self.wagered else 0
+
+    def __str__(self):
+        coin = economics.COIN
+        return '\n'.join((
+            f'Sessions:                {len(self.house):,}',
+            f'Wagered:                 {self.wagered / coin:,.0f}',
+            f'House edge:              {self.house_edge:.4%}',
+            f'House result per session mean {self.house.mean() / coin:,.3f}, '
+            f'variance {self.house.var() / coin ** 2:,.3f}',
+            f'House total:             {self.house.sum() / coin:,.0f} '
+            f'(with raises {(self.house.sum() + self.raise_income) / coin:,.0f})',
+            f'Raises bought:           {self.raises:,} for {self.raise_income / coin:,.0f}',
+            f'Player ruin probability: {self.players_ruined:.4%}',
+            f'House ruin probability:  {self.house_ruined:.4%}',
+        ))
+
+
+def simulate(players, games, win_rate, rate, start_max_bet, deposit, bet_share=0.5, raise_chance=0.01,
+             raise_amount=economics.COIN * 100, house_bankroll=economics.COIN * 10 ** 6, runs=100, seed=None):
+    """
+    :param players: number of player sessions
+    :param games: games played in a session
+    :param win_rate: WIN_RATE
+    :param rate: RATE
+    :param start_max_bet: START_MAX_BET
+    :param deposit: balance every session starts with
+    :param bet_share: share of the balance bet in every game
+    :param raise_chance: chance to try buying a raise before a game
+    :param raise_amount: size of a bought raise
+    :param house_bankroll: the house is ruined when its balance in a run goes below minus this
+    :param runs: the sessions are split into this many runs to estimate the house ruin probability
+    """
+    rng = np.random.default_rng(seed)
+
+    balance = np.full(players, deposit, dtype=np.int64)
+    max_bet = np.full(players, start_max_bet, dtype=np.int64)
+    house = np.zeros(players, dtype=np.int64)
+    wagered = paid = raises = raise_income = 0
+
+    for _ in range(games):
+        buying = rng.random(players) < raise_chance
+        if buying.any():
+            price = economics.raise_price(max_bet[buying], raise_amount, rate).astype(np.int64)
+            affordable = price <= balance[buying]
+            buyers = np.flatnonzero(buying)[affordable]
+
+            balance[buyers] -= price[affordable]
+            max_bet[buyers] += raise_amount
+            raises += len(buyers)
+            raise_income += int(price[affordable].sum())
+
+        # Bets are whole coins like the ones on the bet keyboard
+        bet = np.minimum((balance * bet_share).astype(np.int64), max_bet) // economics.COIN * economics.COIN
+        bet[bet < economics.COIN] = 0
+
+        won = economics.is_win(rng.integers(1, 101, players), win_rate)
+        prize = np.where(won, economics.prize(bet), 0)
+
+        balance += prize - bet
+        house += bet - prize
+        wagered += int(bet.sum())
+        paid += int(prize.sum())
+
+    runs = max(min(runs, players), 1)
+    per_run = players // runs
+    house_balance = np.cumsum(house[:runs * per_run].reshape(runs, per_run), axis=1)
+    house_ruined = float((house_balance.min(axis=1) < -house_bankroll).mean())
+
+    # A player who cant bet once never can again, the balance does not change without games
+    players_ruined = float((bet == 0).mean()) if games else 0.0
+
+    return Result(wagered, paid, house, players_ruined, house_ruined, raises, raise_income)
+
+
+def main():
+    coin = economics.COIN
+
+    parser = argparse.ArgumentParser(description='Simulate the house edge and ruin probabilities')
+    parser.add_argument('--players', type=int, default=1_000_000)
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--win-rate', type=int, required=True, help='WIN_RATE')
+    parser.add_argument('--rate', type=float, required=True, help='RATE')
+    parser.add_argument('--start-max-bet', type=float, required=True, help='START_MAX_BET in coins')
+    parser.add_argument('--deposit', type=float, default=100, help='starting balance in coins')
+    parser.add_argument('--bet-share', type=float, default=0.5)
+    parser.add_argument('--raise-chance', type=float, default=0.01)
+    parser.add_argument('--raise-amount', type=float, default=100, help='in coins')
+    parser.add_argument('--house-bankroll', type=float, default=10 ** 6, help='in coins')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit('The simulator requires NumPy: pip install numpy')
+
+    start = time.perf_counter()
+    result = simulate(args.players, args.games, args.win_rate, args.rate, int(args.start_max_bet * coin),
+                      int(args.deposit * coin), args.bet_share, args.raise_chance, int(args.raise_amount * coin),
+                      int(args.house_bankroll * coin), args.runs, args.seed)
+
+    print(result)
+    print(f'Simulated in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
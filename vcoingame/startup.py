@@ -0,0 +1,103 @@
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger('vcoingame.startup')
+
+
+class Phase:
+    def __init__(self, name, run, requires=(), required=True):
+        """
+        :param name: name for logs and dependencies
+        :param run: coroutine function warming something up
+        :param requires: names of the phases which have to finish first
+        :param required: the bot cant serve until the phase has finished, an optional phase which fails
+                         is retried until it finishes
+        """
+        self.name = name
+        self.run = run
+        self.requires = requires
+        self.required = required
+        self.task = None
+        self.duration = None
+        self.failures = 0
+
+
+class Warmup:
+    """Runs startup phases concurrently, each one as soon as the phases it requires have finished.
+
+    `serving` is set once every required phase has finished, the bot may answer then, maybe with
+    degraded data. `ready` is set once every phase has finished. A failure of a required phase is raised
+    by start(), a failed optional phase is logged and run again with a backoff, so whatever waits for it
+    starts late instead of taking the bot down.
+    """
+
+    def __init__(self, retry_delay=1, max_retry_delay=60):
+        """
+        :param retry_delay: first delay before a failed optional phase is run again, doubles with every failure
+        :param max_retry_delay: the retry delay never goes above it
+        """
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.phases = {}
+        self.serving = asyncio.Event()
+        self.ready = asyncio.Event()
+        self._start = None
+
+    def add(self, name, run, requires=(), required=True):
+        self.phases[name] = Phase(name, run, requires, required)
+
+    async def _run(self, phase: Phase):
+        if phase.requires:
+            await asyncio.gather(*[self.phases[name].task for name in phase.requires])
+
+        start = time.monotonic()
+        delay = self.retry_delay
+        while True:
+            try:
+                await phase.run()
+                break
+            except Exception:
+                if phase.required:
+                    raise
+
+                phase.failures += 1
+                logger.exception(f'Startup phase {phase.name} has failed {phase.failures} times, '
+                                 f'retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+        phase.duration = time.monotonic() - start
+
+        logger.info(f'Startup phase {phase.name} has finished in {phase.duration:.2f}s '
+                    f'({time.monotonic() - self._start:.2f}s since start)')
+
+    async def wait(self, name):
+        """Returns once the phase has finished, raises only if it is a required one which has failed"""
+        await self.phases[name].task
+
+    async def start(self):
+        """Starts every phase and returns when the bot can serve"""
+        self._start = time.monotonic()
+        for phase in self.phases.values():
+            phase.task = asyncio.ensure_future(self._run(phase))
+
+        asyncio.ensure_future(self._wait_ready())
+
+        await asyncio.gather(*[phase.task for phase in self.phases.values() if phase.required])
+        self.serving.set()
+
+        pending = [phase.name for phase in self.phases.values() if not phase.task.done()]
+        if pending:
+            logger.info(f'Serving in {time.monotonic() - self._start:.2f}s, still warming up: {", ".join(pending)}')
+
+    async def _wait_ready(self):
+        results = await asyncio.gather(*[phase.task for phase in self.phases.values()], return_exceptions=True)
+        for phase, result in zip(self.phases.values(), results):
+            if isinstance(result, Exception):
+                logger.error(f'Startup phase {phase.name} has failed: {result!r}')
+
+        self.ready.set()
+
+        timings = '; '.join(f'{phase.name}: {phase.duration:.2f}s' for phase in self.phases.values()
+                            if phase.duration is not None)
+        logger.info(f'Ready in {time.monotonic() - self._start:.2f}s. Phases: {timings}')
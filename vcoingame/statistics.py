@@ -1,5 +1,6 @@
 import logging
 
+from vcoingame.top import Top
 from vcoingame.database import Database
 
 logger = logging.getLogger('vcoingame.statistics')
@@ -11,31 +12,35 @@ class Statistics:
         self.user_id = user_id
 
     async def add_win(self):
-        logger.info(f'Add win for {self.user_id}')
+        logger.info('Add win', extra={'user_id': self.user_id})
         await self.database.fetchval(
             '''UPDATE user_scores SET win = win + 1 WHERE user_id = ($1::int)''', self.user_id)
+        Top.apply(self.user_id, win=1)
 
     async def add_lose(self):
-        logger.info(f'Add lose for {self.user_id}')
+        logger.info('Add lose', extra={'user_id': self.user_id})
         await self.database.fetchval(
             '''UPDATE user_scores SET lose = lose + 1 WHERE user_id = ($1::int)''', self.user_id)
+        Top.apply(self.user_id, lose=1)
 
     async def add_bet(self, value):
-        logger.info(f'Add bet {value} for {self.user_id}')
+        logger.info('Add bet', extra={'user_id': self.user_id, 'value': value})
         await self.database.fetchval(
             '''UPDATE user_scores SET bet = bet + ($1::bigint) WHERE user_id = ($2::int)''', value, self.user_id)
+        Top.apply(self.user_id, bet=value)
 
     async def add_prize(self, value):
-        logger.info(f'Add prize {value} for {self.user_id}')
+        logger.info('Add prize', extra={'user_id': self.user_id, 'value': value})
         await self.database.fetchval(
             '''UPDATE user_scores SET prize = prize + ($1::bigint) WHERE user_id = ($2::int)''', value, self.user_id)
+        Top.apply(self.user_id, prize=value)
 
     async def add_deposit(self, value):
-        logger.info(f'Add deposit {value} for {self.user_id}')
+        logger.info('Add deposit', extra={'user_id': self.user_id, 'value': value})
         await self.database.fetchval(
             '''UPDATE user_scores SET deposit = deposit + ($1::bigint) WHERE user_id = ($2::int)''', value, self.user_id)
 
     async def add_withdraw(self, value):
-        logger.info(f'Add withdraw {value} for {self.user_id}')
+        logger.info('Add withdraw', extra={'user_id': self.user_id, 'value': value})
         await self.database.fetchval(
             '''UPDATE user_scores SET withdraw = withdraw + ($1::bigint) WHERE user_id = ($2::int)''', value, self.user_id)
@@ -1,16 +1,21 @@
-import asyncio
 import logging
 
+from vcoingame.ledger import Ledger
+from vcoingame.messages import Message
 from vcoingame.database import Database
+from vcoingame.scheduler import RefreshScheduler
+from vcoingame.leaderboard import Leaderboard, Snapshot, Board
 
 logger = logging.getLogger('vcoingame.top')
 
 
 class Position:
-    def __init__(self, data: dict):
-        self.user_id = data.get('user_id')
-        self.number = data.get('position')
-        self.value = data.get('value')
+    __slots__ = ('user_id', 'number', 'value')
+
+    def __init__(self, user_id, number, value):
+        self.user_id = user_id
+        self.number = number
+        self.value = value
 
     def __str__(self):
         return f'[Position] User: {self.user_id}; Number: {self.number}; Value: {self.value}'
@@ -20,117 +25,173 @@ class Position:
 
 
 class Top:
-    _WIN_TOP = {}
-    _WINRATE_TOP = {}
-    _SCORE_TOP = {}
-    _GAMES_TOP = {}
-    _PROFIT_TOP = {}
-
-    WIN_TOP_10 = []
-    WINRATE_TOP_10 = []
-    SCORE_TOP_10 = []
-    GAMES_TOP_10 = []
-    PROFIT_TOP_10 = []
+    INCREMENTAL = 'incremental'
+    SNAPSHOT = 'snapshot'
+
+    # incremental: rankings follow every change; snapshot: rankings are recomputed by the database on refresh
+    mode = INCREMENTAL
+    leaderboard = Leaderboard()
+    scheduler = None
+    # Called with (operation, user_id, values) on every change made by this process, e.g. to share it with others
+    on_change = None
+
+    # Board: (leaderboard, version, title, rendered text) of the last rendered top 10
+    _rendered = {}
+    # Changes made while a reload is fetching the rows, made again on the new leaderboard
+    _changes = None
 
     def __init__(self, database: Database, user_id=None):
         self.database = database
         self.user_id = user_id
 
+    def create(self):
+        logger.info(f'Add new user to the top')
+        Top.leaderboard.create(self.user_id)
+        Top._record('create', self.user_id, {})
+        if Top.on_change:
+            Top.on_change('create', self.user_id, {})
+
     @staticmethod
-    def __update_top_10(result):
-        return [Position(row) for row in result[0:10]]
+    def apply(user_id, **deltas):
+        Top.leaderboard.apply(user_id, **deltas)
+        Top._record('apply', user_id, deltas)
+        if Top.on_change:
+            Top.on_change('apply', user_id, deltas)
 
     @staticmethod
-    def __update_top(top, result):
-        for row in result:
-            top.update({row['user_id']: Position(row)})
-
-    async def _update_profit_top(self):
-        result = await self.database.fetch(
-            '''SELECT  user_id, 
-                       (prize - bet)::float / 1000 as value, 
-                       rank() over (order by prize - bet desc) as position 
-               FROM user_scores''')
-        Top.PROFIT_TOP_10 = self.__update_top_10(result)
-        self.__update_top(Top._PROFIT_TOP, result)
-
-    async def _update_games_top(self):
-        result = await self.database.fetch(
-            '''SELECT  user_id, 
-                       win + lose as value, 
-                       rank() over (order by win + lose desc) as position 
-               FROM user_scores''')
-        Top.GAMES_TOP_10 = self.__update_top_10(result)
-        self.__update_top(Top._GAMES_TOP, result)
-
-    async def _update_win_top(self):
-        result = await self.database.fetch(
-            '''SELECT  user_id, 
-                       win as value, 
-                       rank() over (order by win desc) as position 
-               FROM user_scores''')
-        Top.WIN_TOP_10 = self.__update_top_10(result)
-        self.__update_top(Top._WIN_TOP, result)
-
-    async def _update_winrate_top(self):
-        result = await self.database.fetch(
-            '''SELECT user_id, 
-                      round((win::float / (win + lose)) * 100)::int as value,
-                      rank() over (order by win::float / (win + lose) desc) as position 
-               FROM user_scores
-               WHERE (lose != 0 or win != 0) and lose + win > 20''')
-        Top.WINRATE_TOP_10 = self.__update_top_10(result)
-        self.__update_top(Top._WINRATE_TOP, result)
-
-    async def _update_score_top(self):
-        result = await self.database.fetch(
-            '''SELECT user_id, 
-                      score::float / 1000 as value,
-                      rank() over (order by score desc) as position 
-               FROM user_scores''')
-        Top.SCORE_TOP_10 = self.__update_top_10(result)
-        self.__update_top(Top._SCORE_TOP, result)
+    def set(user_id, **values):
+        Top.leaderboard.set(user_id, **values)
+        Top._record('set', user_id, values)
+        if Top.on_change:
+            Top.on_change('set', user_id, values)
 
-    def create(self):
-        logger.info(f'Add new user to the top')
-        position = Position({'user_id': self.user_id, 'position': 0, 'value': 0})
-        data = {self.user_id: position}
+    @staticmethod
+    def replay(operation, user_id, values):
+        """Applies a change made by another process"""
+        Top._replay(Top.leaderboard, operation, user_id, values)
+        Top._record(operation, user_id, values)
 
-        Top._WIN_TOP.update(data)
-        Top._WINRATE_TOP.update(data)
-        Top._SCORE_TOP.update(data)
-        Top._GAMES_TOP.update(data)
-        Top._PROFIT_TOP.update(data)
+    @staticmethod
+    def _replay(leaderboard, operation, user_id, values):
+        if operation == 'create':
+            leaderboard.create(user_id)
+        else:
+            getattr(leaderboard, operation)(user_id, **values)
+
+    @staticmethod
+    def _record(operation, user_id, values):
+        if Top._changes is not None:
+            Top._changes.append((operation, user_id, values))
+
+    async def _fetch(self, query):
+        """Rows of the query and the changes made while they were fetched.
+
+        Queued ledger entries are written first, so changes of scores are either in the rows or in the changes
+        """
+        Top._changes = changes = []
+        try:
+            await Ledger.of(self.database).flush()
+            return await self.database.fetch(query), changes
+        finally:
+            Top._changes = None
+
+    @staticmethod
+    def _swap(leaderboard, changes):
+        # Nothing is awaited between the fetch and the swap, no change can be missed
+        for operation, user_id, values in changes:
+            Top._replay(leaderboard, operation, user_id, values)
+        Top.leaderboard = leaderboard
 
     async def update_tops(self):
-        await self._update_win_top()
-        await self._update_winrate_top()
-        await self._update_score_top()
-        await self._update_games_top()
-        await self._update_profit_top()
-
-    async def start(self):
-        while True:
-            asyncio.create_task(self.update_tops())
-            logger.info('TOPs has been updated')
-            await asyncio.sleep(180)
+        if Top.mode == Top.SNAPSHOT:
+            await self._update_snapshot()
+        else:
+            await self._update_leaderboard()
+
+    async def _update_leaderboard(self):
+        result, changes = await self._fetch('''SELECT user_id, score, win, lose, bet, prize FROM user_scores''')
+
+        leaderboard = Leaderboard()
+        leaderboard.load(tuple(row) for row in result)
+        Top._swap(leaderboard, changes)
+
+    async def _update_snapshot(self):
+        result, changes = await self._fetch(
+            '''SELECT user_id,
+                      win as win_value,
+                      rank() over (order by win desc) as win_position,
+                      CASE WHEN win + lose > 20 THEN round((win::float / (win + lose)) * 100)::int END as winrate_value,
+                      CASE WHEN win + lose > 20 THEN rank() over (
+                          partition by win + lose > 20 order by win::float / nullif(win + lose, 0) desc) END
+                          as winrate_position,
+                      score::float / 1000 as score_value,
+                      rank() over (order by score desc) as score_position,
+                      win + lose as games_value,
+                      rank() over (order by win + lose desc) as games_position,
+                      (prize - bet)::float / 1000 as profit_value,
+                      rank() over (order by prize - bet desc) as profit_position
+               FROM user_scores
+               ORDER BY user_id''')
+
+        # Built aside and swapped with one assignment, readers see either the old or the new snapshot
+        Top._swap(Snapshot(result, Top.leaderboard.versions), changes)
+        logger.info(f'Leaderboard snapshot has been built. Users: {len(Top.leaderboard)}')
+
+    @staticmethod
+    def schedule(database: Database, mode=INCREMENTAL, interval=None, refresh=None) -> RefreshScheduler:
+        """
+        :param refresh: coroutine function reloading the leaderboards, update_tops of this process by default
+        """
+        Top.mode = mode
+        if mode == Top.SNAPSHOT:
+            Top.leaderboard = Snapshot([])
+
+        # Incremental boards are kept up to date by every change, reloading only reconciles them with the database
+        interval = interval or (1800 if mode == Top.INCREMENTAL else 180)
+
+        Top.scheduler = RefreshScheduler('TOPs', refresh or Top(database).update_tops, interval,
+                                         load=lambda: database.load)
+        return Top.scheduler
+
+    def top_10(self, board: Board):
+        return [Position(*row) for row in Top.leaderboard.top(board, 10)]
+
+    @staticmethod
+    def render_top_10(board: Board, title: str):
+        """Text of the top 10, rendered again only when the board has changed since the last call"""
+        leaderboard = Top.leaderboard
+        version = leaderboard.versions[board]
+
+        rendered = Top._rendered.get(board)
+        if rendered and rendered[0] is leaderboard and rendered[1] == version and rendered[2] == title:
+            return rendered[3]
+
+        text = title + ':\n' + ''.join(
+            Message.LeaderboardRow.format(*row) for row in leaderboard.top(board, 10))
+        Top._rendered[board] = (leaderboard, version, title, text)
+
+        return text
+
+    def position(self, board: Board):
+        position = Top.leaderboard.position(board, self.user_id)
+        return Position(self.user_id, *position) if position else None
 
     @property
     def profit(self):
-        return Top._PROFIT_TOP.get(self.user_id)
+        return self.position(Board.PROFIT)
 
     @property
     def games(self):
-        return Top._GAMES_TOP.get(self.user_id)
+        return self.position(Board.GAMES)
 
     @property
     def win(self):
-        return Top._WIN_TOP.get(self.user_id)
+        return self.position(Board.WIN)
 
     @property
     def score(self):
-        return Top._SCORE_TOP.get(self.user_id)
+        return self.position(Board.SCORE)
 
     @property
     def winrate(self):
-        return Top._WINRATE_TOP.get(self.user_id)
+        return self.position(Board.WINRATE)
@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from vcoingame.ledger import Ledger, Entry, Reason
 from vcoingame.database import Database
 
 
@@ -16,3 +17,35 @@ class TransactionManager:
                                         VALUES (($1::int), ($2::int), ($3::bigint), ($4::timestamp), ($5::int))''',
                                      transaction.from_id, transaction.to_id, transaction.amount,
                                      datetime.fromtimestamp(transaction.created_at), transaction.id)
+
+    @staticmethod
+    async def save_deposits(conn, transactions):
+        """Saves the transactions and credits their senders, with ledger entries, in the connection's transaction.
+
+        Transactions which are already saved are skipped, only the saved ones are credited and returned.
+        The rows of the senders are locked in the order of user ids like ledger batches lock them
+        """
+        inserted = await conn.fetch(
+            '''INSERT INTO transactions (from_id, to_id, amount, created_at, tid)
+               SELECT * FROM unnest(($1::int[]), ($2::int[]), ($3::bigint[]), ($4::timestamp[]), ($5::int[]))
+               ON CONFLICT (tid) DO NOTHING
+               RETURNING tid, from_id, amount''',
+            [transaction.from_id for transaction in transactions],
+            [transaction.to_id for transaction in transactions],
+            [transaction.amount for transaction in transactions],
+            [datetime.fromtimestamp(transaction.created_at) for transaction in transactions],
+            [transaction.id for transaction in transactions])
+
+        if inserted:
+            await Ledger.lock(conn, [row['from_id'] for row in inserted])
+            await conn.execute(
+                '''UPDATE user_scores SET score = score + d.amount, deposit = deposit + d.amount
+                   FROM (SELECT user_id, sum(amount)::bigint as amount
+                         FROM unnest(($1::int[]), ($2::bigint[])) as t (user_id, amount)
+                         GROUP BY user_id) d
+                   WHERE user_scores.user_id = d.user_id''',
+                [row['from_id'] for row in inserted], [row['amount'] for row in inserted])
+            await Ledger.append(conn, [Entry(row['from_id'], row['amount'], Reason.DEPOSIT, f'transaction:{row["tid"]}')
+                                       for row in inserted])
+
+        return inserted
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import aiohttp
+
+from enum import Enum
+
+from vcoingame.ledger import Ledger, Entry, Reason
+from vcoingame.coin_api import CoinAPI
+from vcoingame.database import Database
+
+logger = logging.getLogger('vcoingame.transfers')
+
+
+class TransferStatus(Enum):
+    PENDING = 0
+    SENDING = 1
+    DONE = 2
+    FAILED = 3
+    # The request has been sent, but it is not known whether the merchant has made the transfer
+    UNKNOWN = 4
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+class TransferOutbox:
+    """Withdrawals stored in the database in the same transaction as the debit of the player and its ledger entry.
+
+    Workers claim due jobs with FOR UPDATE SKIP LOCKED, so any number of them, in any number of processes,
+    never send the same job twice. All jobs due for the same recipient are claimed together and sent as one
+    transfer of their total, every job keeps its own amount and gets the id of the transfer in batch_id.
+    A job that is busy on the merchant side is retried with a backoff, a job whose outcome is unknown
+    is never retried automatically and has to be checked by hand. A job which has failed is refunded to the
+    player in the same transaction as it is marked as failed. wait() signals the end of every single job,
+    merged or not.
+    """
+
+    BUSY_ERROR = 'ANOTHER_TRANSACTION_IN_PROGRESS_AT_SAME_TIME'
+    FINISHED = (TransferStatus.DONE, TransferStatus.FAILED, TransferStatus.UNKNOWN)
+
+    def __init__(self, database: Database, coin_api: CoinAPI, concurrency=1, delay=0, retry_delay=2,
+                 max_retry_delay=60, idle_delay=1, claim_timeout=300, sessions=None):
+        """
+        :param concurrency: number of transfers sent at the same time
+        :param delay: pause of a worker after every transfer
+        :param retry_delay: first delay before a busy job is retried, doubles with every attempt
+        :param max_retry_delay: the retry delay never goes above it
+        :param idle_delay: how often idle workers look for jobs added by other processes
+        :param claim_timeout: seconds after which a job claimed by a dead worker is marked as unknown
+        :param sessions: SessionList or RemoteSessions the refunds of failed jobs are credited to
+        """
+        self.database = database
+        self.coin_api = coin_api
+        self.concurrency = concurrency
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.idle_delay = idle_delay
+        self.claim_timeout = claim_timeout
+        self.sessions = sessions
+
+        self._wakeup = asyncio.Event()
+        # Transfer id: futures of its waiters
+        self._waiters = {}
+
+    async def withdraw(self, user_id, amount, idempotency_key):
+        """Debits the player and adds the transfer in one transaction.
+
+        :return: id of the job, None if the job with the key already exists
+        :raises InsufficientFunds: if the player has less than the amount
+        """
+        # The debit is checked against the score in the database, which has to have every change queued
+        await Ledger.of(self.database).flush()
+
+        async with self.database.transaction() as conn:
+            transfer_id = await conn.fetchval(
+                '''INSERT INTO transfers (idempotency_key, to_id, amount) VALUES (($1::text), ($2::int), ($3::bigint))
+                   ON CONFLICT (idempotency_key) DO NOTHING
+                   RETURNING id''', idempotency_key, user_id, amount)
+            if transfer_id is None:
+                logger.warning(f'Transfer {idempotency_key} already exists')
+                return None
+
+            score = await conn.fetchval(
+                '''UPDATE user_scores SET score = score - ($1::bigint), withdraw = withdraw + ($1::bigint)
+                   WHERE user_id = ($2::int) AND score >= ($1::bigint)
+                   RETURNING score''', amount, user_id)
+            if score is None:
+                raise InsufficientFunds(f'{user_id} has less than {amount}')
+
+            await Ledger.append(conn, [Entry(user_id, -amount, Reason.WITHDRAWAL, f'transfer:{transfer_id}')])
+
+        logger.info(f'Transfer {transfer_id} of {amount} to {user_id} has been added')
+        self._wakeup.set()
+
+        return transfer_id
+
+    async def _claim(self):
+        return await self.database.fetch(
+            '''WITH lead AS (
+                   SELECT id, to_id FROM transfers
+                   WHERE status = ($2::smallint) AND next_attempt_at <= now()
+                   ORDER BY next_attempt_at, id
+                   LIMIT 1
+                   FOR UPDATE SKIP LOCKED
+               ), jobs AS (
+                   SELECT transfers.id FROM transfers, lead
+                   WHERE transfers.to_id = lead.to_id
+                         AND transfers.status = ($2::smallint) AND transfers.next_attempt_at <= now()
+                   FOR UPDATE OF transfers SKIP LOCKED
+               )
+               UPDATE transfers SET status = ($1::smallint), attempts = attempts + 1, claimed_at = now(),
+                                    batch_id = (SELECT id FROM lead)
+               WHERE id IN (SELECT id FROM jobs)
+               RETURNING id, to_id, amount, attempts, batch_id''',
+            TransferStatus.SENDING.value, TransferStatus.PENDING.value)
+
+    async def status(self, transfer_id):
+        """Status of the job or None if there is no such job"""
+        status = await self.database.fetchval(
+            '''SELECT status FROM transfers WHERE id = ($1::bigint)''', transfer_id)
+        return TransferStatus(status) if status is not None else None
+
+    async def wait(self, transfer_id, interval=5) -> TransferStatus:
+        """Waits until the job is done, failed or has an unknown outcome, raises KeyError if there is no such job.
+
+        Jobs finished by this process are signalled at once, the ones finished by other processes, e.g. by
+        the ingress for a worker, are noticed by reading the status every interval seconds
+        """
+        future = asyncio.get_event_loop().create_future()
+        waiters = self._waiters.setdefault(transfer_id, set())
+        waiters.add(future)
+        try:
+            while True:
+                status = await self.status(transfer_id)
+                if status is None:
+                    raise KeyError(f'There is no transfer {transfer_id}')
+                if status in TransferOutbox.FINISHED:
+                    return status
+
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters.discard(future)
+            if not waiters:
+                self._waiters.pop(transfer_id, None)
+
+    def _notify(self, ids, status: TransferStatus):
+        for transfer_id in ids:
+            for future in self._waiters.get(transfer_id, ()):
+                if not future.done():
+                    future.set_result(status)
+
+    async def _finish(self, ids, status: TransferStatus, response):
+        await self.database.execute(
+            '''UPDATE transfers SET status = ($1::smallint), response = ($2::text),
+                                    sent_at = CASE WHEN ($3::bool) THEN now() END
+               WHERE id = ANY($4::bigint[])''', status.value, str(response), status is TransferStatus.DONE, ids)
+        self._notify(ids, status)
+
+    async def _retry(self, ids, attempts, response):
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        await self.database.execute(
+            '''UPDATE transfers SET status = ($1::smallint), response = ($2::text),
+                                    next_attempt_at = now() + ($3::float) * interval '1 second'
+               WHERE id = ANY($4::bigint[])''', TransferStatus.PENDING.value, str(response), delay, ids)
+
+        logger.warning(f'Transfers {ids} will be retried in {delay}s. Response: {response}')
+
+    async def _fail(self, ids, response):
+        refunds = await self.database.run_in_transaction(lambda conn: self._refund(conn, ids, response))
+        self._notify([row['id'] for row in refunds], TransferStatus.FAILED)
+
+        for row in refunds:
+            logger.warning(f'Transfer {row["id"]} of {row["amount"]} to {row["to_id"]} has been refunded')
+            if self.sessions:
+                self.sessions.credit(row['to_id'], row['amount'])
+
+    @staticmethod
+    async def _refund(conn, ids, response):
+        """Marks the jobs as failed and credits their amounts back with reversing ledger entries"""
+        refunds = await conn.fetch(
+            '''UPDATE transfers SET status = ($1::smallint), response = ($2::text)
+               WHERE id = ANY($3::bigint[]) AND status = ($4::smallint)
+               RETURNING id, to_id, amount''',
+            TransferStatus.FAILED.value, str(response), ids, TransferStatus.SENDING.value)
+
+        for row in refunds:
+            await conn.execute(
+                '''UPDATE user_scores SET score = score + ($1::bigint), withdraw = withdraw - ($1::bigint)
+                   WHERE user_id = ($2::int)''', row['amount'], row['to_id'])
+        if refunds:
+            await Ledger.append(conn, [Entry(row['to_id'], row['amount'], Reason.WITHDRAWAL, f'transfer:{row["id"]}')
+                                       for row in refunds])
+
+        return refunds
+
+    async def _process(self, jobs):
+        ids = [job['id'] for job in jobs]
+        to_id = jobs[0]['to_id']
+        amount = sum(job['amount'] for job in jobs)
+        attempts = max(job['attempts'] for job in jobs)
+
+        if len(jobs) > 1:
+            logger.info(f'Transfers {ids} to {to_id} are merged into one of {amount}')
+
+        try:
+            response = await self.coin_api.send(to_id, amount)
+        except aiohttp.ClientConnectorError as e:
+            # The request has not left, nothing could have been sent
+            await self._retry(ids, attempts, e)
+            return
+        except Exception as e:
+            logger.exception(f'Transfers {ids} have an unknown outcome, check them by hand')
+            await self._finish(ids, TransferStatus.UNKNOWN, e)
+            return
+
+        error = response.get('error')
+        if not error:
+            await self._finish(ids, TransferStatus.DONE, response)
+        elif error.get('message') == TransferOutbox.BUSY_ERROR:
+            await self._retry(ids, attempts, response)
+        else:
+            logger.error(f'Cant send coins. Response: {response}; Transfers: {ids}; To: {to_id}; Amount: {amount}')
+            await self._fail(ids, response)
+
+    async def _worker(self):
+        while True:
+            try:
+                jobs = await self._claim()
+            except Exception:
+                logger.exception('Cant claim a transfer')
+                await asyncio.sleep(self.idle_delay)
+                continue
+
+            if not jobs:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(jobs)
+            except Exception:
+                # The jobs stay claimed and are marked as unknown by recover()
+                logger.exception(f'Cant finish transfers {[job["id"] for job in jobs]}')
+
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+    async def recover(self):
+        """Marks jobs claimed by workers which died while sending them"""
+        result = await self.database.fetch(
+            '''UPDATE transfers SET status = ($1::smallint)
+               WHERE status = ($2::smallint) AND claimed_at < now() - ($3::float) * interval '1 second'
+               RETURNING id''',
+            TransferStatus.UNKNOWN.value, TransferStatus.SENDING.value, self.claim_timeout)
+
+        for row in result:
+            logger.error(f'Transfer {row["id"]} was interrupted while sending, check it by hand')
+        self._notify([row['id'] for row in result], TransferStatus.UNKNOWN)
+
+    async def stats(self):
+        """Number of jobs waiting to be sent and age of the oldest of them in seconds"""
+        row = await self.database.fetchrow(
+            '''SELECT count(*) as depth, coalesce(extract(epoch from now() - min(created_at)), 0) as oldest_age
+               FROM transfers
+               WHERE status IN (($1::smallint), ($2::smallint))''',
+            TransferStatus.PENDING.value, TransferStatus.SENDING.value)
+
+        return row['depth'], row['oldest_age']
+
+    async def _monitor(self, interval=60):
+        while True:
+            try:
+                await self.recover()
+                depth, oldest_age = await self.stats()
+                logger.info(f'Transfer queue depth: {depth}; Oldest job age: {oldest_age:.0f}s')
+            except Exception:
+                logger.exception('Cant check the transfer queue')
+            await asyncio.sleep(interval)
+
+    async def start(self):
+        await asyncio.gather(self._monitor(), *[self._worker() for _ in range(self.concurrency)])
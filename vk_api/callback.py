@@ -0,0 +1,118 @@
+import hmac
+import json
+import asyncio
+import logging
+
+from collections import OrderedDict
+
+from aiohttp import web
+
+from vk_api.api import API
+from vk_api.updates import Update
+from vk_api.exceptions import VkException
+
+logger = logging.getLogger('vk_api.callback')
+
+
+class CallbackServer:
+    """Implements https://vk.com/dev/callback_api
+
+    Receives the events POSTed by VK and answers "ok" at once, the events are handed to the update
+    manager through a bounded queue by wait(), so it can be used in place of a long poll. While the queue
+    is full events are refused and VK sends them again later.
+    """
+
+    def __init__(self, api: API, group_id: int, confirmation: str = None, secret: str = None,
+                 host='0.0.0.0', port=8080, path='/callback', max_queue=10000, max_batch=100):
+        """
+        :param confirmation: string returned on the confirmation request, got from the API if not given
+        :param secret: secret key set in the group settings, events without it are refused
+        :param max_queue: events received but not processed yet
+        :param max_batch: most events returned by one wait
+        """
+        self.api = api
+        self.group_id = group_id
+        self.confirmation = confirmation
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_batch = max_batch
+
+        self.queue = asyncio.Queue(max_queue)
+        # VK sends an event again if the answer was late, the latest ids are remembered to skip it
+        self._seen = OrderedDict()
+        self._seen_size = max_queue
+        self._runner = None
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def prepare(self):
+        """Gets the confirmation string if needed and starts listening"""
+        if self.confirmation is None:
+            response = await self.api('groups.getCallbackConfirmationCode', group_id=self.group_id)
+            # Errors of the API are logged and give None
+            if response is None:
+                raise VkException('Cant get the Callback API confirmation code, the token needs the manage right '
+                                  'of the group, or the code can be set in the config')
+            self.confirmation = response['code']
+
+        self._runner = web.AppRunner(self.application(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f'Callback API server is listening on {self.host}:{self.port}{self.path}')
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            event = json.loads(await request.read())
+        except ValueError:
+            return web.Response(status=400, text='bad request')
+
+        if not isinstance(event, dict) or event.get('group_id') != self.group_id:
+            return web.Response(status=403, text='forbidden')
+
+        if event.get('type') == 'confirmation':
+            return web.Response(text=self.confirmation)
+
+        if self.secret is not None and not hmac.compare_digest(str(event.get('secret', '')), self.secret):
+            logger.warning('Callback event with a wrong secret key has been refused')
+            return web.Response(status=403, text='forbidden')
+
+        event_id = event.get('event_id')
+        if event_id is not None and event_id in self._seen:
+            return web.Response(text='ok')
+
+        try:
+            update = Update(event)
+        except ValueError:
+            # A type the bot does not handle, it is enabled in the group settings
+            logger.debug('Callback event of type %s has been skipped', event.get('type'))
+            return web.Response(text='ok')
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning(f'Callback queue is full ({self.queue.maxsize} events), the event has been refused')
+            return web.Response(status=503, text='busy')
+
+        if event_id is not None:
+            self._seen[event_id] = None
+            if len(self._seen) > self._seen_size:
+                self._seen.popitem(last=False)
+
+        return web.Response(text='ok')
+
+    async def wait(self) -> list:
+        """Waits for events and returns all received meanwhile, at most max_batch"""
+        updates = [await self.queue.get()]
+        while len(updates) < self.max_batch and not self.queue.empty():
+            updates.append(self.queue.get_nowait())
+        return updates
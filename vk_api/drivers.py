@@ -7,8 +7,8 @@ logger = logging.getLogger('vk_api.drivers')
 
 
 def log_request(url, data, timeout):
-    data = str(data).encode("utf-8")
-    logger.debug(f'URL: {url}; Data: {data}; Timeout: {timeout}')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('URL: %s; Data: %s; Timeout: %s', url, str(data).encode("utf-8"), timeout)
 
 
 class BaseDriver(ABC):
@@ -1,7 +1,12 @@
 import json
+import time
 import asyncio
 import logging
 
+from json.encoder import encode_basestring
+
+from vk_api import tracing
+
 logger = logging.getLogger('vk_api.execute')
 
 
@@ -14,24 +19,46 @@ class Pool:
         self._pool = asyncio.Queue()
 
     async def compile(self):
-        methods = []
+        """Code of the next execute and the traces of its requests with the times they were appended"""
+        methods, traces = [], []
         for _ in range(0, 25):
             if self._pool.empty():
                 break
 
-            methods.append(self._pool.get_nowait())
+            request, trace = self._pool.get_nowait()
+            methods.append(request)
+            if trace:
+                traces.append(trace)
 
-        logger.info(f'Pool queue size: {self._pool.qsize()}; Current methods in request: {len(methods)}')
+        logger.debug('Pool queue size: %d; Current methods in request: %d', self._pool.qsize(), len(methods))
 
-        return f"return [{','.join(methods)}];"
+        return f"return [{','.join(methods)}];", traces
 
     def append(self, request):
-        self._pool.put_nowait(request)
+        trace = tracing.current()
+        if trace:
+            # The trace is exported once the request is delivered
+            trace.hold()
+            tracing.span('pool.enqueue', queue_size=self._pool.qsize()).finish()
+            trace = (trace, time.time_ns())
+
+        self._pool.put_nowait((request, trace))
+
+    async def _send(self, code, traces):
+        start = time.time_ns()
+        try:
+            return await self.api._session.send_api_request(self.execute, {'code': code})
+        finally:
+            end = time.time_ns()
+            for trace, appended in traces:
+                tracing.add_span(trace, 'pool.wait', appended, start)
+                tracing.add_span(trace, 'execute', start, end, code_length=len(code))
+                trace.release()
 
     async def start(self):
         while True:
             if not self._pool.empty():
-                asyncio.create_task(self.api._session.send_api_request(self.execute, {'code': await self.compile()}))
+                asyncio.create_task(self._send(*await self.compile()))
             await asyncio.sleep(0.55)
 
 
@@ -51,3 +78,29 @@ class Function:
                 compiled_args[key] = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
 
         return f'API.{self.method._method_name}({json.dumps(compiled_args, ensure_ascii=False)})'
+
+    def template(self, **constants):
+        """Template of the call with the given arguments, see Template"""
+        return Template(self.method._method_name, constants)
+
+
+class Template:
+    """Call of a method whose some arguments are always the same, e.g. a message with a static keyboard.
+
+    The constant arguments are encoded once, a call encodes only the variable ones and joins the parts.
+    The code is the same as Function makes with the variable arguments passed first.
+    """
+    __slots__ = ('method_name', '_prefix', '_constants')
+
+    def __init__(self, method_name, constants: dict):
+        self.method_name = method_name
+        self._prefix = f'API.{method_name}({{'
+        self._constants = ', '.join(f'{encode_basestring(key)}: {encode_basestring(str(value))}'
+                                    for key, value in constants.items())
+
+    def __call__(self, **method_args):
+        parts = [f'{encode_basestring(key)}: {encode_basestring(str(value))}' for key, value in method_args.items()]
+        if self._constants:
+            parts.append(self._constants)
+
+        return f'{self._prefix}{", ".join(parts)}}})'
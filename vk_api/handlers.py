@@ -29,8 +29,7 @@ class GroupJoinHandler(GroupHandler):
 
     async def start(self, update: Update):
         user_id = update.object.get('user_id')
-        if user_id not in HandlerContext.group_members:
-            HandlerContext.group_members.append(user_id)
+        if HandlerContext.group_members.add(user_id):
             logger.info(f'{user_id} join to group')
 
 
@@ -39,8 +38,7 @@ class GroupLeaveHandler(GroupHandler):
 
     async def start(self, update: Update):
         user_id = update.object.get('user_id')
-        if user_id in HandlerContext.group_members:
-            del HandlerContext.group_members[HandlerContext.group_members.index(user_id)]
+        if HandlerContext.group_members.remove(user_id):
             logger.info(f'{user_id} leave from group')
 
 
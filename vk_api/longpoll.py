@@ -47,6 +47,13 @@ class BaseLongPoll(ABC):
         :param need_pts: need return the pts field
         """
 
+    async def prepare(self, need_pts=False) -> None:
+        """Get the long poll server ahead of the first wait
+
+        :param need_pts: need return the pts field
+        """
+        await self._get_long_poll_server(need_pts)
+
     async def wait(self, need_pts=False) -> dict:
         """Send long poll request
 
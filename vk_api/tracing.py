@@ -0,0 +1,279 @@
+"""Per update tracing.
+
+A sampled update gets a trace, every span started while it is processed, in the same task or in tasks
+created from it, belongs to the trace through a context variable. A request appended to the execute pool
+takes the trace along, so the execute that delivers it is a span of the trace too, and the trace is exported
+once both the update is processed and all its requests are delivered. Without a sampled trace every call
+here is a cheap no-op. Background tasks which outlive the update or work for many of them are started
+with detached(), so they are not part of the trace they happen to be started from.
+"""
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import asyncio
+import logging
+import threading
+
+from contextvars import ContextVar, copy_context
+
+logger = logging.getLogger('vk_api.tracing')
+
+_trace = ContextVar('trace', default=None)
+_span = ContextVar('span', default=None)
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'end', 'attributes', '_token')
+
+    def __init__(self, trace, name, parent_id=None, start=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = start or time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, end=None, **attributes):
+        if self.end is not None:
+            return
+        self.end = end or time.time_ns()
+        self.attributes.update(attributes)
+        self.trace.spans.append(self)
+
+    def __enter__(self):
+        self._token = _span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = repr(exc)
+        self.finish()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, end=None, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ('exporter', 'trace_id', 'root', 'spans', '_open')
+
+    def __init__(self, exporter, name, attributes):
+        self.exporter = exporter
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.root = Span(self, name, attributes=attributes)
+        # The root and every request not delivered yet
+        self._open = 1
+
+    def hold(self):
+        self._open += 1
+
+    def release(self):
+        self._open -= 1
+        if not self._open:
+            self.exporter.export(self)
+
+
+class _RootSpan:
+    """Context manager of the root span, the trace is released when it ends"""
+    __slots__ = ('trace', '_tokens')
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._tokens = None
+
+    def __enter__(self):
+        self._tokens = _trace.set(self.trace), _span.set(self.trace.root)
+        return self.trace.root
+
+    def __exit__(self, exc_type, exc, tb):
+        _trace.reset(self._tokens[0])
+        _span.reset(self._tokens[1])
+        if exc_type is not None:
+            self.trace.root.attributes['error'] = repr(exc)
+        self.trace.root.finish()
+        self.trace.release()
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate=0.0):
+        """
+        :param exporter: gets every finished trace, nothing is traced without one
+        :param sample_rate: share of the traces which are recorded
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def trace(self, name, **attributes):
+        """Starts a trace, if it is sampled, with the root span of the given name"""
+        if not self.exporter or _trace.get() is not None or random.random() >= self.sample_rate:
+            return NOOP
+        return _RootSpan(Trace(self.exporter, name, attributes))
+
+
+tracer = Tracer()
+
+
+def configure(exporter=None, sample_rate=0.0):
+    tracer.exporter = exporter
+    tracer.sample_rate = sample_rate
+
+
+def current():
+    """Trace of the current context or None"""
+    return _trace.get()
+
+
+def span(name, **attributes):
+    """Span in the current trace. As a context manager it is the parent of the spans started inside,
+    otherwise it ends with finish()"""
+    trace = _trace.get()
+    if trace is None:
+        return NOOP
+
+    parent = _span.get()
+    return Span(trace, name, parent.span_id if parent else None, attributes=attributes)
+
+
+def _untraced():
+    _trace.set(None)
+    _span.set(None)
+
+
+def detached(coroutine):
+    """Task of the coroutine outside of the current trace, other context variables are kept"""
+    context = copy_context()
+    context.run(_untraced)
+    return context.run(asyncio.ensure_future, coroutine)
+
+
+def add_span(trace, name, start, end, **attributes):
+    """Span with known times, e.g. of a request delivered on behalf of the trace, under its root"""
+    Span(trace, name, trace.root.span_id, start, attributes).finish(end)
+
+
+class FileExporter:
+    """Appends every trace to a file from a thread, so the event loop never waits for the disk"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write, name='trace-exporter', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def encode(self, trace: Trace) -> str:
+        raise NotImplementedError
+
+    def export(self, trace: Trace):
+        self._queue.put(trace)
+
+    def _write(self):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            while True:
+                trace = self._queue.get()
+                if trace is None:
+                    return
+
+                try:
+                    file.write(self.encode(trace) + '\n')
+                except Exception:
+                    logger.exception(f'Cant export trace {trace.trace_id}')
+
+                if self._queue.empty():
+                    file.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class JsonLinesExporter(FileExporter):
+    """One JSON object per trace with its spans, durations in microseconds"""
+
+    def encode(self, trace: Trace) -> str:
+        root = trace.root
+        spans = sorted(trace.spans, key=lambda item: item.start)
+        return json.dumps({
+            'trace_id': trace.trace_id,
+            'name': root.name,
+            'start': root.start / 10 ** 9,
+            'duration_us': (max(item.end for item in spans) - root.start) // 1000,
+            'attributes': root.attributes,
+            'spans': [{
+                'name': item.name,
+                'span_id': item.span_id,
+                'parent_id': item.parent_id,
+                'offset_us': (item.start - root.start) // 1000,
+                'duration_us': (item.end - item.start) // 1000,
+                'attributes': item.attributes,
+            } for item in spans if item is not root],
+        }, ensure_ascii=False, default=str)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OTLPJsonExporter(FileExporter):
+    """One OTLP/JSON ExportTraceServiceRequest per trace, the format the OpenTelemetry collector
+    reads with its otlpjsonfile receiver"""
+
+    def __init__(self, path, service_name='vcoingame'):
+        self.service_name = service_name
+        super().__init__(path)
+
+    def encode(self, trace: Trace) -> str:
+        return json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': _otlp_value(self.service_name)}]},
+            'scopeSpans': [{
+                'scope': {'name': 'vk_api.tracing'},
+                'spans': [{
+                    'traceId': trace.trace_id,
+                    'spanId': item.span_id,
+                    'parentSpanId': item.parent_id or '',
+                    'name': item.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(item.start),
+                    'endTimeUnixNano': str(item.end),
+                    'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in item.attributes.items()],
+                } for item in trace.spans],
+            }],
+        }]}, ensure_ascii=False)
+
+
+EXPORTERS = {
+    'jsonl': JsonLinesExporter,
+    'otlp': OTLPJsonExporter,
+}
@@ -1,7 +1,9 @@
+import time
 import logging
 
 from enum import Enum
 
+from vk_api import tracing
 from vk_api.messages import Message
 
 logger = logging.getLogger('vk_api.updates')
@@ -42,12 +44,18 @@ class Update:
 
 
 class UpdateManager:
-    def __init__(self, longpoll):
+    def __init__(self, longpoll, api=None):
+        """
+        :param api: needed only without a long poll, when updates are passed in by somebody else
+        """
         self.longpoll = longpoll
-        self.api = self.longpoll.api
+        self.api = longpoll.api if longpoll else api
         self._handlers = []
 
-    async def process_unread_conversation(self):
+    async def process_unread_conversation(self, prepare=None):
+        """
+        :param prepare: coroutine function called with all unread updates before they are processed
+        """
         updates = []
 
         offset = 0
@@ -63,16 +71,38 @@ class UpdateManager:
             else:
                 offset += 200
 
+        if prepare:
+            await prepare(updates)
         await self._process_updates(updates)
 
     async def _process_updates(self, updates):
         for update in updates:
-            for handler in self._handlers:
-                if update.type in handler.TYPES and await handler.check(update.object):
-                    logger.debug(f'[HandlerCall] ({handler}) for ({update})')
+            with tracing.tracer.trace('update', type=update.type.value) as root:
+                date = getattr(update.object, 'date', None)
+                if date:
+                    # Time spent in VK and in the long poll queue, VK gives it in whole seconds
+                    root.set(age_ms=int((time.time() - date.timestamp()) * 1000))
+
+                await self._process_update(update)
+
+    async def _process_update(self, update):
+        match = tracing.span('handler.match')
+        for handler in self._handlers:
+            if update.type in handler.TYPES and await handler.check(update.object):
+                match.finish(handler=str(handler))
+
+                logger.debug('[HandlerCall] (%s) for (%s)', handler, update)
+                with tracing.span('handler', handler=str(handler)):
                     await handler.start(update)
-                    if handler.final:
-                        break
+                if handler.final:
+                    return
+
+                match = tracing.span('handler.match')
+        match.finish()
+
+    async def process(self, updates):
+        """Processes updates received by somebody else, e.g. by another process"""
+        await self._process_updates(updates)
 
     async def start(self):
         while True: